@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*
+
+"""
+ Advertiser benchmark suite, run against the simulated BLED112.
+
+ Measures start/stop cycle latency, identity switches per second and memory
+ per advertiser / per identity. With --save the results are written as JSON;
+ with --baseline they are compared to a previous run and the script exits
+ with status 1 if one of them regressed by more than --tolerance.
+
+ Example: python3 benchmarks/bench_advertiser.py --latency 0.001 --baseline bench.json
+"""
+
+import os, sys, io, json, time, argparse, contextlib, statistics, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ble.advertiser import BleAdvertiser
+from ble.optionparser import BleParsedArgs
+from ble.rotation import BleIdentityTable, BleRotator
+from ble.simulator import SimulatedBled112
+
+# Whether a larger value of each result is better
+HIGHER_IS_BETTER = {
+    "cycle_full_ms": False,
+    "cycle_incremental_ms": False,
+    "switches_per_s": True,
+    "advertiser_bytes": False,
+    "identity_bytes": False,
+}
+
+
+def params(minor=1):
+    return BleParsedArgs(uuid=list(range(16)), major=1, minor=minor, interval=100, adv_min=90, adv_max=110)
+
+
+def cycle_latency(latency, cycles, force):
+    """Median start+stop time in ms, full resync or state-tracked."""
+    dongle = SimulatedBled112(latency=latency)
+    advertiser = BleAdvertiser(dongle, params())
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(cycles):
+            began = time.perf_counter()
+            advertiser.start(force=force)
+            advertiser.stop()
+            samples.append((time.perf_counter() - began) * 1000)
+    dongle.close()
+    return statistics.median(samples), max(samples)
+
+
+def switch_rate(latency, identities, switches):
+    dongle = SimulatedBled112(latency=latency)
+    advertiser = BleAdvertiser(dongle, params())
+    table = BleIdentityTable()
+    for minor in range(identities):
+        table.add(list(range(16)), 1, minor)
+    rotator = BleRotator(advertiser, table, 0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        advertiser.start()
+    began = time.perf_counter()
+    for _ in range(switches):
+        rotator.switch()
+    rate = switches / (time.perf_counter() - began)
+    dongle.close()
+    return rate
+
+
+def advertiser_memory(count):
+    dongles = [SimulatedBled112() for _ in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    advertisers = [BleAdvertiser(dongle, params(minor)) for minor, dongle in enumerate(dongles)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    for dongle in dongles:
+        dongle.close()
+    del advertisers
+    return size / count
+
+
+def identity_memory(count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    table = BleIdentityTable()
+    for minor in range(count):
+        table.add(list(range(16)), 1, minor & 0xFFFF)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename")) / count
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline or not baseline[name]:
+            continue
+        change = value / baseline[name] - 1
+        if not HIGHER_IS_BETTER[name]:
+            change = -change
+        if change < -tolerance:
+            regressions.append("%s: %.2f -> %.2f (%+.0f%%)" % (name, baseline[name], value, change * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.001, help="Simulated per-command dongle latency in s (default 0.001)")
+    parser.add_argument("--cycles", type=int, default=50, help="Start/stop cycles measured (default 50)")
+    parser.add_argument("--switches", type=int, default=2000, help="Identity switches measured (default 2000)")
+    parser.add_argument("--identities", type=int, default=10000, help="Identities in the rotation table (default 10000)")
+    parser.add_argument("--advertisers", type=int, default=32, help="Advertisers created for the memory figure (default 32)")
+    parser.add_argument("--save", metavar="FILE", help="Write the results to FILE as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare the results to a previous --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression before failing (default 0.25)")
+    args = parser.parse_args()
+
+    full, full_max = cycle_latency(args.latency, args.cycles, True)
+    incremental, incremental_max = cycle_latency(args.latency, args.cycles, False)
+    results = {
+        "cycle_full_ms": full,
+        "cycle_incremental_ms": incremental,
+        "switches_per_s": switch_rate(args.latency, args.identities, args.switches),
+        "advertiser_bytes": advertiser_memory(args.advertisers),
+        "identity_bytes": identity_memory(args.identities),
+    }
+
+    print("Simulated command latency:\t%.3f ms" % (args.latency * 1000))
+    print("Start/stop cycle (full):\t%.2f ms median, %.2f ms max" % (full, full_max))
+    print("Start/stop cycle (tracked):\t%.2f ms median, %.2f ms max" % (incremental, incremental_max))
+    print("Identity switches:\t\t%.0f /s" % results["switches_per_s"])
+    print("Memory per advertiser:\t\t%.0f bytes" % results["advertiser_bytes"])
+    print("Memory per identity:\t\t%.1f bytes" % results["identity_bytes"])
+
+    if args.save:
+        with open(args.save, "w") as resultfile:
+            json.dump(results, resultfile, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baselinefile:
+            regressions = compare(results, json.load(baselinefile), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION %s" % regression)
+        if regressions:
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*
+
+"""
+ Microbenchmark of advertisement payload updates.
+
+ Compares rebuilding the iBeacon list and encoding its gap_set_adv_data
+ frame on every update with patching a compiled BlePayload in place, and
+ reports updates/sec for each.
+
+ Example: python3 benchmarks/bench_payload.py -n 200000
+"""
+
+import os, sys, time, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ble.stack import BleStack
+from ble.advertiser import ibeacon_adv_data
+from ble.payload import BlePayloadCompiler
+
+
+class NullPort(object):
+    """Serial stand-in that drops every written frame."""
+    def write(self, data):
+        return len(data)
+
+
+UUID = list(range(16))
+
+
+def rebuild(port, count):
+    for minor in range(count):
+        BleStack.ble_cmd_gap_set_adv_data(port, 0, ibeacon_adv_data(UUID, 1, minor & 0xFFFF))
+
+
+def patch(port, count):
+    payload = BlePayloadCompiler().flags().ibeacon(UUID).compile()
+    for minor in range(count):
+        payload.set("minor", minor & 0xFFFF)
+        port.write(payload.frame)
+
+
+def tlm(port, count):
+    payload = BlePayloadCompiler().flags().eddystone_tlm(battery=3000, temperature=21.5).compile()
+    for adv_count in range(count):
+        payload.set("adv_count", adv_count)
+        port.write(payload.frame)
+
+
+CASES = [
+    ("iBeacon minor, rebuilt", rebuild),
+    ("iBeacon minor, patched", patch),
+    ("Eddystone-TLM counter, patched", tlm),
+]
+
+
+def rate(case, count):
+    port = NullPort()
+    start = time.perf_counter()
+    case(port, count)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--count", type=int, default=100000, help="Updates per case (default 100000)")
+    args = parser.parse_args()
+
+    print("%-32s %14s" % ("update", "updates/s"))
+    for name, case in CASES:
+        print("%-32s %14.0f" % (name, rate(case, args.count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*
+
+"""
+ Microbenchmark of advertisement report parsing.
+
+ Compares unpacking each gap_scan_response event of a read into Python
+ tuples with parse_scan_reports() gathering all of them into a NumPy
+ structured array, and reports reports/sec for each. One in four reports
+ is not an iBeacon. Reads shorter than BULK_MIN_SIZE bytes, e.g. --chunk
+ 10, are parsed one report at a time by parse_scan_reports() too.
+
+ Example: python3 benchmarks/bench_scanner.py -n 200000
+"""
+
+import os, sys, time, struct, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ble.payload import BlePayloadCompiler
+from ble.scanner import parse_scan_reports
+
+_HEADER = struct.Struct('4B')
+_REPORT = struct.Struct('<bB6sBBB')
+_IBEACON = struct.Struct('>6x16sHHb')
+_IBEACON_PREFIX = bytes((0x1A, 0xFF, 0x4C, 0x00, 0x02, 0x15))
+
+
+def events(count):
+    """Return count gap_scan_response events, as read off the link."""
+    ibeacon = bytes(BlePayloadCompiler().flags().ibeacon(list(range(16))).compile().data)
+    other = bytes(BlePayloadCompiler().flags().local_name("MOB-1443").compile().data)
+    buffer = bytearray()
+    for i in range(count):
+        data = other if i % 4 == 3 else ibeacon
+        payload = _REPORT.pack(-40 - i % 50, 0, bytes((i & 0xFF, 1, 2, 3, 4, 5)), 0, 0xFF, len(data)) + data
+        buffer += _HEADER.pack(0x80, len(payload), 6, 0) + payload
+    return buffer
+
+
+def per_event(buffer, now):
+    reports = []
+    offset = 0
+    while offset < len(buffer):
+        length = buffer[offset + 1]
+        rssi, packet_type, sender, address_type, bond, data_length = _REPORT.unpack_from(buffer, offset + 4)
+        data = offset + 4 + _REPORT.size
+        end = data + data_length
+        # Walk the AD structures up to the iBeacon one, if any
+        while data + _IBEACON.size <= end and buffer[data:data + 6] != _IBEACON_PREFIX and buffer[data]:
+            data += buffer[data] + 1
+        if data + _IBEACON.size <= end and buffer[data:data + 6] == _IBEACON_PREFIX:
+            uuid, major, minor, tx_power = _IBEACON.unpack_from(buffer, data)
+            reports.append((now, sender, address_type, packet_type, rssi, True, uuid, major, minor, tx_power))
+        else:
+            reports.append((now, sender, address_type, packet_type, rssi, False, None, 0, 0, 0))
+        offset += 4 + length
+    return reports
+
+
+def bulk(buffer, now):
+    return parse_scan_reports(buffer, now)[0]
+
+
+CASES = [
+    ("per event, struct", per_event),
+    ("bulk, numpy", bulk),
+]
+
+
+def rate(case, count, chunk):
+    # Reads of chunk reports each, as poll() would get them
+    data = events(chunk)
+    reads = max(count // chunk, 1)
+    start = time.perf_counter()
+    for _ in range(reads):
+        case(data, start)
+    return reads * chunk / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--count", type=int, default=100000, help="Reports per case (default 100000)")
+    parser.add_argument("--chunk", type=int, default=1000, help="Reports per read (default 1000)")
+    args = parser.parse_args()
+
+    print("%-32s %14s" % ("parse", "reports/s"))
+    for name, case in CASES:
+        print("%-32s %14.0f" % (name, rate(case, args.count, args.chunk)))
+
+
+if __name__ == '__main__':
+    main()
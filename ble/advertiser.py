@@ -1,80 +1,93 @@
-from ble.role import BleRole
+from ble.role import BleDongleRole, AsyncBleDongleRole
 from ble.stack import BleStack
 from ble.optionparser import BleParsedArgs
+from ble.payload import BlePayloadCompiler
 
-class BleAdvertiser(BleRole):
-    def __init__(self, connection, params, name=None):
-        super().__init__(connection, params)
-        self._name = name
-        # self._name = name.encode("utf-8").hex()
+MODE_BROADCAST = (0x84, 0x03)
+
+# Local name (scan response packet)
+DEFAULT_NAME = "MOB-1443"
+# DEFAULT_NAME = "PiBeacon"
+
+# Measured power at 1 m (-58 dBm) advertised when none is given
+MEASURED_POWER = 0xC6
+
+def ibeacon_adv_data(uuid, major, minor, measured_power=MEASURED_POWER):
+    """ Build main ad packet"""
+    ibeacon_adv = [ 0x02, 0x01, 0x06, 0x1a, 0xff, 0x4c, 0x00, 0x02, 0x15,
+                    0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
+                    major >> 8, major & 0xFF,
+                    minor >> 8, minor & 0xFF,
+                    measured_power & 0xFF ]
+
+    """ Set UUID specifically"""
+    ibeacon_adv[9:25] = uuid[0:16]
+    return ibeacon_adv
+
+class BleAdvertiserMixin(object):
+    """Advertiser command sequences shared by the blocking and asyncio roles."""
+    def __init__(self, connection, params, name=None, metrics=None):
+        super().__init__(connection, params, metrics)
+        """ Payload advertised instead of the iBeacon of params, if set"""
+        self.payload = None
+        self._ibeacon = BlePayloadCompiler().flags().ibeacon(bytes(16)).compile()
+        self._set_name(name or DEFAULT_NAME)
 
     def _get_name(self):
-        # lname = [ 0x09, 0x09]
-        # lname.extend(BleParsedArgs.toHexArray(self._name))
-        # return lname
         return self._name
 
     def _set_name(self, name):
+        """ Compile the local name (scan response packet), fails if too long"""
+        self._scan_response = BlePayloadCompiler().local_name(name).compile(scan_response=True)
         self._name = name
 
-    def start(self):
-        self.stop()
+    def _queue_start(self, batch, target):
+        """ Queue the commands that bring the dongle from target to advertising;
+            target is updated to the state the dongle will be in"""
+        adv_parameters = (int(self.params.adv_min * 0.625), int(self.params.adv_max * 0.625), 7)
+
+        """ Patch the iBeacon payload with the current params"""
+        payload = self.payload
+        if payload is None:
+            payload = self._ibeacon
+            payload.set("uuid", self.params.uuid)
+            payload.set("major", self.params.major)
+            payload.set("minor", self.params.minor)
+            payload.set("measured_power", getattr(self.params, "power", MEASURED_POWER - 256))
 
-        """ Build main ad packet"""
-        ibeacon_adv = [ 0x02, 0x01, 0x06, 0x1a, 0xff, 0x4c, 0x00, 0x02, 0x15,
-                        0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
-                        self.params.major & 0xFF, self.params.major >> 8,
-                        self.params.minor & 0xFF, self.params.minor >> 8,
-                        0xC6 ]
-                        
-        """ Set UUID specifically"""
-        ibeacon_adv[9:25] = self.params.uuid[0:16]
+        """ Advertising restarts if it is off or its parameters change"""
+        restart = target.mode != MODE_BROADCAST or target.adv_parameters != adv_parameters
+        self._queue_stop(batch, target, restart)
 
         """ Set advertisement (min/max interval + all three ad channels)"""
-        BleStack.ble_cmd_gap_set_adv_parameters(self.serial, int(self.params.adv_min * 0.625), int(self.params.adv_max * 0.625), 7)
-        response = self.serial.read(6) # 6-byte response
-        #for b in response: print '%02X' % ord(b),
-        
+        if target.adv_parameters != adv_parameters:
+            BleStack.ble_cmd_gap_set_adv_parameters(batch, *adv_parameters)
+            target.adv_parameters = adv_parameters
+
         """ Set beacon data (advertisement packet)"""
-        BleStack.ble_cmd_gap_set_adv_data(self.serial, 0, ibeacon_adv)
-        response = self.serial.read(6) # 6-byte response
-        #for b in response: print '%02X' % ord(b),
-        
+        if target.adv_data != payload.data:
+            batch.write(payload.frame)
+            target.adv_data = bytes(payload.data)
+
         """ Set local name (scan response packet)"""
-        # BleStack.ble_cmd_gap_set_adv_data(self.serial, 1, [ 0x09, 0x09, 0x50, 0x69, 0x42, 0x65, 0x61, 0x63, 0x6f, 0x6e ])
-        BleStack.ble_cmd_gap_set_adv_data(self.serial, 1, [0x09, 0x09, 0x4d, 0x4f, 0x42, 0x2d, 0x31, 0x34, 0x34, 0x33])
-        response = self.serial.read(6) # 6-byte response
-        #for b in response: print '%02X' % ord(b),
-
-        """ Start advertising as non-connectable with userdata and enhanced broadcasting"""
-        print ("Entering advertisement mode...")
-        BleStack.ble_cmd_gap_set_mode(self.serial, 0x84, 0x03)
-        response = self.serial.read(6) # 6-byte response
-        #for b in response: print '%02X' % ord(b),
-
-    def stop(self):
-        """Flush the serial buffers"""
-        #print ("Flushing serial I/O buffers...")
-        self.serial.flushInput()
-        self.serial.flushOutput()
-
-        """ Disconnect if we are connected already"""
-        #print ("Disconnecting if connected...")
-        BleStack.ble_cmd_connection_disconnect(self.serial, 0)
-        response = self.serial.read(7) # 7-byte response
-        #for b in response: print ('%02X' % ord(b))
-
-        """ Stop advertising if we are advertising already """
-        #print ("Exiting advertising mode if advertising...")
-        BleStack.ble_cmd_gap_set_mode(self.serial, 0, 0)
-        response = self.serial.read(6) # 6-byte response
-        #for b in response: print '%02X' % ord(b),
-
-        """ Stop scanning if we are scanning already"""
-        #print ("Exiting scanning mode if scanning...")
-        BleStack.ble_cmd_gap_end_procedure(self.serial)
-        response = self.serial.read(6) # 6-byte response
-        #for b in response: print ('%02X' % ord(b))
+        if target.scan_response != self._scan_response.data:
+            batch.write(self._scan_response.frame)
+            target.scan_response = bytes(self._scan_response.data)
+
+        """ Start advertising as non-connectable with userdata and enhanced broadcasting,
+            only once the configuration above has been accepted"""
+        if restart:
+            batch.barrier()
+            BleStack.ble_cmd_gap_set_mode(batch, *MODE_BROADCAST)
+            batch.notices.append("Entering advertisement mode...")
+            target.mode = MODE_BROADCAST
+
     name = property(_get_name, _set_name)
 
 
+class BleAdvertiser(BleAdvertiserMixin, BleDongleRole):
+    pass
+
+
+class AsyncBleAdvertiser(BleAdvertiserMixin, AsyncBleDongleRole):
+    pass
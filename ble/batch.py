@@ -0,0 +1,69 @@
+class BleBatchError(Exception):
+    """A batched command failed or its response never arrived."""
+    def __init__(self, cls, cmd, result):
+        if result is None:
+            message = "No response to BGAPI command (class=%d, id=%d)" % (cls, cmd)
+        else:
+            message = "BGAPI command (class=%d, id=%d) failed with result 0x%04X" % (cls, cmd, result)
+        super().__init__(message)
+        self.cls = cls
+        self.cmd = cmd
+        self.result = result
+
+
+class BleBatch(object):
+    """Pipelined sequence of BGAPI commands.
+
+    The batch stands in for the serial port of the BleStack commands, e.g.
+    ``BleStack.ble_cmd_gap_set_mode(batch, 0, 0)``: frames are only queued.
+    ``execute()`` writes every queued frame in a single write() and then
+    matches the responses to the commands in order.
+
+    Commands queued while ``check`` is False may fail without aborting the
+    batch. ``barrier()`` splits the batch: the commands after it are only
+    written once every command before it has succeeded, so a failed
+    configuration command aborts the rest of the batch.
+
+    ``notices`` are messages for the user that only hold once the batch
+    has succeeded; the role prints them after ``execute()``.
+    """
+    def __init__(self, connection, reader):
+        self.serial = connection
+        self.reader = reader
+        self.check = True
+        self.notices = []
+        self._segments = [(bytearray(), [])]
+
+    def write(self, frame):
+        if frame[2] == 0 and frame[3] == 0:
+            raise ValueError("system_reset has no response and cannot be batched")
+        frames, commands = self._segments[-1]
+        frames += frame
+        commands.append((frame[2], frame[3], self.check))
+        return len(frame)
+
+    def barrier(self):
+        if self._segments[-1][1]:
+            self._segments.append((bytearray(), []))
+
+    def __len__(self):
+        return sum(len(commands) for frames, commands in self._segments)
+
+    def execute(self):
+        """Send the batch, raises BleBatchError on the first failed command."""
+        for frames, commands in self._segments:
+            if not commands:
+                continue
+            self.serial.write(frames)
+            if self.reader.metrics is not None:
+                self.reader.metrics.sent(frames, [check for cls, cmd, check in commands])
+            failure = None
+            for cls, cmd, check in commands:
+                result = self.reader.read_response(cls, cmd)
+                if result is None:
+                    raise BleBatchError(cls, cmd, result)
+                # Keep reading so the link stays in sync with the dongle
+                if failure is None and check and result != 0:
+                    failure = BleBatchError(cls, cmd, result)
+            if failure is not None:
+                raise failure
@@ -0,0 +1,382 @@
+import array, bisect, csv, datetime, json, math, time
+
+from ble.optionparser import BleParsedArgs
+from ble.rotation import BleIdentityTable
+
+"""
+ Campaign files list time-windowed beacon entries, one per CSV row or JSON
+ object. start and end are epoch seconds or ISO 8601 local times; an entry
+ with a period (s) recurs for duration seconds every period from its start,
+ until its end if any. Every key but uuid falls back to the command line.
+
+    uuid,major,minor,interval,start,end,period,duration
+    # Opening hours, then a 10 minute burst every hour
+    504f4c45-5354-4152-4d4f-422d31343433,0001,0001,100,2026-10-19T09:00:00,2026-10-19T18:00:00,,
+    504f4c45-5354-4152-4d4f-422d31343433,0001,0002,200,2026-10-19T00:00:00,,3600,600
+
+    [
+        {"uuid": "504f4c45-5354-4152-4d4f-422d31343433", "minor": "0001", "start": 1792400400, "end": 1792432800},
+        {"uuid": "504f4c45-5354-4152-4d4f-422d31343433", "minor": "0002", "start": "2026-10-19T00:00:00", "period": 3600, "duration": 600}
+    ]
+
+ The CSV header line comes first, lines whose uuid starts with # are
+ skipped. JSON files may also hold one object per line. Both formats are
+ read as a stream, so a file is never held in memory whole.
+"""
+
+# Errors reported by a failed load, the others are only counted
+MAX_REPORTED_ERRORS = 10
+
+
+def _parse_time(value):
+    """Return epoch seconds from a number or an ISO 8601 string."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError("Invalid time '%s', must be epoch seconds or ISO 8601" % value)
+
+
+def _iter_json(jsonfile, chunk_size=65536):
+    """Yield the objects of a JSON array, or of JSON lines, read by chunks."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    offset = 0
+    eof = False
+    in_array = None
+    while True:
+        # Skip separators, the array brackets and blank lines
+        while offset < len(buffer) and buffer[offset] in " \t\r\n,":
+            offset += 1
+        if offset < len(buffer):
+            if in_array is None:
+                in_array = buffer[offset] == "["
+                if in_array:
+                    offset += 1
+                    continue
+            if in_array and buffer[offset] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, offset)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number may have been cut by the chunk boundary
+                if end < len(buffer) or eof:
+                    offset = end
+                    yield record
+                    continue
+        elif eof:
+            if in_array:
+                raise ValueError("Unterminated JSON array")
+            return
+        chunk = jsonfile.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[offset:] + chunk
+        offset = 0
+
+
+class BleIntervalIndex(object):
+    """Static index of [start, end) intervals answering stabbing queries.
+
+    Intervals are sorted by start, so those starting before t are a prefix
+    found by bisection; a max-tree over their ends then visits only the
+    branches holding an interval still open at t. A query costs
+    O(log n + k log n) for k matches, with four machine words per interval.
+    """
+    def __init__(self):
+        self.starts = array.array('d')
+        self.ends = array.array('d')
+        self.ids = array.array('l')
+        self._tree = None
+        self._size = 0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start, end, id):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.ids.append(id)
+        self._tree = None
+
+    def build(self):
+        """Sort the intervals and build the tree, once every one was added."""
+        order = sorted(range(len(self.starts)), key=self.starts.__getitem__)
+        self.starts = array.array('d', (self.starts[i] for i in order))
+        self.ends = array.array('d', (self.ends[i] for i in order))
+        self.ids = array.array('l', (self.ids[i] for i in order))
+        size = 1
+        while size < len(order):
+            size <<= 1
+        tree = array.array('d', [-math.inf]) * (2 * size)
+        tree[size:size + len(order)] = self.ends
+        for node in range(size - 1, 0, -1):
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+        self._tree = tree
+        self._size = size
+
+    def stab(self, t):
+        """Yield (id, end) of every interval holding t."""
+        if self._tree is None:
+            self.build()
+        count = bisect.bisect_right(self.starts, t)
+        if not count:
+            return
+        tree, size = self._tree, self._size
+        stack = [(1, 0, size)]
+        while stack:
+            node, low, high = stack.pop()
+            if low >= count or tree[node] <= t:
+                continue
+            if node >= size:
+                yield self.ids[low], self.ends[low]
+                continue
+            middle = (low + high) // 2
+            stack.append((2 * node + 1, middle, high))
+            stack.append((2 * node, low, middle))
+
+    def next_start(self, t):
+        """Return the first interval start after t, or None."""
+        if self._tree is None:
+            self.build()
+        index = bisect.bisect_right(self.starts, t)
+        return self.starts[index] if index < len(self.starts) else None
+
+
+class BleCampaign(object):
+    """Timeline of beacon entries, indexed by time.
+
+    Identities are kept as ready-to-send frames in a BleIdentityTable and
+    the other fields in typed arrays, in file order, which is also the
+    precedence order when entries overlap. One-off entries go in one
+    BleIntervalIndex. Every recurring entry is indexed once, whatever its
+    number of occurrences, in one index per period over its window modulo
+    the period; its start and end are checked at query time.
+    """
+    def __init__(self):
+        self.table = BleIdentityTable()
+        self.intervals = array.array('H')
+        self.starts = array.array('d')
+        self.ends = array.array('d')
+        self.periods = array.array('d')
+        self.durations = array.array('d')
+        self._once = BleIntervalIndex()
+        self._recurring = {}
+        self._bounds = None
+        self._recurring_edges = None
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def add(self, uuid, major, minor, interval, start, end=math.inf, period=None, duration=None):
+        """Append an entry, returns its index."""
+        if end <= start:
+            raise ValueError("Entry ends before it starts")
+        if period is not None and not 0 < duration < period:
+            raise ValueError("Invalid recurrence, the duration must be shorter than the period")
+        index = len(self.intervals)
+        self.table.add(uuid, major, minor)
+        self.intervals.append(interval)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.periods.append(period or 0.0)
+        self.durations.append(duration or 0.0)
+        if period is None:
+            self._once.add(start, end, index)
+            return index
+        self._bounds = self._recurring_edges = None
+        recurring = self._recurring.get(period)
+        if recurring is None:
+            recurring = self._recurring[period] = BleIntervalIndex()
+        offset = start % period
+        if offset + duration <= period:
+            recurring.add(offset, offset + duration, index)
+        else:
+            recurring.add(offset, period, index)
+            recurring.add(0.0, offset + duration - period, index)
+        return index
+
+    def build(self):
+        """Build the indexes, once every entry was added."""
+        self._once.build()
+        for recurring in self._recurring.values():
+            recurring.build()
+        self._build_bounds()
+
+    def entry(self, index):
+        """Return (uuid, major, minor, interval) of an entry."""
+        uuid, major, minor, tx_power = self.table.identity(index)
+        return uuid, major, minor, self.intervals[index]
+
+    def active(self, t):
+        """Return the indexes of the entries advertising at t, in file order."""
+        indexes = [index for index, end in self._once.stab(t)]
+        for period, recurring in self._recurring.items():
+            for index, end in recurring.stab(t % period):
+                if self.starts[index] <= t < self.ends[index]:
+                    indexes.append(index)
+        indexes.sort()
+        return indexes
+
+    def current(self, t):
+        """Return the index of the entry to advertise at t, or None."""
+        indexes = self.active(t)
+        return indexes[0] if indexes else None
+
+    def next_change(self, t):
+        """Return the first time after t the active entries may change, or None."""
+        candidates = [self._once.next_start(t)]
+        candidates.extend(end for index, end in self._once.stab(t))
+        if self._bounds is None:
+            self._build_bounds()
+        edges = self._recurring_edges
+        position = bisect.bisect_right(edges, t)
+        if position < len(edges):
+            candidates.append(edges[position])
+        # The next phase at which an entry valid at t starts or stops; the
+        # entries outside their [start, end) until then are skipped
+        starts, ends = self.starts, self.ends
+        for period, (phases, ids) in self._bounds.items():
+            phase = t % period
+            position = bisect.bisect_right(phases, phase)
+            for step in range(len(phases)):
+                bound = position + step
+                if bound >= len(phases):
+                    bound -= len(phases)
+                index = ids[bound]
+                if starts[index] <= t < ends[index]:
+                    candidates.append(t - phase + phases[bound] + (period if bound < position else 0))
+                    break
+        candidates = [candidate for candidate in candidates if candidate is not None and candidate != math.inf]
+        return min(candidates) if candidates else None
+
+    def _build_bounds(self):
+        """Sort the start and end phases of the recurring entries, per period,
+        and the starts and ends of their windows."""
+        bounds = {}
+        for index, period in enumerate(self.periods):
+            if period:
+                offset = self.starts[index] % period
+                bounds.setdefault(period, []).extend(((offset, index), ((offset + self.durations[index]) % period, index)))
+        self._bounds = {}
+        for period, phases in bounds.items():
+            phases.sort()
+            self._bounds[period] = (array.array('d', (phase for phase, index in phases)), array.array('l', (index for phase, index in phases)))
+        self._recurring_edges = array.array('d', sorted(edge for index, period in enumerate(self.periods) if period
+            for edge in (self.starts[index], self.ends[index])))
+
+    @staticmethod
+    def load(filepath, defaults):
+        """Stream a CSV or JSON campaign file into a campaign.
+
+        Entries are validated as the command line is; every invalid entry is
+        counted and the first ones reported in the raised ValueError.
+        """
+        campaign = BleCampaign()
+        errors = []
+        count = 0
+        with open(filepath, newline='') as campaign_file:
+            if str(filepath).lower().endswith((".json", ".jsonl")):
+                records = enumerate(_iter_json(campaign_file), 1)
+            else:
+                rows = csv.DictReader(campaign_file)
+                records = ((rows.line_num, row) for row in rows if any(row.values()) and not (row.get("uuid") or "").startswith("#"))
+            for line, record in records:
+                try:
+                    BleCampaign._add_record(campaign, record, defaults)
+                except (ValueError, TypeError, KeyError) as e:
+                    count += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append("%s:%d: %s" % (filepath, line, e))
+        if count:
+            raise ValueError("%d invalid campaign entries\n\t%s" % (count, "\n\t".join(errors)))
+        campaign.build()
+        return campaign
+
+    @staticmethod
+    def _add_record(campaign, record, defaults):
+        record = dict((key.strip().lower(), value) for key, value in record.items()
+            if key is not None and value is not None and value != "")
+        uuid = BleParsedArgs.parseUuid(record["uuid"])
+        major = BleParsedArgs.parseWord(record["major"], "major", "-j") if "major" in record else defaults.major
+        minor = BleParsedArgs.parseWord(record["minor"], "minor", "-n") if "minor" in record else defaults.minor
+        interval = int(record.get("interval", defaults.interval))
+        BleParsedArgs.parseInterval(interval)
+        start = _parse_time(record["start"]) if "start" in record else 0.0
+        end = _parse_time(record["end"]) if "end" in record else math.inf
+        period = float(record["period"]) if "period" in record else None
+        duration = float(record["duration"]) if "duration" in record else None
+        if period is not None and duration is None:
+            raise ValueError("A recurring entry needs a duration")
+        campaign.add(uuid, major, minor, interval, start, end, period, duration)
+
+
+class BleCampaignRunner(object):
+    """Advertise whatever a campaign schedules, as time goes.
+
+    The current entry is applied through the advertiser's state tracking,
+    so switching from one entry to the next only sends what differs. The
+    runner then sleeps in the BleScheduler until the next possible change.
+    """
+    def __init__(self, advertiser, campaign, scheduler, eventlog=None, quiet=False):
+        self.advertiser = advertiser
+        self.campaign = campaign
+        self.scheduler = scheduler
+        self.eventlog = eventlog
+        self.quiet = quiet
+        self.index = None
+        self._applied = False
+        self._next = None
+
+    def begin(self):
+        self.step()
+
+    def cancel(self):
+        if self._next is not None:
+            self._next.cancel()
+            self._next = None
+
+    def restore(self):
+        """Apply the entry of now again after a link failure, and schedule
+        the next step, lost if the failure happened during a step."""
+        self.cancel()
+        self.step(force=True)
+
+    def step(self, force=False):
+        """Apply the entry of now and schedule the next step."""
+        now = time.time()
+        index = self.campaign.current(now)
+        if force or index != self.index or not self._applied:
+            self._apply(index, force)
+        change = self.campaign.next_change(now)
+        self._next = None
+        if change is not None:
+            self._next = self.scheduler.at(time.monotonic() + change - time.time(), self.step)
+
+    def _apply(self, index, force=False):
+        params = self.advertiser.params
+        if index is None:
+            self.advertiser.stop(force)
+            status = "Stop"
+        else:
+            params.uuid, params.major, params.minor, params.interval = self.campaign.entry(index)
+            params.adv_min, params.adv_max = BleParsedArgs.parseInterval(params.interval)
+            self.advertiser.start(force)
+            status = "Start"
+        if self.eventlog is not None and (index is None) != (self.index is None):
+            self.eventlog.write(status)
+        self.index = index
+        self._applied = True
+        if not self.quiet:
+            if index is None:
+                print(f"<- [{datetime.datetime.now()}] No campaign entry, advertisements stopped")
+            else:
+                print(f"-> [{datetime.datetime.now()}] Campaign entry {index + 1}: {params.major:04X}/{params.minor:04X}, {params.interval} ms")
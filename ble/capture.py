@@ -0,0 +1,251 @@
+import argparse, collections, mmap, struct, sys, time
+
+from ble.reader import BgapiReader, HEADER_SIZE, is_header, payload_length, result_code
+from ble.stack import COMMAND_NAMES
+from ble.metrics import BleMetrics
+
+"""
+ Capture file: a 16-byte header, magic + version + reserved byte + capture
+ start in epoch seconds, then records of a 12-byte header, seconds since
+ the capture start, direction and length, followed by the bytes as they
+ went over the wire, zero-padded to a multiple of 4 bytes. Records are
+ read in place through mmap, without parsing the whole file first.
+
+ Example: python3 -m ble.capture dump resources/trace.bin
+          python3 -m ble.capture replay resources/trace.bin --speed 10
+"""
+
+CAPTURE_MAGIC = b"BLECAP\x01"
+CAPTURE_HEADER = struct.Struct('<7sxd')
+CAPTURE_RECORD = struct.Struct('<dBxH')
+
+# Directions, as seen from the host
+TX, RX = 0, 1
+DIRECTIONS = ("tx", "rx")
+
+_PADDING = bytes(3)
+
+
+class BleCapture(object):
+    """Append-only binary trace of the bytes written to and read from a dongle.
+
+    Records are assembled in the file buffer, so a capture costs one
+    struct.pack and no system call per serial call. The buffer is written
+    out when full, at the first record flush_interval seconds after the
+    last flush, and on close(): a crash only loses the records since the
+    last flush. An existing file is never overwritten, FileExistsError is
+    raised instead.
+    """
+    def __init__(self, filepath, buffering=65536, flush_interval=1.0):
+        self.filepath = filepath
+        self.flush_interval = flush_interval
+        self._file = open(filepath, 'xb', buffering=buffering)
+        self._file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, time.time()))
+        self._start = time.perf_counter()
+        self._flush_at = self._start + flush_interval
+
+    def record(self, direction, data):
+        now = time.perf_counter()
+        length = len(data)
+        self._file.write(CAPTURE_RECORD.pack(now - self._start, direction, length))
+        self._file.write(data)
+        if length & 3:
+            self._file.write(_PADDING[:4 - (length & 3)])
+        if now >= self._flush_at:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        self._flush_at = time.perf_counter() + self.flush_interval
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class BleCaptureTap(object):
+    """Serial connection stand-in recording every write() and read() to a BleCapture.
+
+    Everything else, attributes included, is passed through to the wrapped
+    connection, so the tap can be given to any role, reader or transport.
+    """
+    def __init__(self, connection, capture):
+        object.__setattr__(self, "serial", connection)
+        object.__setattr__(self, "capture", capture)
+
+    def write(self, data):
+        written = self.serial.write(data)
+        self.capture.record(TX, data)
+        return written
+
+    def read(self, size=1):
+        data = self.serial.read(size)
+        if data:
+            self.capture.record(RX, data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.serial, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.serial, name, value)
+
+
+def read_capture(filepath):
+    """Return (start epoch, records): records yields (seconds, direction, data)
+    with data a memoryview of the mapped file."""
+    with open(filepath, 'rb') as capture_file:
+        mapped = mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic, started = CAPTURE_HEADER.unpack_from(view)
+    if magic != CAPTURE_MAGIC:
+        raise ValueError("%s is not a capture file" % filepath)
+
+    def records():
+        offset = CAPTURE_HEADER.size
+        end = len(view)
+        while offset + CAPTURE_RECORD.size <= end:
+            seconds, direction, length = CAPTURE_RECORD.unpack_from(view, offset)
+            offset += CAPTURE_RECORD.size
+            if offset + length > end:
+                return
+            yield seconds, direction, view[offset:offset + length]
+            offset += (length + 3) & ~3
+    return started, records()
+
+
+def capture_frames(records):
+    """Reassemble BGAPI packets from captured chunks, per direction.
+
+    Yields (seconds, direction, packet) with the time of the chunk that
+    completed the packet.
+    """
+    buffers = (bytearray(), bytearray())
+    for seconds, direction, data in records:
+        buffer = buffers[direction]
+        buffer += data
+        while buffer:
+            if not is_header(buffer[0]):
+                del buffer[0]
+                continue
+            if len(buffer) < HEADER_SIZE:
+                break
+            size = HEADER_SIZE + payload_length(buffer)
+            if len(buffer) < size:
+                break
+            yield seconds, direction, bytes(buffer[:size])
+            del buffer[:size]
+
+
+def capture_commands(records):
+    """Pair every captured command with its captured response.
+
+    Yields (seconds, command, response) in command order, response being
+    None if the capture has none. Responses come in command order: one
+    answering a later command means the earlier ones went unanswered.
+    """
+    pending = collections.deque()
+    for seconds, direction, packet in capture_frames(records):
+        if direction == TX:
+            pending.append((seconds, packet))
+            continue
+        if packet[0] & 0x80:
+            continue
+        # A response to no pending command, e.g. from before the capture
+        if not any(command[2] == packet[2] and command[3] == packet[3] for sent, command in pending):
+            continue
+        while pending:
+            sent, command = pending.popleft()
+            if command[2] == packet[2] and command[3] == packet[3]:
+                yield sent, command, packet
+                break
+            yield sent, command, None
+    for sent, command in pending:
+        yield sent, command, None
+
+
+def _describe(direction, packet):
+    kind = "cmd" if direction == TX else "evt" if packet[0] & 0x80 else "rsp"
+    name = COMMAND_NAMES.get((packet[2], packet[3]), "%d_%d" % (packet[2], packet[3]))
+    return "%s %-24s %s" % (kind, name, packet[4:].hex())
+
+
+def dump(filepath, out=sys.stdout):
+    started, records = read_capture(filepath)
+    for seconds, direction, packet in capture_frames(records):
+        out.write("%12.6f %s %s\n" % (seconds, DIRECTIONS[direction], _describe(direction, packet)))
+
+
+def replay(filepath, connection, speed=1.0, metrics=None):
+    """Send the captured commands to connection again and check the responses.
+
+    Commands are written at their original pace divided by speed, or back
+    to back if speed is 0, and each response is read before the next
+    command. Returns (commands, mismatches, seconds, divergence),
+    mismatches counting the commands whose result, or missing response,
+    differs from the captured one, and divergence being None or the first
+    of them as (command number, captured seconds, name, captured result,
+    replayed result), a missing response having result None.
+    """
+    started, records = read_capture(filepath)
+    reader = BgapiReader(connection, metrics=metrics)
+    commands = mismatches = 0
+    divergence = None
+    began = time.perf_counter()
+    for seconds, packet, response in capture_commands(records):
+        if speed:
+            delay = began + seconds / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        cls, cmd = packet[2], packet[3]
+        connection.write(packet)
+        if metrics is not None:
+            metrics.sent(packet)
+        commands += 1
+        if (cls, cmd) == (0, 0):
+            continue
+        result = reader.read_response(cls, cmd)
+        captured = None if response is None else result_code(cls, cmd, response[4:])
+        if result != captured:
+            mismatches += 1
+            if divergence is None:
+                divergence = (commands, seconds, COMMAND_NAMES.get((cls, cmd), "%d_%d" % (cls, cmd)), captured, result)
+    return commands, mismatches, time.perf_counter() - began, divergence
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay a BGAPI capture file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    dump_parser = subparsers.add_parser("dump", help="Print the captured packets")
+    dump_parser.add_argument("capture")
+    replay_parser = subparsers.add_parser("replay", help="Send the captured commands again")
+    replay_parser.add_argument("capture")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="Pace divisor, 0 for back to back (default 1, original pace)")
+    replay_parser.add_argument("--port", help="Serial port of a dongle (default: a simulated BLED112)")
+    replay_parser.add_argument("--baud", type=int, default=115200)
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        dump(args.capture)
+        return
+    if args.port:
+        import serial
+        connection = serial.Serial(port=args.port, baudrate=args.baud, timeout=1)
+    else:
+        from ble.simulator import SimulatedBled112
+        connection = SimulatedBled112()
+    metrics = BleMetrics(port=args.port or "simulated")
+    commands, mismatches, seconds, divergence = replay(args.capture, connection, args.speed, metrics)
+    print("Replayed %d commands in %.3f s, %d results differ from the capture" % (commands, seconds, mismatches))
+    if divergence is not None:
+        number, at, name, captured, result = divergence
+        print("First difference at command %d, %s at %.6f s: captured %s, replayed %s" % (
+            number, name, at, "no response" if captured is None else captured, "no response" if result is None else result))
+    for line in metrics.render():
+        if line.startswith(("ble_command_latency_seconds_sum", "ble_command_latency_seconds_count", "ble_command_errors", "ble_command_timeouts")):
+            print(line)
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import errno, json, os, select, socket, stat, sys
+
+from ble.optionparser import BleParsedArgs
+from ble.link import LINK_ERRORS
+from ble.state import BleDongleState
+
+"""
+ Control protocol: one JSON object per line, answered by one JSON line.
+
+    {"cmd": "status"}
+    {"cmd": "set_identity", "uuid": "504f4c45-5354-4152-4d4f-422d31343433", "major": "0001", "minor": "0002"}
+    {"cmd": "set_interval", "interval": 200}
+    {"cmd": "set_duty_cycle", "duration": 30, "period": 120}
+    {"cmd": "pause"}
+    {"cmd": "resume"}
+
+ Example: python3 -m ble.daemon /run/bleadvertiser.sock set_identity minor=0002
+"""
+
+
+def _jsonable(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, tuple):
+        return [_jsonable(item) for item in value]
+    return value
+
+
+class BleControlServer(object):
+    """Local control socket of a long-running advertiser.
+
+    Commands change the BleDutyCycle params in place: the advertiser's state
+    tracking then sends only the BGAPI commands the change requires, without
+    reopening the port or restarting the process. ``poll()`` is meant to be
+    the idle hook of the BleScheduler driving the duty cycle; a link error
+    raised by a command is answered, then raised again for the
+    BleLinkSupervisor to resync the dongle. The socket is only accessible
+    to its owner; a stale one is replaced, but OSError is raised if another
+    daemon still listens on it.
+    """
+    def __init__(self, path, duty_cycle):
+        self.path = path
+        self.duty_cycle = duty_cycle
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            self._unlink_stale(path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        """ Create the socket file as 0600, the commands are not authenticated"""
+        umask = os.umask(0o177)
+        try:
+            self._server.bind(path)
+        except OSError:
+            self._server.close()
+            raise
+        finally:
+            os.umask(umask)
+        self._server.listen(8)
+        self._server.setblocking(False)
+        self._clients = {}
+
+    @staticmethod
+    def _unlink_stale(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, "Another daemon is listening on %s" % path)
+
+    def close(self):
+        for client in list(self._clients):
+            client.close()
+        self._clients.clear()
+        self._server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def poll(self, timeout, link=None, on_link=None):
+        """Wait up to timeout for commands, or for link to be readable."""
+        readers = [self._server]
+        readers.extend(self._clients)
+        if link is not None:
+            readers.append(link)
+        for reader in select.select(readers, [], [], timeout)[0]:
+            if reader is self._server:
+                client, address = self._server.accept()
+                client.setblocking(False)
+                self._clients[client] = bytearray()
+            elif reader is link:
+                on_link()
+            else:
+                self._receive(reader)
+
+    def _receive(self, client):
+        try:
+            data = client.recv(4096)
+        except OSError:
+            data = b""
+        if not data:
+            client.close()
+            del self._clients[client]
+            return
+        buffer = self._clients[client]
+        buffer += data
+        while b"\n" in buffer:
+            line, _, rest = bytes(buffer).partition(b"\n")
+            buffer[:] = rest
+            if line.strip():
+                try:
+                    response = self.handle(line)
+                except LINK_ERRORS as e:
+                    self._reply(client, {"ok": False, "error": str(e)})
+                    raise
+                self._reply(client, response)
+
+    @staticmethod
+    def _reply(client, response):
+        try:
+            client.sendall(json.dumps(response).encode("utf-8") + b"\n")
+        except OSError:
+            pass
+
+    def handle(self, line):
+        """Run one JSON command line, returns the response object."""
+        try:
+            request = json.loads(line)
+            command = request.get("cmd")
+            handler = getattr(self, "_cmd_%s" % command, None)
+            if handler is None:
+                raise ValueError("Unknown command '%s'" % command)
+            response = handler(request)
+        except (ValueError, TypeError, AttributeError) as e:
+            return {"ok": False, "error": str(e)}
+        response["ok"] = True
+        return response
+
+    def _cmd_status(self, request):
+        duty_cycle = self.duty_cycle
+        params = duty_cycle.params
+        return {
+            "uuid": "".join("%02X" % b for b in params.uuid),
+            "major": "%04X" % params.major,
+            "minor": "%04X" % params.minor,
+            "interval": params.interval,
+            "duration": params.duration,
+            "period": params.period,
+            "paused": duty_cycle.schedule is None,
+            "advertising": duty_cycle.advertising,
+            "cycles": duty_cycle.schedule.cycles if duty_cycle.schedule is not None else None,
+            "dongle": dict((field, _jsonable(getattr(duty_cycle.advertiser.state, field))) for field in BleDongleState.FIELDS),
+        }
+
+    def _cmd_set_identity(self, request):
+        params = self.duty_cycle.params
+        uuid = BleParsedArgs.parseUuid(request["uuid"]) if "uuid" in request else params.uuid
+        major = BleParsedArgs.parseWord(request["major"], "major", "major=") if "major" in request else params.major
+        minor = BleParsedArgs.parseWord(request["minor"], "minor", "minor=") if "minor" in request else params.minor
+        params.uuid, params.major, params.minor = uuid, major, minor
+        self.duty_cycle.apply()
+        return self._cmd_status(request)
+
+    def _cmd_set_interval(self, request):
+        params = self.duty_cycle.params
+        interval = int(request["interval"])
+        params.adv_min, params.adv_max = BleParsedArgs.parseInterval(interval)
+        params.interval = interval
+        self.duty_cycle.apply()
+        return self._cmd_status(request)
+
+    def _cmd_set_duty_cycle(self, request):
+        params = self.duty_cycle.params
+        duration = float(request.get("duration", params.duration))
+        period = float(request.get("period", params.period))
+        params.duration, params.period = BleParsedArgs.parseDutyCycle(duration, period)
+        self.duty_cycle.reschedule()
+        return self._cmd_status(request)
+
+    def _cmd_pause(self, request):
+        self.duty_cycle.pause()
+        return self._cmd_status(request)
+
+    def _cmd_resume(self, request):
+        self.duty_cycle.resume()
+        return self._cmd_status(request)
+
+
+def send_command(path, command, **arguments):
+    """Send one command to a control socket, returns the response object."""
+    request = dict(arguments, cmd=command)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        response = bytearray()
+        while not response.endswith(b"\n"):
+            data = client.recv(4096)
+            if not data:
+                break
+            response += data
+    return json.loads(response)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python3 -m ble.daemon SOCKET COMMAND [key=value ...]")
+        exit(1)
+    arguments = dict(argument.split("=", 1) for argument in sys.argv[3:])
+    response = send_command(sys.argv[1], sys.argv[2], **arguments)
+    print(json.dumps(response, indent=2))
+    exit(0 if response.get("ok") else 1)
@@ -0,0 +1,97 @@
+import datetime
+
+
+class BleDutyCycle(object):
+    """Advertise for params.duration seconds every params.period seconds.
+
+    The start and stop edges are run by a BleScheduler; a duration of the
+    whole period has no stop edge, advertising never stops. While
+    advertising, an optional rotator switches identity every rotator.dwell
+    seconds through its own schedule. Edges are written to an optional
+    event log.
+    """
+    def __init__(self, advertiser, scheduler, eventlog=None, rotator=None, quiet=False):
+        self.advertiser = advertiser
+        self.scheduler = scheduler
+        self.eventlog = eventlog
+        self.rotator = rotator
+        self.quiet = quiet
+        self.schedule = None
+        self.advertising = False
+        self._rotation = None
+
+    @property
+    def params(self):
+        return self.advertiser.params
+
+    def begin(self, start_at=None):
+        """Schedule the duty cycle, first start at start_at (default now)."""
+        duration = self.params.duration if self.params.duration < self.params.period else None
+        self.schedule = self.scheduler.every(self.params.period, self.start, duration, self.stop, start_at)
+
+    def cancel(self):
+        """Unschedule the duty cycle, leaving the advertiser as it is."""
+        if self.schedule is not None:
+            self.schedule.cancel()
+            self.schedule = None
+
+    def pause(self):
+        """Stop advertising until resume()."""
+        self.cancel()
+        if self.advertising:
+            self.stop()
+
+    def resume(self):
+        if self.schedule is None:
+            self.begin()
+
+    def reschedule(self):
+        """Apply a new params.duration/period, starting a new cycle now."""
+        if self.schedule is not None:
+            self.cancel()
+            self.begin()
+
+    def apply(self):
+        """Apply new advertising params in place if advertising."""
+        if self.advertising:
+            self.advertiser.start()
+
+    def restore(self):
+        """Resend the last requested edge after a link failure.
+
+        An edge that failed half-way is completed, so ``advertising``, the
+        rotation and the event log match the dongle again.
+        """
+        if self.advertiser.desired == "start":
+            self.start(force=True)
+        elif self.advertising:
+            self.stop(force=True)
+        elif self.advertiser.desired == "stop":
+            self.advertiser.stop(force=True)
+        else:
+            self.advertiser.state.invalidate()
+
+    def start(self, force=False):
+        if self.advertiser.metrics is not None and self.schedule is not None and not force:
+            self.advertiser.metrics.cycle_started(self.params.period, self.schedule.scheduled)
+        self.advertiser.start(force)
+        if self.advertising:
+            return
+        self.advertising = True
+        if self.eventlog is not None:
+            self.eventlog.write("Start")
+        if not self.quiet:
+            print(f"-> [{datetime.datetime.now()}] iBeacon advertisements started")
+        if self.rotator is not None:
+            self._rotation = self.scheduler.every(self.rotator.dwell, self.rotator.switch)
+
+    def stop(self, force=False):
+        if self._rotation is not None:
+            self._rotation.cancel()
+            self._rotation = None
+        self.advertiser.stop(force)
+        self.advertising = False
+        if self.eventlog is not None:
+            self.eventlog.write("Stop")
+        if not self.quiet:
+            print(f"<- [{datetime.datetime.now()}] iBeacon advertisements stopped")
@@ -0,0 +1,138 @@
+import csv, datetime, os, struct, sys, threading
+from pathlib import Path
+
+# Statuses of the compact binary format, stored as their index
+STATUSES = ("Start", "Stop")
+
+# Binary log: 4-byte magic + version, then (epoch seconds, status index) records
+BINARY_MAGIC = b"BLEL\x01"
+BINARY_RECORD = struct.Struct('<dB')
+
+
+class BleEventLog(object):
+    """Buffered, append-only event log written by a background thread.
+
+    write() only appends the event to an in-memory batch. The batch is
+    written when it reaches ``flush_size`` events or ``flush_interval``
+    seconds after the previous write, so the advertising path never waits on
+    the storage. The log is appended to, never truncated: the CSV header is
+    only written to a new file. With ``rotate`` set to a size in bytes or to
+    "daily", the current file is renamed with a date suffix once it is full
+    or from a previous day. Appending to a file written in the other format
+    raises ValueError.
+    """
+    def __init__(self, filepath, fmt="csv", flush_size=64, flush_interval=5.0, rotate=None, fsync=True):
+        if fmt not in ("csv", "binary"):
+            raise ValueError("Unknown log format '%s', must be csv or binary" % fmt)
+        self.filepath = Path(filepath)
+        self.fmt = fmt
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.rotate = rotate
+        self.fsync = fsync
+        self._check_format()
+        self._pending = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="BleEventLog", daemon=True)
+        self._thread.start()
+
+    def write(self, status):
+        """Log an event now, without touching the file."""
+        record = (datetime.datetime.now(), status)
+        with self._cond:
+            self._pending.append(record)
+            if len(self._pending) >= self.flush_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Ask the writer to write the pending events right away."""
+        with self._cond:
+            self._cond.notify()
+
+    def close(self):
+        """Write the pending events and stop the writer."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+                records, self._pending = self._pending, []
+                closed = self._closed
+            if records:
+                try:
+                    self._write(records)
+                except OSError as e:
+                    print("Event log error (name='%s'): %s" % (self.filepath, e), file=sys.stderr)
+            if closed:
+                return
+
+    def _write(self, records):
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        self._rotate(records[0][0])
+        new = not self.filepath.exists() or self.filepath.stat().st_size == 0
+        if self.fmt == "csv":
+            with open(self.filepath, 'a', newline='') as logfile:
+                writer = csv.writer(logfile)
+                if new:
+                    writer.writerow(["Date", "Status"])
+                writer.writerows(records)
+                self._sync(logfile)
+        else:
+            with open(self.filepath, 'ab') as logfile:
+                if new:
+                    logfile.write(BINARY_MAGIC)
+                logfile.write(b"".join(BINARY_RECORD.pack(date.timestamp(), STATUSES.index(status)) for date, status in records))
+                self._sync(logfile)
+
+    def _check_format(self):
+        try:
+            with open(self.filepath, 'rb') as logfile:
+                head = logfile.read(len(BINARY_MAGIC))
+        except FileNotFoundError:
+            return
+        if head and (head == BINARY_MAGIC) != (self.fmt == "binary"):
+            raise ValueError("%s is not a %s event log, refusing to append to it" % (self.filepath, self.fmt))
+
+    def _sync(self, logfile):
+        if self.fsync:
+            logfile.flush()
+            os.fsync(logfile.fileno())
+
+    def _rotate(self, now):
+        if not self.rotate or not self.filepath.exists():
+            return
+        stat = self.filepath.stat()
+        if self.rotate == "daily":
+            started = datetime.datetime.fromtimestamp(stat.st_mtime).date()
+            if started == now.date():
+                return
+            suffix = started.strftime("%Y%m%d")
+        else:
+            if stat.st_size < self.rotate:
+                return
+            suffix = now.strftime("%Y%m%d-%H%M%S")
+        target = self.filepath.with_name("%s-%s%s" % (self.filepath.stem, suffix, self.filepath.suffix))
+        count = 1
+        while target.exists():
+            target = self.filepath.with_name("%s-%s.%d%s" % (self.filepath.stem, suffix, count, self.filepath.suffix))
+            count += 1
+        self.filepath.rename(target)
+
+
+def read_binary_log(filepath):
+    """Yield the (datetime, status) records of a binary event log."""
+    with open(filepath, 'rb') as logfile:
+        if logfile.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError("%s is not a binary event log" % filepath)
+        while True:
+            record = logfile.read(BINARY_RECORD.size)
+            if len(record) < BINARY_RECORD.size:
+                return
+            timestamp, status = BINARY_RECORD.unpack(record)
+            yield datetime.datetime.fromtimestamp(timestamp), STATUSES[status]
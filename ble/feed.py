@@ -0,0 +1,172 @@
+import json, struct, sys, threading
+
+from ble.advertiser import MODE_BROADCAST
+from ble.batch import BleBatchError
+
+"""
+ Feed lines are either "name=value" pairs or a JSON object, naming fields
+ of the advertised payload, e.g. for an Eddystone-TLM payload:
+
+    battery=2950 temperature=21.5
+    {"adv_count": 1200, "uptime": 3600}
+
+ Example: sensor | ./main.py -u 504f4c45-5354-4152-4d4f-422d31343433 --feed - --feed-payload tlm
+"""
+
+
+def parse_feed_line(line):
+    """Return the {field: value} of a feed line, numbers as int or float."""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return {}
+    if line.startswith("{"):
+        values = json.loads(line)
+    else:
+        values = dict(pair.split("=", 1) for pair in line.split())
+    for name, value in values.items():
+        if isinstance(value, str):
+            value = float(value)
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        values[name] = value
+    return values
+
+
+class BleTelemetryFeed(object):
+    """Stream values into the fields of the advertised payload.
+
+    Producers offer() values into a single slot where a newer value of a
+    field replaces the older one, so a burst costs one update and memory
+    never grows with the producer's rate. tick() runs at most ``rate``
+    times per second from the BleScheduler and sends the newest values with
+    one gap_set_adv_data, without leaving advertising mode. Values offered
+    while not advertising are patched into the payload and go out with the
+    next start. The feed replaces ``advertiser.payload``: nothing else may
+    change the advertised identity while it runs.
+    """
+    def __init__(self, advertiser, payload, rate=1.0):
+        if rate <= 0:
+            raise ValueError("Feed rate must be positive")
+        self.advertiser = advertiser
+        self.payload = payload
+        self.rate = rate
+        self.offered = 0
+        self.coalesced = 0
+        self.updates = 0
+        self.rejected = 0
+        self.failures = 0
+        self.last_error = None
+        self._slot = {}
+        self._closed = False
+        self._cond = threading.Condition()
+        self._threads = []
+        self._schedule = None
+        advertiser.payload = payload
+
+    def offer(self, values, block=False):
+        """Offer new field values.
+
+        With block set, wait until the previous values were taken by tick():
+        the producer is then paced at the feed rate instead of coalesced.
+        """
+        with self._cond:
+            if block:
+                while self._slot and not self._closed:
+                    self._cond.wait()
+            for name in values:
+                if name not in self.payload.fields:
+                    raise KeyError("Unknown payload field '%s'" % name)
+            self.offered += 1
+            self.coalesced += sum(1 for name in values if name in self._slot)
+            self._slot.update(values)
+
+    def begin(self, scheduler):
+        """Send the offered values every 1 / rate seconds."""
+        self._schedule = scheduler.every(1.0 / self.rate, self.tick)
+
+    def cancel(self):
+        if self._schedule is not None:
+            self._schedule.cancel()
+            self._schedule = None
+
+    def tick(self):
+        with self._cond:
+            values, self._slot = self._slot, {}
+            self._cond.notify_all()
+        if not values:
+            return
+        for name, value in values.items():
+            try:
+                self.payload.set(name, value)
+            except (struct.error, ValueError, TypeError):
+                self.rejected += 1
+        advertiser = self.advertiser
+        if advertiser.state.mode != MODE_BROADCAST or advertiser.state.adv_data == self.payload.data:
+            return
+        """ Update the advertisement packet only, advertising keeps running"""
+        frame = self.payload.frame
+        advertiser.serial.write(frame)
+        if advertiser.reader.metrics is not None:
+            advertiser.reader.metrics.sent(frame)
+        result = advertiser.reader.read_response(6, 9)
+        if result is None:
+            # No answer: the link is down, left to the link supervisor
+            advertiser.state.adv_data = None
+            raise BleBatchError(6, 9, result)
+        if result != 0:
+            advertiser.state.adv_data = None
+            self.failures += 1
+            self.last_error = str(BleBatchError(6, 9, result))
+            return
+        advertiser.state.adv_data = bytes(self.payload.data)
+        self.updates += 1
+
+    def read(self, source, block=False):
+        """Feed the lines of a file path ("-" for stdin), pipe or any iterable
+        of lines from a background thread."""
+        thread = threading.Thread(target=self._read, args=(source, block), name="BleTelemetryFeed", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def consume(self, iterator, block=True):
+        """Feed the {field: value} dicts of an iterator from a background thread.
+
+        The iterator is paced by the feed by default, a generator computing
+        values is then never asked for more than the feed can send.
+        """
+        thread = threading.Thread(target=self._consume, args=(iterator, block), name="BleTelemetryFeed", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _read(self, source, block):
+        if source == "-":
+            source = sys.stdin
+        elif isinstance(source, str):
+            # Opened here: opening a FIFO waits for its writer
+            try:
+                source = open(source)
+            except OSError as e:
+                print("Feed error: %s" % e, file=sys.stderr)
+                return
+        for line in source:
+            try:
+                values = parse_feed_line(line)
+                if values:
+                    self.offer(values, block)
+            except (ValueError, KeyError) as e:
+                self.rejected += 1
+                print("Feed error: %s" % e, file=sys.stderr)
+            if self._closed:
+                return
+
+    def _consume(self, iterator, block):
+        for values in iterator:
+            self.offer(values, block)
+            if self._closed:
+                return
+
+    def close(self):
+        self.cancel()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
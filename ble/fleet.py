@@ -0,0 +1,231 @@
+import asyncio, datetime, json
+from pathlib import Path
+
+import serial
+
+from ble.optionparser import BleParsedArgs
+from ble.advertiser import AsyncBleAdvertiser
+from ble.transport import BleAsyncTransport
+from ble.batch import BleBatchError
+from ble.metrics import BleMetrics
+from ble.link import backoff_delays
+
+"""
+ Fleet file example, every key but "port" falls back to the command line;
+ major and minor are hex strings as on the command line, or JSON numbers.
+ Each dongle logs its duty cycle events to its own "log" file, by default
+ the --log path with the port name added, e.g. resources/wakeup-ttyACM0.csv:
+
+    {
+        "dongles": [
+            {"port": "/dev/ttyACM0", "uuid": "504f4c45-5354-4152-4d4f-422d31343433", "major": "0001", "minor": "0001"},
+            {"port": "/dev/ttyACM1", "minor": 2, "interval": 200, "duration": 30, "period": 120}
+        ]
+    }
+"""
+
+
+class BleFleetMember(object):
+    """One dongle of the fleet and its health counters."""
+    def __init__(self, params):
+        self.params = params
+        self.port = params.port
+        self.metrics = BleMetrics(port=params.port)
+        self.advertiser = None
+        self.eventlog = None
+        self.state = "closed"
+        self.cycles = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_start = None
+        self.start_latency = None
+
+    def health(self):
+        return {
+            "port": self.port,
+            "state": self.state,
+            "cycles": self.cycles,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_start": self.last_start,
+            "start_latency": self.start_latency,
+        }
+
+
+class BleFleet(object):
+    """Drive many BLED112 dongles from one asyncio event loop.
+
+    Every dongle runs its own duty cycle as a coroutine, so sleeping between
+    start and stop edges costs no thread. Duty cycles are offset by
+    ``stagger`` seconds from one dongle to the next so their USB traffic
+    does not burst at the same instant. Each member's edges go to its
+    ``eventlog``, if set, and a health report is printed every
+    ``report_interval`` seconds unless quiet.
+    """
+    def __init__(self, members, stagger=None, quiet=False, report_interval=60):
+        self.members = members
+        self.quiet = quiet
+        self.report_interval = report_interval
+        if stagger is None:
+            stagger = min(member.params.period for member in members) / len(members) if members else 0
+        self.stagger = stagger
+
+    @staticmethod
+    def load(filepath, defaults):
+        """Read a fleet file, per-dongle keys override the defaults params."""
+        with open(filepath) as fleet_file:
+            entries = json.load(fleet_file)["dongles"]
+        members = []
+        for entry in entries:
+            members.append(BleFleetMember(BleFleet.params(entry, defaults)))
+        return members
+
+    @staticmethod
+    def params(entry, defaults):
+        """Build the BleParsedArgs of one fleet entry."""
+        try:
+            return BleFleet._params(entry, defaults)
+        except (TypeError, ValueError) as e:
+            raise ValueError("Dongle %s: %s" % (entry.get("port"), e))
+
+    @staticmethod
+    def _params(entry, defaults):
+        args = dict(defaults.__dict__)
+        args["port"] = entry["port"]
+        for key in ("baudrate", "duration", "period"):
+            if key in entry:
+                args[key] = entry[key]
+        args["log"] = entry["log"] if "log" in entry else BleFleet._member_log(defaults.log, entry["port"])
+        if "uuid" in entry:
+            args["uuid"] = BleParsedArgs.parseUuid(entry["uuid"])
+        if "major" in entry:
+            args["major"] = BleParsedArgs.parseWord(entry["major"], "major", "-j")
+        if "minor" in entry:
+            args["minor"] = BleParsedArgs.parseWord(entry["minor"], "minor", "-n")
+        if "interval" in entry:
+            args["interval"] = entry["interval"]
+            args["adv_min"], args["adv_max"] = BleParsedArgs.parseInterval(entry["interval"])
+        args["duration"], args["period"] = BleParsedArgs.parseDutyCycle(args["duration"], args["period"])
+        if "uuid" not in args:
+            raise ValueError("No UUID for dongle %s" % entry["port"])
+        return BleParsedArgs(**args)
+
+    @staticmethod
+    def _member_log(filepath, port):
+        """The event log path of one dongle: filepath with the port name added."""
+        filepath = Path(filepath)
+        return str(filepath.with_name("%s-%s%s" % (filepath.stem, Path(port).name, filepath.suffix)))
+
+    def health(self):
+        """Return the health counters of every dongle."""
+        return [member.health() for member in self.members]
+
+    async def run(self):
+        tasks = [asyncio.ensure_future(self._cycle(member, index * self.stagger)) for index, member in enumerate(self.members)]
+        if self.report_interval and not self.quiet:
+            tasks.append(asyncio.ensure_future(self._report()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for member in self.members:
+                if member.advertiser is not None:
+                    member.advertiser.transport.close()
+
+    def _open(self, member):
+        try:
+            ser = serial.Serial(port=member.params.port, baudrate=member.params.baudrate, timeout=0)
+        except serial.SerialException as e:
+            member.state = "closed"
+            member.failures += 1
+            member.last_error = str(e)
+            return False
+        member.advertiser = AsyncBleAdvertiser(BleAsyncTransport(ser, metrics=member.metrics), member.params)
+        member.state = "idle"
+        return True
+
+    async def _cycle(self, member, offset):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(offset)
+        next_start = loop.time()
+        while True:
+            member.metrics.cycle_started(member.params.period, next_start)
+            if member.advertiser is not None or self._open(member):
+                await self._edge(member, "Start")
+                # Always on when the duration is the whole period
+                if member.params.duration < member.params.period:
+                    await asyncio.sleep(member.params.duration)
+                    await self._edge(member, "Stop")
+            next_start += member.params.period
+            await asyncio.sleep(max(0, next_start - loop.time()))
+
+    async def _edge(self, member, status):
+        if member.advertiser is None and not self._open(member):
+            return
+        loop = asyncio.get_running_loop()
+        began = loop.time()
+        try:
+            if status == "Start":
+                await member.advertiser.start()
+                member.start_latency = loop.time() - began
+                member.last_start = datetime.datetime.now()
+                member.state = "advertising"
+                member.cycles += 1
+            else:
+                await member.advertiser.stop()
+                member.state = "idle"
+        except (BleBatchError, OSError) as e:
+            member.state = "failed"
+            member.failures += 1
+            member.last_error = str(e)
+            # A write error or a missing response: the dongle reset or was
+            # unplugged, reopen it within the current duty cycle window
+            if not isinstance(e, BleBatchError) or e.result is None:
+                window = member.params.duration if status == "Start" else member.params.period - member.params.duration
+                await self._recover(member, status, window)
+        if member.eventlog is not None and member.state == ("advertising" if status == "Start" else "idle"):
+            member.eventlog.write(status)
+        if not self.quiet:
+            print(f"{'->' if status == 'Start' else '<-'} [{datetime.datetime.now()}] {member.port}: {status} ({member.state})")
+
+    async def _recover(self, member, status, window):
+        """Reopen a failed dongle with bounded backoff, then redo the edge."""
+        loop = asyncio.get_running_loop()
+        failed_at = loop.time()
+        member.metrics.link_failed()
+        for delay in backoff_delays(0.1, 5.0):
+            if member.advertiser is not None:
+                try:
+                    member.advertiser.transport.close()
+                except OSError:
+                    pass
+                member.advertiser = None
+            if self._open(member):
+                try:
+                    if status == "Start":
+                        await member.advertiser.start(force=True)
+                        member.state = "advertising"
+                    else:
+                        await member.advertiser.stop(force=True)
+                        member.state = "idle"
+                    member.metrics.link_recovered(loop.time() - failed_at)
+                    return True
+                except (BleBatchError, OSError) as e:
+                    member.last_error = str(e)
+                    # The reopened dongle answers but rejects the command
+                    if isinstance(e, BleBatchError) and e.result is not None:
+                        return False
+            if loop.time() - failed_at + delay >= window:
+                return False
+            await asyncio.sleep(delay)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print("----------------------------------------------------------------")
+            for health in self.health():
+                latency = "-" if health["start_latency"] is None else "%.1f ms" % (health["start_latency"] * 1000)
+                print("%s\t%s\tcycles=%d\tfailures=%d\tstart=%s\t%s" % (
+                    health["port"], health["state"], health["cycles"], health["failures"], latency, health["last_error"] or ""))
+            print("----------------------------------------------------------------")
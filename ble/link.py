@@ -0,0 +1,122 @@
+import datetime, time
+
+from ble.batch import BleBatchError
+from ble.stack import COMMAND_NAMES
+
+# What a dead or confused link raises; serial.SerialException is an OSError
+LINK_ERRORS = (OSError, BleBatchError)
+
+
+class BleLinkFatalError(Exception):
+    """The dongle keeps rejecting a command on a live link, reopening it cannot help."""
+    def __init__(self, error):
+        name = COMMAND_NAMES.get((error.cls, error.cmd), "class=%d, id=%d" % (error.cls, error.cmd))
+        super().__init__("The dongle rejects %s with result 0x%04X" % (name, error.result))
+        self.error = error
+
+
+def _rejected(error):
+    """Whether error is a result code from a link that answers, not a transport failure."""
+    return isinstance(error, BleBatchError) and error.result is not None
+
+
+def backoff_delays(initial=0.1, maximum=5.0):
+    """Yield reopen delays, doubling from initial up to maximum."""
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * 2, maximum)
+
+
+class BleLinkSupervisor(object):
+    """Keep an advertiser's serial link alive across dongle resets and replugs.
+
+    ``run()`` calls a function, typically the scheduler's run(), and
+    recovers from every link error it raises before calling it again. A bad
+    result code on a live link is first answered with a forced resync in
+    place; a write error, a read timeout or a resync cut short by one closes
+    the port and reopens it through ``opener()``, retried with bounded
+    exponential backoff. A result code still there once the dongle has been
+    resynced or reopened is a command the dongle rejects, e.g. an interval
+    out of its range: BleLinkFatalError is raised instead of retrying. The advertising state is then restored through ``owner``, the
+    BleDutyCycle or BleCampaignRunner running the edges, so its own state
+    follows the dongle's; without an owner, the advertiser's last requested
+    state is restored from its cached params and payload. Failures and
+    time-to-recover go to the advertiser's metrics.
+    """
+    def __init__(self, advertiser, opener, initial_delay=0.1, max_delay=5.0, quiet=False, owner=None):
+        self.advertiser = advertiser
+        self.opener = opener
+        self.owner = owner
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.quiet = quiet
+        self.failures = 0
+        self.last_error = None
+
+    def run(self, function, *args):
+        while True:
+            try:
+                return function(*args)
+            except LINK_ERRORS as e:
+                self.recover(e)
+
+    def recover(self, error):
+        """Bring the link and the advertising state back, returns the time it took."""
+        failed_at = time.monotonic()
+        self.failures += 1
+        self.last_error = str(error)
+        metrics = self.advertiser.metrics
+        if metrics is not None:
+            metrics.link_failed()
+        self._print("Link failure: %s" % error)
+
+        restored = False
+        if _rejected(error):
+            # The link answers, only the dongle state differs from the cache
+            try:
+                self._restore()
+                restored = True
+            except LINK_ERRORS as e:
+                if _rejected(e):
+                    raise BleLinkFatalError(e)
+                self._print("Resync failed: %s" % e)
+
+        if not restored:
+            for delay in backoff_delays(self.initial_delay, self.max_delay):
+                self._close()
+                try:
+                    self.advertiser.attach(self.opener())
+                    self._restore()
+                    break
+                except LINK_ERRORS as e:
+                    if _rejected(e):
+                        raise BleLinkFatalError(e)
+                    self.last_error = str(e)
+                    time.sleep(delay)
+
+        elapsed = time.monotonic() - failed_at
+        if metrics is not None:
+            metrics.link_recovered(elapsed)
+        self._print("Link recovered in %.3f s" % elapsed)
+        return elapsed
+
+    def _restore(self):
+        if self.owner is not None:
+            self.owner.restore()
+        elif self.advertiser.desired == "start":
+            self.advertiser.start(force=True)
+        elif self.advertiser.desired == "stop":
+            self.advertiser.stop(force=True)
+        else:
+            self.advertiser.state.invalidate()
+
+    def _close(self):
+        try:
+            self.advertiser.serial.close()
+        except OSError:
+            pass
+
+    def _print(self, message):
+        if not self.quiet:
+            print(f"!! [{datetime.datetime.now()}] {message}")
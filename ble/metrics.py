@@ -0,0 +1,249 @@
+import bisect, collections, os, sys, threading, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from ble.stack import COMMAND_NAMES
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+JITTER_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0)
+RECOVERY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class BleHistogram(object):
+    """Fixed-bucket histogram, as exported by Prometheus."""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%sle="%s"} %d' % (name, labels, bound, cumulative))
+        lines.append('%s_sum{%s} %f' % (name, labels.rstrip(","), self.sum))
+        lines.append('%s_count{%s} %d' % (name, labels.rstrip(","), self.count))
+        return lines
+
+
+class BleMetrics(object):
+    """Link metrics of one dongle.
+
+    ``sent()`` is called with every block of command frames written to the
+    dongle and ``received()`` / ``timed_out()`` with every response or
+    missing response, in command order. Each is a few integer updates and
+    one perf_counter() call, cheap enough to leave on. A failed result is
+    only counted as an error if the command's result is checked: commands
+    that may fail, such as stopping an idle dongle, do on every stop.
+    """
+    def __init__(self, **labels):
+        self.labels = "".join('%s="%s",' % item for item in sorted(labels.items()))
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.events = 0
+        self.latency = {}
+        self.errors = collections.Counter()
+        self.timeouts = collections.Counter()
+        self.unmatched_responses = collections.Counter()
+        self.jitter = BleHistogram(JITTER_BUCKETS)
+        self.last_jitter = 0.0
+        self.link_failures = 0
+        self.recovery = BleHistogram(RECOVERY_BUCKETS)
+        self.last_recovery = 0.0
+        self._outstanding = collections.deque()
+        self._last_cycle = None
+
+    def sent(self, frames, checks=None):
+        """Record command frames written to the dongle, checks telling for
+        each one whether its result is checked (default all)."""
+        now = time.perf_counter()
+        self.bytes_out += len(frames)
+        checks = iter(checks) if checks is not None else None
+        offset = 0
+        while offset + 4 <= len(frames):
+            self._outstanding.append((frames[offset + 2], frames[offset + 3], now, True if checks is None else next(checks)))
+            offset += 4 + (((frames[offset] & 0x07) << 8) | frames[offset + 1])
+
+    def read(self, nbytes):
+        self.bytes_in += nbytes
+
+    def event(self, count=1):
+        self.events += count
+
+    def received(self, cls, cmd, result):
+        """Record the response to the oldest outstanding (cls, cmd) command."""
+        sent, check = self._pop(cls, cmd)
+        if sent is not None:
+            histogram = self.latency.get((cls, cmd))
+            if histogram is None:
+                histogram = self.latency[(cls, cmd)] = BleHistogram(LATENCY_BUCKETS)
+            histogram.observe(time.perf_counter() - sent)
+        if result != 0 and check:
+            self.errors[(cls, cmd)] += 1
+
+    def timed_out(self, cls, cmd):
+        self._pop(cls, cmd)
+        self.timeouts[(cls, cmd)] += 1
+
+    def unmatched(self, cls, cmd):
+        """Record a response dropped because no command waits for it."""
+        self.unmatched_responses[(cls, cmd)] += 1
+
+    def flushed(self):
+        """Forget outstanding commands, their responses were discarded."""
+        self._outstanding.clear()
+
+    def _pop(self, cls, cmd):
+        outstanding = self._outstanding
+        while outstanding:
+            sent_cls, sent_cmd, sent, check = outstanding.popleft()
+            if sent_cls == cls and sent_cmd == cmd:
+                return sent, check
+            # Responses come in command order: this one was never answered
+            self.timeouts[(sent_cls, sent_cmd)] += 1
+        return None, True
+
+    def cycle_started(self, period, scheduled=None):
+        """Record a duty cycle start.
+
+        The start was due at the scheduled time.monotonic() deadline if
+        given, else period seconds after the previous start.
+        """
+        now = time.monotonic()
+        if scheduled is None and self._last_cycle is not None:
+            scheduled = self._last_cycle + period
+        if scheduled is not None:
+            self.last_jitter = now - scheduled
+            self.jitter.observe(abs(self.last_jitter))
+        self._last_cycle = now
+
+    def link_failed(self):
+        self.link_failures += 1
+
+    def link_recovered(self, seconds):
+        """Record the time from a link failure to the restored advertising state."""
+        self.last_recovery = seconds
+        self.recovery.observe(seconds)
+
+    def render(self):
+        """Return the metrics in the Prometheus text format, without HELP/TYPE lines."""
+        labels = self.labels
+        plain = labels.rstrip(",")
+        lines = [
+            'ble_bytes_out_total{%s} %d' % (plain, self.bytes_out),
+            'ble_bytes_in_total{%s} %d' % (plain, self.bytes_in),
+            'ble_events_total{%s} %d' % (plain, self.events),
+            'ble_duty_cycle_last_jitter_seconds{%s} %f' % (plain, self.last_jitter),
+            'ble_link_failures_total{%s} %d' % (plain, self.link_failures),
+            'ble_link_last_recovery_seconds{%s} %f' % (plain, self.last_recovery),
+        ]
+        lines.extend(self.jitter.render("ble_duty_cycle_jitter_seconds", labels))
+        lines.extend(self.recovery.render("ble_link_recovery_seconds", labels))
+        # Rendered from another thread than the one adding commands: copy
+        # the dicts first, list() of a dict runs without releasing the GIL
+        for key, histogram in sorted(list(self.latency.items())):
+            lines.extend(histogram.render("ble_command_latency_seconds", '%scommand="%s",' % (labels, _command_name(key))))
+        for key, count in sorted(list(self.errors.items())):
+            lines.append('ble_command_errors_total{%scommand="%s"} %d' % (labels, _command_name(key), count))
+        for key, count in sorted(list(self.timeouts.items())):
+            lines.append('ble_command_timeouts_total{%scommand="%s"} %d' % (labels, _command_name(key), count))
+        for key, count in sorted(list(self.unmatched_responses.items())):
+            lines.append('ble_command_unmatched_responses_total{%scommand="%s"} %d' % (labels, _command_name(key), count))
+        return lines
+
+
+def _command_name(key):
+    return COMMAND_NAMES.get(key, "%d_%d" % key)
+
+
+_TYPES = (
+    ("ble_bytes_out_total", "counter", "Bytes written to the dongle"),
+    ("ble_bytes_in_total", "counter", "Bytes read from the dongle"),
+    ("ble_events_total", "counter", "BGAPI events received"),
+    ("ble_duty_cycle_last_jitter_seconds", "gauge", "Offset of the last duty cycle start from its schedule"),
+    ("ble_duty_cycle_jitter_seconds", "histogram", "Absolute duty cycle start jitter"),
+    ("ble_link_failures_total", "counter", "Serial link failures: write errors, timeouts, unexpected results"),
+    ("ble_link_last_recovery_seconds", "gauge", "Time to recover from the last link failure"),
+    ("ble_link_recovery_seconds", "histogram", "Time from a link failure to the restored advertising state"),
+    ("ble_command_latency_seconds", "histogram", "Time from command write to response"),
+    ("ble_command_errors_total", "counter", "Responses with a non-zero result code to a checked command"),
+    ("ble_command_timeouts_total", "counter", "Commands whose response never arrived"),
+    ("ble_command_unmatched_responses_total", "counter", "Responses dropped because no command was waiting for them"),
+)
+
+
+def render_metrics(metrics_list):
+    """Render several BleMetrics as one Prometheus text exposition."""
+    rendered = [metrics.render() for metrics in metrics_list]
+    lines = []
+    for name, kind, description in _TYPES:
+        lines.append("# HELP %s %s" % (name, description))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for metric_lines in rendered:
+            lines.extend(line for line in metric_lines if line.split("{", 1)[0] in (name, name + "_bucket", name + "_sum", name + "_count"))
+    return "\n".join(lines) + "\n"
+
+
+class BleMetricsExporter(object):
+    """Publish metrics as a Prometheus textfile and/or on a local HTTP port.
+
+    The textfile is rewritten every ``interval`` seconds through an atomic
+    rename, for node_exporter's textfile collector. The HTTP endpoint renders
+    on request only.
+    """
+    def __init__(self, metrics_list, filepath=None, port=None, interval=15.0, host="127.0.0.1"):
+        self.metrics_list = metrics_list
+        self.filepath = filepath
+        self.interval = interval
+        self._stop = threading.Event()
+        self._threads = []
+        if filepath:
+            self._threads.append(threading.Thread(target=self._write_loop, name="BleMetricsFile", daemon=True))
+        self._server = None
+        if port:
+            exporter = self
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = render_metrics(exporter.metrics_list).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+            self._server = HTTPServer((host, port), Handler)
+            self._threads.append(threading.Thread(target=self._server.serve_forever, name="BleMetricsHttp", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def write(self):
+        temppath = "%s.tmp" % self.filepath
+        with open(temppath, "w") as metricsfile:
+            metricsfile.write(render_metrics(self.metrics_list))
+        os.replace(temppath, self.filepath)
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                # Keep exporting, the next write may well succeed
+                print("Metrics export error (name='%s'): %s" % (self.filepath, e), file=sys.stderr)
+
+    def close(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+        if self.filepath:
+            self.write()
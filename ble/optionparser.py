@@ -10,6 +10,53 @@ class BleParsedArgs:
     def toHexArray(hexstring):
         return [int(hexstring[i:i+2], 16) for i in range(0, len(hexstring), 2)]
 
+    @staticmethod
+    def parseUuid(uuid):
+        """Validate an iBeacon UUID string, returns its 16 bytes."""
+        if not isinstance(uuid, str):
+            raise ValueError("Invalid UUID %r, must be 16 bytes in 0-padded hex form:\n\t-u 0123456789abcdef0123456789abcdef" % (uuid,))
+        if re.search('[^a-fA-F0-9:\\-]', uuid):
+            raise ValueError("Invalid UUID characters, must be 16 bytes in 0-padded hex form:\n\t-u 0123456789abcdef0123456789abcdef")
+        uuid_hex_string = uuid.replace(":", "").replace("-", "").upper()
+        if len(uuid_hex_string) != 32:
+            raise ValueError("Invalid UUID length, must be 16 bytes in 0-padded hex form:\n\t-u 0123456789abcdef0123456789abcdef")
+        return BleParsedArgs.toHexArray(uuid_hex_string)
+
+    @staticmethod
+    def parseWord(value, name, flag):
+        """Validate a 2-byte hex value such as the major or minor.
+
+        An int, as read from a JSON number, is taken as is.
+        """
+        if isinstance(value, int) and not isinstance(value, bool):
+            if not 0 <= value <= 0xFFFF:
+                raise ValueError("Invalid %s %d, must be between 0 and 65535:\n\t%s 01cf" % (name, value, flag))
+            return value
+        if not isinstance(value, str):
+            raise ValueError("Invalid %s %r, must be 2 bytes in 0-padded hex form:\n\t%s 01cf" % (name, value, flag))
+        if re.search('[^a-fA-F0-9:\\-]', value):
+            raise ValueError("Invalid %s characters, must be 2 bytes in 0-padded hex form:\n\t%s 01cf" % (name, flag))
+        word = value.replace(":", "").replace("-", "").upper()
+        if len(word) != 4:
+            raise ValueError("Invalid %s length, must be 2 bytes in 0-padded hex form:\n\t%s 01cf" % (name, flag))
+        return int(word[0:4], 16)
+
+    @staticmethod
+    def parseInterval(interval):
+        """Validate an advertisement interval in ms, returns (adv_min, adv_max)."""
+        if interval < 30 or interval > 10230:
+            raise ValueError("Invalid advertisement interval, must be between 30 and 10230")
+        adv_min = interval - 10
+        adv_max = adv_min + 20
+        return adv_min, adv_max
+
+    @staticmethod
+    def parseDutyCycle(duration, period):
+        """Validate a duty cycle in s, a duration equal to the period advertises all the time."""
+        if period <= 0 or not 0 <= duration <= period:
+            raise ValueError("Invalid duty cycle, the duration must be at most the period:\n\t-d 45 -t 360")
+        return duration, period
+
 class BleOptionParser(object):
     def __init__(self) -> None:
         """Generate BLE's command line parser.
@@ -38,7 +85,7 @@ class BleOptionParser(object):
 
     def _add_default_options(self) -> None:
         # set all defaults for options
-        self._parser.set_defaults(port="/dev/ttyACM0", baud=115200, interval=100, uuid="", major="0001", minor="0001", quiet=False, scanreq=False, duration=60, period=300)
+        self._parser.set_defaults(port="/dev/ttyACM0", baud=115200, interval=100, uuid="", major="0001", minor="0001", power=-58, quiet=False, scanreq=False, duration=60, period=300, fleet=None, stagger=None, identities=None, dwell=1.0, log=None, log_format="csv", log_rotate=None, metrics=None, metrics_port=None, scanreq_window=10.0, scanreq_log=None, daemon=None, campaign=None, feed=None, feed_rate=1.0, feed_payload="ibeacon", capture=None, observe=False, observe_window=10.0, scan_interval=75, scan_window=50, active_scan=False)
 
         # create serial port options argument group
         serial_option_group = optparse.OptionGroup(self._parser, "Serial Port Options")
@@ -51,6 +98,7 @@ class BleOptionParser(object):
         ibeacon_option_group.add_option('--uuid', '-u', type="string", help="iBeacon UUID (default AirLocate)", metavar="UUID")
         ibeacon_option_group.add_option('--major', '-j', type="string", help="iBeacon Major (default 0001)", metavar="MAJOR")
         ibeacon_option_group.add_option('--minor', '-n', type="string", help="iBeacon Minor (default 0001)", metavar="MINOR")
+        ibeacon_option_group.add_option('--power', type="int", help="iBeacon measured power at 1 m in dBm (default -58)", metavar="DBM")
         ibeacon_option_group.add_option('--interval', '-i', type="int", help="Advertisement interval in ms (default 100, min 30, max 10230)", metavar="INTERVAL")
         ibeacon_option_group.add_option('--end', '-e', action="store_true", help="End beaconing advertisements", metavar="STOP")
         self._parser.add_option_group(ibeacon_option_group)
@@ -58,15 +106,61 @@ class BleOptionParser(object):
         # create output options argument group
         output_option_group = optparse.OptionGroup(self._parser, "Output Options")
         output_option_group.add_option('--scanreq', '-s', action="store_true", help="Display scan requests (Bluegiga enhanced broadcasting)", metavar="SCANREQ")
+        output_option_group.add_option('--scanreq-window', type="float", help="Display a requester again only after this many s (default 10 seconds)", metavar="WINDOW")
+        output_option_group.add_option('--scanreq-log', type="string", help="Append scan requests to FILE instead of displaying them", metavar="FILE")
         output_option_group.add_option('--quiet', '-q', action="store_true", help="Quiet mode (suppress initial parameter display)")
+        output_option_group.add_option('--log', '-l', type="string", help="Duty cycle event log, appended to (default resources/wakeup.csv, or .bin with --log-format binary); with --fleet, one per dongle with its port name added", metavar="FILE")
+        output_option_group.add_option('--log-format', type="choice", choices=["csv", "binary"], help="Event log format, csv or compact binary records (default csv)", metavar="FORMAT")
+        output_option_group.add_option('--log-rotate', type="string", help="Rotate the event log once it reaches SIZE bytes, or \"daily\"", metavar="SIZE")
+        output_option_group.add_option('--capture', type="string", help="Record the serial traffic to FILE, which must not exist yet, see python3 -m ble.capture", metavar="FILE")
+        output_option_group.add_option('--metrics', '-m', type="string", help="Write link metrics to FILE in the Prometheus text format, every 15 seconds", metavar="FILE")
+        output_option_group.add_option('--metrics-port', type="int", help="Serve link metrics over HTTP on 127.0.0.1:PORT", metavar="PORT")
         self._parser.add_option_group(output_option_group)
 
+        # create telemetry feed options argument group
+        feed_option_group = optparse.OptionGroup(self._parser, "Telemetry Feed Options")
+        feed_option_group.add_option('--feed', type="string", help="Read payload field values from FILE or pipe (- for stdin), e.g. \"minor=2\" lines", metavar="FILE")
+        feed_option_group.add_option('--feed-rate', type="float", help="Max advertisement data updates per second (default 1)", metavar="HZ")
+        feed_option_group.add_option('--feed-payload', type="choice", choices=["ibeacon", "tlm"], help="Payload fed, ibeacon (major, minor, measured_power) or Eddystone tlm (battery, temperature, adv_count, uptime) (default ibeacon)", metavar="PAYLOAD")
+        self._parser.add_option_group(feed_option_group)
+
         # create duty cycle options argument group
         duty_cycle_option_group = optparse.OptionGroup(self._parser, "Duty cycle Options")
-        duty_cycle_option_group.add_option('--duration', '-d', type="int", help="Advertisement activity duration in s (default 15 seconds)", metavar="INTERVAL")
-        duty_cycle_option_group.add_option('--period', '-t', type="int", help="Advertisement activitionperiod in minute (default 300 seconds)", metavar="INTERVAL")
+        duty_cycle_option_group.add_option('--duration', '-d', type="float", help="Advertisement activity duration in s, may be fractional (default 60 seconds)", metavar="INTERVAL")
+        duty_cycle_option_group.add_option('--period', '-t', type="float", help="Advertisement activity period in s, may be fractional (default 300 seconds)", metavar="INTERVAL")
         self._parser.add_option_group(duty_cycle_option_group)
 
+        # create campaign options argument group
+        campaign_option_group = optparse.OptionGroup(self._parser, "Campaign Options")
+        campaign_option_group.add_option('--campaign', '-c', type="string", help="CSV or JSON file of time-windowed beacon entries to advertise instead of the duty cycle", metavar="FILE")
+        self._parser.add_option_group(campaign_option_group)
+
+        # create identity rotation options argument group
+        rotation_option_group = optparse.OptionGroup(self._parser, "Rotation Options")
+        rotation_option_group.add_option('--identities', '-r', type="string", help="CSV file of uuid,major,minor[,tx_power] identities to rotate through while advertising", metavar="FILE")
+        rotation_option_group.add_option('--dwell', '-w', type="float", help="Time in s each identity is advertised (default 1 second)", metavar="DWELL")
+        self._parser.add_option_group(rotation_option_group)
+
+        # create fleet options argument group
+        fleet_option_group = optparse.OptionGroup(self._parser, "Fleet Options")
+        fleet_option_group.add_option('--fleet', '-f', type="string", help="JSON file listing the dongle ports and their beacon parameters, all driven from this process", metavar="FILE")
+        fleet_option_group.add_option('--stagger', type="float", help="Delay in s between the duty cycles of two dongles (default period / number of dongles)", metavar="DELAY")
+        self._parser.add_option_group(fleet_option_group)
+
+        # create daemon options argument group
+        daemon_option_group = optparse.OptionGroup(self._parser, "Daemon Options")
+        daemon_option_group.add_option('--daemon', type="string", help="Run until killed, taking identity, interval, duty cycle, pause and resume commands on the unix socket PATH", metavar="PATH")
+        self._parser.add_option_group(daemon_option_group)
+
+        # create scanner options argument group
+        scanner_option_group = optparse.OptionGroup(self._parser, "Scanner Options")
+        scanner_option_group.add_option('--observe', action="store_true", help="Scan instead of advertising, printing the RSSI statistics of the iBeacons around (needs numpy)")
+        scanner_option_group.add_option('--observe-window', type="float", help="Sliding window and print period of the RSSI statistics in s (default 10 seconds)", metavar="WINDOW")
+        scanner_option_group.add_option('--scan-interval', type="int", help="Scan interval in ms (default 75 ms)", metavar="INTERVAL")
+        scanner_option_group.add_option('--scan-window', type="int", help="Scan window in ms, at most the scan interval (default 50 ms)", metavar="WINDOW")
+        scanner_option_group.add_option('--active-scan', action="store_true", help="Send scan requests to the advertisers found")
+        self._parser.add_option_group(scanner_option_group)
+
         
     def parse(self):
         """
@@ -78,79 +172,99 @@ class BleOptionParser(object):
         args_option_dict["port"] = options.port
         args_option_dict["baudrate"] = options.baud
         args_option_dict["interval"] = options.interval
-        args_option_dict["scanreq"] = options.scanreq
+        args_option_dict["power"] = options.power
+        args_option_dict["scanreq"] = options.scanreq or options.scanreq_log is not None
+        args_option_dict["scanreq_window"] = options.scanreq_window
+        args_option_dict["scanreq_log"] = options.scanreq_log
         args_option_dict["duration"] = options.duration
         args_option_dict["period"] = options.period
+        args_option_dict["log"] = options.log or ("resources/wakeup.bin" if options.log_format == "binary" else "resources/wakeup.csv")
+        args_option_dict["metrics"] = options.metrics
+        args_option_dict["capture"] = options.capture
+        args_option_dict["metrics_port"] = options.metrics_port
+        args_option_dict["log_format"] = options.log_format
+        args_option_dict["log_rotate"] = options.log_rotate
+        args_option_dict["identities"] = options.identities
+        args_option_dict["dwell"] = options.dwell
+        args_option_dict["fleet"] = options.fleet
+        args_option_dict["stagger"] = options.stagger
+        args_option_dict["daemon"] = options.daemon
+        args_option_dict["campaign"] = options.campaign
+        args_option_dict["feed"] = options.feed
+        args_option_dict["feed_rate"] = options.feed_rate
+        args_option_dict["feed_payload"] = options.feed_payload
+        args_option_dict["observe"] = options.observe
+        args_option_dict["observe_window"] = options.observe_window
+        args_option_dict["scan_interval"] = options.scan_interval
+        args_option_dict["scan_window"] = options.scan_window
+        args_option_dict["active_scan"] = options.active_scan
+
+        try:
+            # validate UUID if specified
+            if len(options.uuid):
+                args_option_dict["uuid"] = BleParsedArgs.parseUuid(options.uuid)
+
+            # validate major value if specified
+            if len(options.major):
+                args_option_dict["major"] = BleParsedArgs.parseWord(options.major, "major", "-j")
+
+            # validate minor value if specified
+            if len(options.minor):
+                args_option_dict["minor"] = BleParsedArgs.parseWord(options.minor, "minor", "-n")
+
+            # validate measured power
+            if not -128 <= options.power <= 127:
+                raise ValueError("Invalid measured power, must be between -128 and 127 dBm:\n\t--power -59")
+
+            # validate interval
+            args_option_dict["adv_min"], args_option_dict["adv_max"] = BleParsedArgs.parseInterval(options.interval)
+
+            # validate duty cycle
+            BleParsedArgs.parseDutyCycle(options.duration, options.period)
+
+            # validate feed rate
+            if options.feed_rate <= 0:
+                raise ValueError("Invalid feed rate, must be a positive number of updates per second:\n\t--feed-rate 4")
+
+            # validate telemetry feed, it owns the advertised payload
+            if options.feed is not None:
+                for flag, value in (("--identities", options.identities), ("--campaign", options.campaign), ("--daemon", options.daemon)):
+                    if value is not None:
+                        raise ValueError("Invalid options, --feed cannot be used with %s: the feed overwrites the identity it advertises" % flag)
+
+            # validate campaign, it replaces the duty cycle
+            if options.campaign is not None:
+                for flag, value in (("--identities", options.identities), ("--daemon", options.daemon)):
+                    if value is not None:
+                        raise ValueError("Invalid options, --campaign cannot be used with %s: the campaign schedules the identities instead of the duty cycle" % flag)
+
+            # validate fleet, its dongles only run the duty cycle
+            if options.fleet is not None:
+                for flag, value in (("--capture", options.capture), ("--identities", options.identities), ("--campaign", options.campaign),
+                                    ("--daemon", options.daemon), ("--feed", options.feed), ("--scanreq", options.scanreq or options.scanreq_log),
+                                    ("--observe", options.observe)):
+                    if value:
+                        raise ValueError("Invalid options, --fleet cannot be used with %s: fleet dongles only run the duty cycle" % flag)
+
+            # validate observe window
+            if options.observe_window <= 0:
+                raise ValueError("Invalid observe window, must be a positive number of seconds:\n\t--observe-window 5")
+
+            # validate scan timing, sent in 0.625 ms units from 0x4 to 0x4000
+            if not 3 <= options.scan_window <= options.scan_interval <= 10240:
+                raise ValueError("Invalid scan timing, the window must be at most the interval, between 3 and 10240 ms:\n\t--scan-interval 100 --scan-window 50")
 
-        # validate UUID if specified
-        if len(options.uuid):
-            if re.search('[^a-fA-F0-9:\\-]', options.uuid):
-                self._parser.print_help()
-                print("\n================================================================")
-                print("Invalid UUID characters, must be 16 bytes in 0-padded hex form:")
-                print("\t-u 0123456789abcdef0123456789abcdef")
-                print("================================================================")
-                exit(1)
-            uuid_hex_string = options.uuid.replace(":", "").replace("-", "").upper()
-            if len(uuid_hex_string) != 32:
-                self._parser.print_help()
-                print("\n================================================================")
-                print("Invalid UUID length, must be 16 bytes in 0-padded hex form:")
-                print("\t-u 0123456789abcdef0123456789abcdef")
-                print("================================================================")
-                exit(1)
-            args_option_dict["uuid"] = BleParsedArgs.toHexArray(uuid_hex_string)
-
-        # validate major value if specified
-        if len(options.major):
-            if re.search('[^a-fA-F0-9:\\-]', options.major):
-                self._parser.print_help()
-                print("\n================================================================")
-                print("Invalid major characters, must be 2 bytes in 0-padded hex form:")
-                print("\t-j 01cf")
-                print("================================================================")
-                exit(1)
-            major =options.major.replace(":", "").replace("-", "").upper()
-            if len(major) != 4:
-                self._parser.print_help()
-                print("\n================================================================")
-                print("Invalid major length, must be 2 bytes in 0-padded hex form:")
-                print("\t-j 01cf")
-                print("================================================================")
-                exit(1)
-            args_option_dict["major"] = int(major[0:4], 16)
-                
-        # validate minor value if specified
-        if len(options.minor):
-            if re.search('[^a-fA-F0-9:\\-]', options.minor):
-                self._parser.print_help()
-                print("\n================================================================")
-                print("Invalid minor characters, must be 2 bytes in 0-padded hex form:")
-                print("\t-n 01cf")
-                print("================================================================")
-                exit(1)
-            minor = options.minor.replace(":", "").replace("-", "").upper()
-            if len(minor) != 4:
-                self._parser.print_help()
-                print("\n================================================================")
-                print("Invalid minor length, must be 2 bytes in 0-padded hex form:")
-                print("\t-n 01cf")
-                print("================================================================")
-                exit(1)
-            args_option_dict["minor"] = int(minor[0:4], 16)
-            
-        # validate interval
-        if options.interval < 30 or options.interval > 10230:
+            # validate event log rotation
+            if options.log_rotate is not None and options.log_rotate != "daily":
+                if not options.log_rotate.isdigit() or int(options.log_rotate) == 0:
+                    raise ValueError("Invalid log rotation, must be a size in bytes or daily:\n\t--log-rotate 1048576")
+                args_option_dict["log_rotate"] = int(options.log_rotate)
+        except ValueError as e:
             self._parser.print_help()
             print("\n================================================================")
-            print("Invalid advertisement interval, must be between 30 and 10230")
+            print(e)
             print("================================================================")
             exit(1)
-        else:
-            adv_min = options.interval - 10
-            adv_max = adv_min + 20
-            args_option_dict["adv_min"] = options.interval - 10
-            args_option_dict["adv_max"] = adv_min + 20
 
         args_option_dict["quiet"] = False if not(options.quiet) else True
 
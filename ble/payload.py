@@ -0,0 +1,236 @@
+import struct
+
+from ble.stack import BleStack, ADV_DATA_MAX_LENGTH
+
+# AD structure types
+AD_FLAGS = 0x01
+AD_COMPLETE_16BIT_UUIDS = 0x03
+AD_SHORTENED_LOCAL_NAME = 0x08
+AD_COMPLETE_LOCAL_NAME = 0x09
+AD_SERVICE_DATA = 0x16
+AD_MANUFACTURER_DATA = 0xFF
+
+# LE General Discoverable, BR/EDR not supported
+FLAGS_GENERAL_DISCOVERABLE = 0x06
+
+APPLE_COMPANY_ID = 0x004C
+RADIUS_NETWORKS_COMPANY_ID = 0x0118
+EDDYSTONE_SERVICE_UUID = 0xFEAA
+EDDYSTONE_UID, EDDYSTONE_URL, EDDYSTONE_TLM = 0x00, 0x10, 0x20
+
+# Field codecs, compiled once
+_INT8 = struct.Struct('b')
+_UINT8 = struct.Struct('B')
+_UINT16_LE = struct.Struct('<H')
+_UINT16_BE = struct.Struct('>H')
+_INT16_BE = struct.Struct('>h')
+_UINT32_BE = struct.Struct('>I')
+
+_EDDYSTONE_URL_SCHEMES = ("http://www.", "https://www.", "http://", "https://")
+_EDDYSTONE_URL_EXPANSIONS = (".com/", ".org/", ".edu/", ".net/", ".info/", ".biz/", ".gov/",
+                             ".com", ".org", ".edu", ".net", ".info", ".biz", ".gov")
+
+
+def eddystone_url_bytes(url):
+    """Encode a URL the Eddystone-URL way: scheme prefix byte, then the rest
+    with the common suffixes as single bytes."""
+    for scheme, prefix in enumerate(_EDDYSTONE_URL_SCHEMES):
+        if url.startswith(prefix):
+            break
+    else:
+        raise ValueError("Invalid Eddystone URL '%s', must start with http:// or https://" % url)
+    encoded = bytearray([scheme])
+    rest = url[len(prefix):]
+    while rest:
+        for code, expansion in enumerate(_EDDYSTONE_URL_EXPANSIONS):
+            if rest.startswith(expansion):
+                encoded.append(code)
+                rest = rest[len(expansion):]
+                break
+        else:
+            encoded += rest[0].encode("ascii")
+            rest = rest[1:]
+    if len(encoded) > 18:
+        raise ValueError("Eddystone URL '%s' is %d bytes encoded, max 18" % (url, len(encoded)))
+    return bytes(encoded)
+
+
+class BlePayload(object):
+    """Compiled advertisement or scan response payload.
+
+    ``frame`` is the complete gap_set_adv_data command, ready to be written
+    as is, and ``data`` a view of its AD structures. Named fields are
+    patched in place by set(): no list or bytes object is built, so a
+    payload can be updated many times per second.
+    """
+    __slots__ = ("frame", "data", "fields", "scan_response")
+
+    def __init__(self, data, fields, scan_response=False):
+        self.frame = bytearray(6 + len(data))
+        BleStack.pack_gap_set_adv_data_into(self.frame, 0, 1 if scan_response else 0, data)
+        self.data = memoryview(self.frame)[6:]
+        self.fields = fields
+        self.scan_response = scan_response
+
+    def __len__(self):
+        return len(self.data)
+
+    def set(self, name, value):
+        """Patch a field, e.g. payload.set("minor", 2)."""
+        offset, codec, scale = self.fields[name]
+        offset += 6
+        if codec is None:
+            if len(value) != scale:
+                raise ValueError("Field %s is %d bytes, got %d" % (name, scale, len(value)))
+            self.frame[offset:offset + scale] = value
+        elif scale == 1:
+            codec.pack_into(self.frame, offset, value)
+        else:
+            codec.pack_into(self.frame, offset, int(round(value * scale)))
+
+    def get(self, name):
+        offset, codec, scale = self.fields[name]
+        offset += 6
+        if codec is None:
+            return bytes(self.frame[offset:offset + scale])
+        value = codec.unpack_from(self.frame, offset)[0]
+        return value if scale == 1 else value / scale
+
+    def copy(self):
+        payload = BlePayload.__new__(BlePayload)
+        payload.frame = bytearray(self.frame)
+        payload.data = memoryview(payload.frame)[6:]
+        payload.fields = self.fields
+        payload.scan_response = self.scan_response
+        return payload
+
+    def update(self, **values):
+        for name, value in values.items():
+            self.set(name, value)
+
+
+class BlePayloadCompiler(object):
+    """Build a payload from AD structures, then compile() it.
+
+    Each method appends one AD structure and names its variable fields, e.g.
+
+        payload = BlePayloadCompiler().flags().eddystone_tlm().compile()
+        payload.set("battery", 2950)
+
+    compile() enforces the 31-byte limit, so a payload that would not fit
+    fails when it is built, not when the dongle rejects it.
+    """
+    def __init__(self):
+        self._data = bytearray()
+        self._fields = {}
+        self._eddystone_listed = False
+
+    def _structure(self, ad_type, content):
+        """Append an AD structure, returns the offset of its content."""
+        self._data += bytes((len(content) + 1, ad_type))
+        offset = len(self._data)
+        self._data += content
+        return offset
+
+    def _field(self, name, offset, codec, scale=1):
+        if name in self._fields:
+            raise ValueError("Duplicate payload field '%s'" % name)
+        self._fields[name] = (offset, codec, scale)
+
+    def flags(self, flags=FLAGS_GENERAL_DISCOVERABLE):
+        self._field("flags", self._structure(AD_FLAGS, bytes((flags,))), _UINT8)
+        return self
+
+    def ibeacon(self, uuid, major=1, minor=1, measured_power=-58):
+        """Apple iBeacon: fields uuid, major, minor and measured_power (dBm).
+
+        Major and minor are written big-endian, as the iBeacon specification
+        and BleScanner have them.
+        """
+        offset = self._structure(AD_MANUFACTURER_DATA, bytes(25))
+        _UINT16_LE.pack_into(self._data, offset, APPLE_COMPANY_ID)
+        self._data[offset + 2:offset + 4] = b"\x02\x15"
+        self._field("uuid", offset + 4, None, 16)
+        self._field("major", offset + 20, _UINT16_BE)
+        self._field("minor", offset + 22, _UINT16_BE)
+        self._field("measured_power", offset + 24, _INT8)
+        self._set(uuid=uuid, major=major, minor=minor, measured_power=measured_power)
+        return self
+
+    def altbeacon(self, beacon_id, reference_rssi=-59, reserved=0, company_id=RADIUS_NETWORKS_COMPANY_ID):
+        """AltBeacon: fields beacon_id (20 bytes), reference_rssi and reserved."""
+        offset = self._structure(AD_MANUFACTURER_DATA, bytes(26))
+        _UINT16_LE.pack_into(self._data, offset, company_id)
+        self._data[offset + 2:offset + 4] = b"\xBE\xAC"
+        self._field("beacon_id", offset + 4, None, 20)
+        self._field("reference_rssi", offset + 24, _INT8)
+        self._field("reserved", offset + 25, _UINT8)
+        self._set(beacon_id=beacon_id, reference_rssi=reference_rssi, reserved=reserved)
+        return self
+
+    def _eddystone(self, frame_type, length):
+        if not self._eddystone_listed:
+            self._structure(AD_COMPLETE_16BIT_UUIDS, _UINT16_LE.pack(EDDYSTONE_SERVICE_UUID))
+            self._eddystone_listed = True
+        offset = self._structure(AD_SERVICE_DATA, bytes(3 + length))
+        _UINT16_LE.pack_into(self._data, offset, EDDYSTONE_SERVICE_UUID)
+        self._data[offset + 2] = frame_type
+        return offset + 3
+
+    def eddystone_uid(self, namespace, instance, tx_power=-20):
+        """Eddystone-UID: fields tx_power (at 0 m), namespace (10 bytes) and instance (6 bytes)."""
+        offset = self._eddystone(EDDYSTONE_UID, 19)
+        self._field("tx_power", offset, _INT8)
+        self._field("namespace", offset + 1, None, 10)
+        self._field("instance", offset + 11, None, 6)
+        self._set(tx_power=tx_power, namespace=namespace, instance=instance)
+        return self
+
+    def eddystone_url(self, url, tx_power=-20):
+        """Eddystone-URL: field tx_power, the URL length is fixed once compiled."""
+        encoded = eddystone_url_bytes(url)
+        offset = self._eddystone(EDDYSTONE_URL, 1 + len(encoded))
+        self._field("tx_power", offset, _INT8)
+        self._data[offset + 1:offset + 1 + len(encoded)] = encoded
+        self._set(tx_power=tx_power)
+        return self
+
+    def eddystone_tlm(self, battery=0, temperature=-128.0, adv_count=0, uptime=0.0):
+        """Eddystone-TLM: fields battery (mV), temperature (C), adv_count and uptime (s)."""
+        offset = self._eddystone(EDDYSTONE_TLM, 13)
+        self._field("battery", offset + 1, _UINT16_BE)
+        self._field("temperature", offset + 3, _INT16_BE, 256)
+        self._field("adv_count", offset + 5, _UINT32_BE)
+        self._field("uptime", offset + 9, _UINT32_BE, 10)
+        self._set(battery=battery, temperature=temperature, adv_count=adv_count, uptime=uptime)
+        return self
+
+    def local_name(self, name, complete=True):
+        """Local name, as sent in the scan response."""
+        self._structure(AD_COMPLETE_LOCAL_NAME if complete else AD_SHORTENED_LOCAL_NAME, name.encode("utf-8"))
+        return self
+
+    def manufacturer_data(self, company_id, data):
+        """Manufacturer specific data: field manufacturer_data, of a fixed length."""
+        offset = self._structure(AD_MANUFACTURER_DATA, _UINT16_LE.pack(company_id) + bytes(data))
+        self._field("manufacturer_data", offset + 2, None, len(data))
+        return self
+
+    def _set(self, **values):
+        # Initial values, encoded as BlePayload.set() does
+        for name, value in values.items():
+            offset, codec, scale = self._fields[name]
+            if codec is None:
+                if len(value) != scale:
+                    raise ValueError("Field %s is %d bytes, got %d" % (name, scale, len(value)))
+                self._data[offset:offset + scale] = bytes(value)
+            elif scale == 1:
+                codec.pack_into(self._data, offset, value)
+            else:
+                codec.pack_into(self._data, offset, int(round(value * scale)))
+
+    def compile(self, scan_response=False):
+        """Return a BlePayload, raises ValueError if it exceeds 31 bytes."""
+        if len(self._data) > ADV_DATA_MAX_LENGTH:
+            raise ValueError("Payload is %d bytes, max %d" % (len(self._data), ADV_DATA_MAX_LENGTH))
+        return BlePayload(self._data, dict(self._fields), scan_response)
@@ -0,0 +1,160 @@
+import collections
+
+# BGAPI header: message type (bit 7), technology type (bits 6..3),
+# payload length (bits 2..0 of byte 0 + byte 1), class, command/event id
+HEADER_SIZE = 4
+PAYLOAD_MAX_LENGTH = 0x7FF
+
+MESSAGE_RESPONSE = 0x00
+MESSAGE_EVENT = 0x80
+
+# Offset of the uint16 result code in the response payloads we care about;
+# every response not listed here carries it first
+_RESULT_OFFSET = {
+    (3, 0): 1, # connection_disconnect: connection, result
+}
+
+
+def payload_length(header):
+    """Return the payload length announced by a BGAPI header."""
+    return ((header[0] & 0x07) << 8) | header[1]
+
+
+def is_header(first_byte):
+    """Tell whether a byte can start a Bluetooth BGAPI packet."""
+    return not first_byte & 0x78
+
+
+def result_code(cls, cmd, payload):
+    """Return the uint16 result code of a response payload."""
+    offset = _RESULT_OFFSET.get((cls, cmd), 0)
+    return payload[offset] | (payload[offset + 1] << 8)
+
+
+class BgapiPacket(object):
+    """A BGAPI packet living in one slot of the reader's ring buffer.
+
+    ``payload`` is a memoryview into the ring buffer and stays valid until the
+    slot is reused, i.e. for the next ``slots - 1`` packets.
+    """
+    __slots__ = ("buffer", "view", "msg_type", "cls", "cmd", "length", "payload")
+
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.msg_type = None
+        self.cls = None
+        self.cmd = None
+        self.length = 0
+        self.payload = self.view[HEADER_SIZE:HEADER_SIZE]
+
+    def decode(self):
+        """Decode the header already stored in the slot buffer."""
+        view = self.view
+        length = payload_length(view)
+        self.msg_type = view[0] & 0x80
+        self.length = length
+        self.cls = view[2]
+        self.cmd = view[3]
+        self.payload = view[HEADER_SIZE:HEADER_SIZE + length]
+        return self
+
+    def is_event(self):
+        return self.msg_type == MESSAGE_EVENT
+
+    def result(self):
+        """Return the uint16 result code of a response packet."""
+        return result_code(self.cls, self.cmd, self.payload)
+
+    def __repr__(self):
+        return "BgapiPacket(%s, class=%d, id=%d, payload=%s)" % (
+            "event" if self.is_event() else "response", self.cls, self.cmd, self.payload.hex())
+
+
+class BgapiReader(object):
+    """Header-driven BGAPI packet reader.
+
+    Reads the 4-byte header, then exactly the length-prefixed payload, into a
+    preallocated ring of packet slots. Events received while waiting for a
+    response are queued in ``events`` (or handed to ``on_event``) instead of
+    being mistaken for the response.
+    """
+    def __init__(self, connection, slots=16, on_event=None, metrics=None):
+        self.serial = connection
+        self.on_event = on_event
+        self.metrics = metrics
+        self.events = collections.deque()
+        self.dropped_events = 0
+        self._slots = [BgapiPacket(HEADER_SIZE + PAYLOAD_MAX_LENGTH) for _ in range(slots)]
+        self._next = 0
+
+    def reset(self):
+        """Forget queued events, e.g. after the serial input was flushed."""
+        self.events.clear()
+        if self.metrics is not None:
+            self.metrics.flushed()
+
+    def _readinto(self, view):
+        """Fill view from the serial port, returns False on timeout."""
+        data = self.serial.read(len(view))
+        view[:len(data)] = data
+        if self.metrics is not None:
+            self.metrics.read(len(data))
+        return len(data) == len(view)
+
+    def _next_slot(self):
+        packet = self._slots[self._next]
+        self._next = (self._next + 1) % len(self._slots)
+        # Slots are reused in arrival order, so a queued event being
+        # overwritten is always the oldest one
+        if self.events and self.events[0] is packet:
+            self.events.popleft()
+            self.dropped_events += 1
+        return packet
+
+    def read_packet(self):
+        """Read the next packet, returns None if the port timed out."""
+        packet = self._next_slot()
+        view = packet.view
+        if not self._readinto(view[:HEADER_SIZE]):
+            return None
+
+        # Resynchronise on a byte that is not a Bluetooth BGAPI header
+        while not is_header(view[0]):
+            view[0:3] = view[1:4]
+            if not self._readinto(view[3:4]):
+                return None
+
+        length = payload_length(view)
+        if not self._readinto(view[HEADER_SIZE:HEADER_SIZE + length]):
+            return None
+        return packet.decode()
+
+    def read_response(self, cls, cmd):
+        """Read packets until the response to (cls, cmd) arrives.
+
+        Returns the response result code, or None if the port timed out.
+        """
+        while True:
+            packet = self.read_packet()
+            if packet is None:
+                if self.metrics is not None:
+                    self.metrics.timed_out(cls, cmd)
+                return None
+            if packet.msg_type == MESSAGE_EVENT:
+                self._dispatch(packet)
+            elif packet.cls == cls and packet.cmd == cmd:
+                result = packet.result()
+                if self.metrics is not None:
+                    self.metrics.received(cls, cmd, result)
+                return result
+            elif self.metrics is not None:
+                self.metrics.unmatched(packet.cls, packet.cmd)
+
+    def _dispatch(self, packet):
+        if self.metrics is not None:
+            self.metrics.event()
+        if self.on_event is not None:
+            self.on_event(packet)
+        else:
+            self.events.append(packet)
@@ -1,7 +1,24 @@
+from ble.reader import BgapiReader
+from ble.batch import BleBatch
+from ble.stack import BleStack, MODE_OFF
+from ble.state import BleDongleState
+
 class BleRole(object):
-    def __init__(self, connection, params):
+    def __init__(self, connection, params, metrics=None):
         self.serial = connection
         self.params = params
+        self.metrics = metrics
+        self.reader = BgapiReader(connection, metrics=metrics)
+
+    def batch(self):
+        """Return an empty pipelined command batch on this role's link."""
+        return BleBatch(self.serial, self.reader)
+
+    def attach(self, connection):
+        """Continue on a new serial connection, e.g. after a replug."""
+        self.serial = connection
+        self.reader.serial = connection
+        self.reader.reset()
 
     def start(self):
         pass
@@ -10,4 +27,125 @@ class BleRole(object):
         pass
 
     def config(self, attrname, value):
-        pass
\ No newline at end of file
+        pass
+
+class AsyncBleRole(object):
+    def __init__(self, transport, params, metrics=None):
+        self.transport = transport
+        self.serial = transport.serial
+        self.params = params
+        self.metrics = metrics or transport.metrics
+        transport.metrics = self.metrics
+
+    def batch(self):
+        """Return an empty pipelined command batch on this role's transport."""
+        return self.transport.batch()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def config(self, attrname, value):
+        pass
+
+
+class BleDongleMixin(object):
+    """State-tracked reconfiguration shared by the advertiser and scanner.
+
+    A role queues the commands that bring a copy of the known dongle state
+    to the target state; only those that differ are sent, unless forced.
+    """
+    def __init__(self, connection, params, metrics=None):
+        super().__init__(connection, params, metrics)
+        self.state = BleDongleState()
+        """ Last requested activity, "start" or "stop", restored after a link failure"""
+        self.desired = None
+
+    def _queue_stop(self, batch, target, stop_advertising=True):
+        """ Nothing may be connected, advertising or scanning: these may fail"""
+        batch.check = False
+
+        """ Disconnect if we are connected already"""
+        if target.connected is not False:
+            BleStack.ble_cmd_connection_disconnect(batch, 0)
+            target.connected = False
+
+        """ Stop advertising if we are advertising already """
+        if stop_advertising and target.mode != MODE_OFF:
+            BleStack.ble_cmd_gap_set_mode(batch, *MODE_OFF)
+            target.mode = MODE_OFF
+
+        """ Stop scanning if we are scanning already"""
+        if target.scanning is not False:
+            BleStack.ble_cmd_gap_end_procedure(batch)
+            target.scanning = False
+
+        batch.check = True
+
+    def _prepare(self, queue, force):
+        """ Queue the commands of a reconfiguration, only those whose target
+            state differs from the known dongle state unless forced"""
+        if force:
+            self.state.invalidate()
+        target = self.state.copy()
+        batch = self.batch()
+        queue(batch, target)
+        return batch, target
+
+
+class BleDongleRole(BleDongleMixin, BleRole):
+    def start(self, force=False):
+        self.desired = "start"
+        self._execute(*self._prepare(self._queue_start, force))
+
+    def stop(self, force=False):
+        self.desired = "stop"
+        self._execute(*self._prepare(self._queue_stop, force))
+
+    def _execute(self, batch, target):
+        if not len(batch):
+            return
+
+        """Flush the serial buffers"""
+        #print ("Flushing serial I/O buffers...")
+        self.serial.flushInput()
+        self.serial.flushOutput()
+        self.reader.reset()
+
+        try:
+            batch.execute()
+        except Exception:
+            self.state.invalidate()
+            raise
+        self.state = target
+        for notice in batch.notices:
+            print (notice)
+
+
+class AsyncBleDongleRole(BleDongleMixin, AsyncBleRole):
+    async def start(self, force=False):
+        self.desired = "start"
+        await self._execute(*self._prepare(self._queue_start, force))
+
+    async def stop(self, force=False):
+        self.desired = "stop"
+        await self._execute(*self._prepare(self._queue_stop, force))
+
+    async def _execute(self, batch, target):
+        if not len(batch):
+            return
+
+        """Flush the serial buffers"""
+        self.transport.flush()
+        self.serial.reset_output_buffer()
+
+        try:
+            await batch.execute()
+        except Exception:
+            self.state.invalidate()
+            raise
+        self.state = target
+        for notice in batch.notices:
+            print (notice)
@@ -0,0 +1,102 @@
+import csv
+
+from ble.stack import BleStack
+from ble.advertiser import ibeacon_adv_data
+from ble.optionparser import BleParsedArgs
+from ble.batch import BleBatchError
+
+# Measured power at 1 m, in dBm, when an identity does not give one
+DEFAULT_TX_POWER = -58
+
+
+class BleIdentityTable(object):
+    """Compact table of beacon identities.
+
+    Every identity is stored as its ready-to-send gap_set_adv_data command
+    frame (36 bytes) in one contiguous bytearray, so switching identity is a
+    single write of a slice and no Python object is kept per identity.
+    """
+    FRAME_SIZE = 36
+
+    def __init__(self):
+        self._frames = bytearray()
+        self._view = None
+
+    def __len__(self):
+        return len(self._frames) // self.FRAME_SIZE
+
+    def add(self, uuid, major, minor, tx_power=DEFAULT_TX_POWER):
+        """Append an identity, uuid being the list of its 16 bytes."""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        offset = len(self._frames)
+        self._frames.extend(bytes(self.FRAME_SIZE))
+        BleStack.pack_gap_set_adv_data_into(self._frames, offset, 0, ibeacon_adv_data(uuid, major, minor, tx_power))
+
+    def frame(self, index):
+        """Return the gap_set_adv_data frame of an identity."""
+        if self._view is None:
+            self._view = memoryview(self._frames)
+        offset = index * self.FRAME_SIZE
+        return self._view[offset:offset + self.FRAME_SIZE]
+
+    def identity(self, index):
+        """Decode an identity back to (uuid, major, minor, tx_power)."""
+        frame = self.frame(index)
+        return (list(frame[15:31]), (frame[31] << 8) | frame[32], (frame[33] << 8) | frame[34],
+                frame[35] - 256 if frame[35] > 127 else frame[35])
+
+    @staticmethod
+    def load(filepath):
+        """Stream a CSV file of uuid,major,minor[,tx_power] rows into a table.
+
+        Major and minor are 2-byte hex values as on the command line, the
+        optional tx power is the measured power at 1 m in dBm.
+        """
+        table = BleIdentityTable()
+        with open(filepath, newline='') as csvfile:
+            for line, row in enumerate(csv.reader(csvfile), 1):
+                if not row or row[0].startswith("#") or row[0].lower() == "uuid":
+                    continue
+                try:
+                    uuid = BleParsedArgs.parseUuid(row[0].strip())
+                    major = BleParsedArgs.parseWord(row[1].strip(), "major", "-j")
+                    minor = BleParsedArgs.parseWord(row[2].strip(), "minor", "-n")
+                    tx_power = int(row[3]) if len(row) > 3 and row[3].strip() else DEFAULT_TX_POWER
+                    if not -128 <= tx_power <= 127:
+                        raise ValueError("Invalid tx power %d, must be between -128 and 127 dBm" % tx_power)
+                except (ValueError, IndexError) as e:
+                    raise ValueError("%s:%d: %s" % (filepath, line, e))
+                table.add(uuid, major, minor, tx_power)
+        if not len(table):
+            raise ValueError("%s: no identity" % filepath)
+        return table
+
+
+class BleRotator(object):
+    """Cycle an advertising dongle through the identities of a table.
+
+    Advertising parameters and mode are left untouched: every switch only
+    sends gap_set_adv_data with the precomputed frame of the next identity.
+    """
+    def __init__(self, advertiser, table, dwell):
+        self.advertiser = advertiser
+        self.table = table
+        self.dwell = dwell
+        self.index = -1
+
+    def switch(self, index=None):
+        """Advertise the given identity, or the next one in the table."""
+        if index is None:
+            index = (self.index + 1) % len(self.table)
+        frame = self.table.frame(index)
+        self.advertiser.serial.write(frame)
+        if self.advertiser.reader.metrics is not None:
+            self.advertiser.reader.metrics.sent(frame)
+        result = self.advertiser.reader.read_response(6, 9)
+        if result != 0:
+            self.advertiser.state.adv_data = None
+            raise BleBatchError(6, 9, result)
+        self.advertiser.state.adv_data = bytes(frame[6:])
+        self.index = index
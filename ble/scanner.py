@@ -0,0 +1,344 @@
+import array, collections, select, struct, time
+
+try:
+    import numpy
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:  # optional, only the scanner needs it
+    numpy = None
+
+from ble.role import BleDongleRole
+from ble.stack import BleStack
+from ble.reader import HEADER_SIZE
+
+# gap_discover modes
+GAP_DISCOVER_LIMITED, GAP_DISCOVER_GENERIC, GAP_DISCOVER_OBSERVATION = 0, 1, 2
+
+# gap_scan_response event payload: rssi, packet_type, sender (6), address_type, bond, data length
+_REPORT_HEADER_SIZE = 11
+
+# Manufacturer data structure of an iBeacon: length, type, Apple company id,
+# iBeacon type and length, then uuid (16), major, minor and tx power
+_IBEACON_PREFIX = (0x1A, 0xFF, 0x4C, 0x00, 0x02, 0x15)
+_IBEACON_PREFIX_BYTES = bytes(_IBEACON_PREFIX)
+_IBEACON_SIZE = 27
+_ADV_DATA_SIZE = 31
+
+# Below this many bytes, about 45 iBeacon reports, a read is parsed one
+# report at a time: the fixed cost of the NumPy calls would outweigh them
+BULK_MIN_SIZE = 2048
+_REPORT = struct.Struct('<bB6sBBB')
+_IBEACON = struct.Struct('>6x16sHHb')
+# A REPORT_DTYPE record, as packed in native byte order
+_RECORD = struct.Struct('=dQBBb?16sHHb')
+_NOT_IBEACON = (False, bytes(16), 0, 0, 0)
+
+if numpy is not None:
+    REPORT_DTYPE = numpy.dtype([
+        ("time", "f8"),             # time.monotonic() of the read that brought the report
+        ("address", "u8"),          # 48-bit address, as printed AA:BB:...
+        ("address_type", "u1"),
+        ("packet_type", "u1"),
+        ("rssi", "i1"),
+        ("ibeacon", "?"),
+        ("uuid", "u1", (16,)),
+        ("major", "u2"),
+        ("minor", "u2"),
+        ("tx_power", "i1"),
+    ])
+    BEACON_DTYPE = numpy.dtype([("uuid", "u1", (16,)), ("major", ">u2"), ("minor", ">u2")])
+    STATS_FIELDS = [("count", "u4"), ("rssi_mean", "f4"), ("rssi_std", "f4"), ("rssi_min", "i1"), ("rssi_max", "i1"), ("last_seen", "f8")]
+    _IBEACON_PREFIX_ARRAY = numpy.array(_IBEACON_PREFIX, dtype=numpy.uint8)
+    # A gap_scan_response event, as it comes over the wire
+    WIRE_DTYPE = numpy.dtype([
+        ("header", "u1", (HEADER_SIZE,)),
+        ("rssi", "i1"),
+        ("packet_type", "u1"),
+        ("sender", "u1", (6,)),
+        ("address_type", "u1"),
+        ("bond", "u1"),
+        ("length", "u1"),
+        ("data", "u1", (_ADV_DATA_SIZE,)),
+    ])
+    # The iBeacon structure, wherever it is in the advertising data
+    IBEACON_DTYPE = numpy.dtype([
+        ("prefix", "u1", (len(_IBEACON_PREFIX),)),
+        ("uuid", "u1", (16,)),
+        ("major", ">u2"),
+        ("minor", ">u2"),
+        ("tx_power", "i1"),
+    ])
+
+
+def _chained_reports(raw):
+    """Return (offsets, end) of the gap_scan_response events following each
+    other from the start of raw, found without a Python loop: candidate
+    headers are matched on all bytes at once and kept while each one ends
+    where the next one starts. A candidate made of data bytes, or another
+    kind of packet, breaks the chain, the rest is then left to the caller."""
+    starts = numpy.flatnonzero((raw[:-3] == 0x80) & (raw[2:-1] == 6) & (raw[3:] == 0))
+    if not len(starts) or starts[0] != 0:
+        return starts[:0], 0
+    ends = starts + HEADER_SIZE + raw[starts + 1]
+    broken = numpy.flatnonzero(ends[:-1] != starts[1:])
+    count = broken[0] + 1 if len(broken) else len(starts)
+    count = numpy.searchsorted(ends[:count], len(raw), "right")
+    return starts[:count], int(ends[count - 1]) if count else 0
+
+
+def parse_scan_reports(buffer, now=0.0):
+    """Parse the gap_scan_response events of a chunk of BGAPI bytes in bulk.
+
+    Every field of every report is gathered at once with NumPy indexing,
+    without one Python object per report, and so are the packet boundaries
+    while the chunk holds nothing but reports. Returns (reports, consumed):
+    a REPORT_DTYPE array and the number of bytes parsed, the rest being an
+    incomplete packet. The iBeacon structure is found wherever it is in the
+    advertising data, with or without a flags structure before it. Reads
+    shorter than BULK_MIN_SIZE are parsed one report at a time instead.
+    """
+    end = len(buffer)
+    if end < BULK_MIN_SIZE:
+        return _parse_scan_reports_struct(buffer, now)
+    raw = numpy.frombuffer(buffer, numpy.uint8, end)
+    chained, offset = _chained_reports(raw)
+
+    # Walk the packets past the chain one by one
+    offsets = array.array('q')
+    while offset + HEADER_SIZE <= end:
+        first = buffer[offset]
+        # Resynchronise on a byte that is not a Bluetooth BGAPI header
+        if first & 0x78:
+            offset += 1
+            continue
+        size = HEADER_SIZE + (((first & 0x07) << 8) | buffer[offset + 1])
+        if offset + size > end:
+            break
+        if first & 0x80 and buffer[offset + 2] == 6 and buffer[offset + 3] == 0:
+            offsets.append(offset)
+        offset += size
+    if offsets:
+        chained = numpy.concatenate((chained, numpy.frombuffer(offsets, numpy.int64)))
+    chained = chained[raw[chained + 1] >= _REPORT_HEADER_SIZE]
+
+    reports = numpy.zeros(len(chained), REPORT_DTYPE)
+    if not len(chained):
+        return reports, offset
+
+    # One fixed-size row per report, as long as the longest one, read through
+    # the WIRE_DTYPE view; past the end of a shorter report, its row holds
+    # the next bytes, never looked at: the data length bounds every access
+    padded = numpy.concatenate((raw[:offset], numpy.zeros(WIRE_DTYPE.itemsize, numpy.uint8)))
+    rows = sliding_window_view(padded, WIRE_DTYPE.itemsize)[chained]
+    wire = rows.view(WIRE_DTYPE)[:, 0]
+    length = numpy.minimum(numpy.minimum(wire["length"], raw[chained + 1] - _REPORT_HEADER_SIZE), _ADV_DATA_SIZE)
+    found = _find_ibeacons(wire["data"], length)
+    addresses = numpy.zeros((len(rows), 8), numpy.uint8)
+    addresses[:, :6] = wire["sender"]
+
+    reports["time"] = now
+    reports["address"] = addresses.view("<u8")[:, 0]
+    for name in ("address_type", "packet_type", "rssi"):
+        reports[name] = wire[name]
+    ibeacon = found >= 0
+    reports["ibeacon"] = ibeacon
+    if ibeacon.any():
+        data = wire["data"][ibeacon]
+        columns = found[ibeacon, None] + numpy.arange(_IBEACON_SIZE)
+        beacons = data[numpy.arange(len(data))[:, None], columns].view(IBEACON_DTYPE)[:, 0]
+        for name in ("uuid", "major", "minor", "tx_power"):
+            reports[name][ibeacon] = beacons[name]
+    return reports, offset
+
+
+def _parse_scan_reports_struct(buffer, now):
+    """parse_scan_reports() of a short read: one struct unpack per report."""
+    end = len(buffer)
+    offset = 0
+    records = bytearray()
+    while offset + HEADER_SIZE <= end:
+        first = buffer[offset]
+        # Resynchronise on a byte that is not a Bluetooth BGAPI header
+        if first & 0x78:
+            offset += 1
+            continue
+        size = HEADER_SIZE + (((first & 0x07) << 8) | buffer[offset + 1])
+        if offset + size > end:
+            break
+        if first & 0x80 and buffer[offset + 2] == 6 and buffer[offset + 3] == 0 and size >= HEADER_SIZE + _REPORT_HEADER_SIZE:
+            rssi, packet_type, sender, address_type, bond, length = _REPORT.unpack_from(buffer, offset + HEADER_SIZE)
+            data = offset + HEADER_SIZE + _REPORT_HEADER_SIZE
+            data_end = data + min(length, size - HEADER_SIZE - _REPORT_HEADER_SIZE, _ADV_DATA_SIZE)
+            address = int.from_bytes(sender, "little")
+            """ Walk the AD structures up to the iBeacon one, if any"""
+            ibeacon = _NOT_IBEACON
+            while data + _IBEACON_SIZE <= data_end:
+                if buffer[data:data + len(_IBEACON_PREFIX)] == _IBEACON_PREFIX_BYTES:
+                    ibeacon = (True,) + _IBEACON.unpack_from(buffer, data)
+                    break
+                if not buffer[data]:
+                    data = data_end
+                else:
+                    data += buffer[data] + 1
+            records += _RECORD.pack(now, address, address_type, packet_type, rssi, *ibeacon)
+        offset += size
+    return numpy.frombuffer(records, REPORT_DTYPE).copy(), offset
+
+
+def _find_ibeacons(data, length):
+    """Return the offset of the iBeacon structure in the advertising data of
+    every report, -1 if it has none. The AD structures of all reports are
+    walked together, one structure of each per step: the walk of a report
+    stops on its iBeacon, on a zero length or once no iBeacon fits anymore."""
+    found = numpy.full(len(data), -1, numpy.intp)
+    position = numpy.zeros(len(data), numpy.intp)
+    live = numpy.flatnonzero(length >= _IBEACON_SIZE)
+    while len(live):
+        at = position[live]
+        match = (data[live[:, None], at[:, None] + numpy.arange(len(_IBEACON_PREFIX))] == _IBEACON_PREFIX_ARRAY).all(axis=1)
+        found[live[match]] = at[match]
+        step = data[live, at].astype(numpy.intp)
+        position[live] = at + step + 1
+        live = live[~match & (step > 0) & (position[live] + _IBEACON_SIZE <= length[live])]
+    return found
+
+
+class BleRssiWindow(object):
+    """Per-beacon RSSI statistics over the last ``window`` seconds.
+
+    Report arrays are kept as they come and grouped only when stats() is
+    asked for, by iBeacon identity (key "beacon") or by address.
+    """
+    def __init__(self, window=10.0, key="beacon"):
+        if key not in ("beacon", "address"):
+            raise ValueError("Unknown key '%s', must be beacon or address" % key)
+        self.window = window
+        self.key = key
+        self._chunks = collections.deque()
+
+    def add(self, reports):
+        if len(reports):
+            self._chunks.append(reports)
+
+    def _prune(self, now):
+        horizon = now - self.window
+        while self._chunks and self._chunks[0]["time"].max() < horizon:
+            self._chunks.popleft()
+
+    def stats(self, now=None):
+        """Return one record per beacon: its key fields, count, rssi_mean,
+        rssi_std, rssi_min, rssi_max and last_seen."""
+        if now is None:
+            now = time.monotonic()
+        self._prune(now)
+        if self.key == "beacon":
+            key_dtype = BEACON_DTYPE
+        else:
+            key_dtype = numpy.dtype([("address", "u8")])
+        stats_dtype = numpy.dtype(key_dtype.descr + STATS_FIELDS)
+        if not self._chunks:
+            return numpy.zeros(0, stats_dtype)
+        reports = numpy.concatenate(self._chunks)
+        reports = reports[reports["time"] >= now - self.window]
+        if self.key == "beacon":
+            reports = reports[reports["ibeacon"]]
+            keys = numpy.empty(len(reports), BEACON_DTYPE)
+            keys["uuid"] = reports["uuid"]
+            keys["major"] = reports["major"]
+            keys["minor"] = reports["minor"]
+            unique, inverse = numpy.unique(keys.view("V%d" % BEACON_DTYPE.itemsize), return_inverse=True)
+            unique = unique.view(BEACON_DTYPE)
+        else:
+            unique, inverse = numpy.unique(reports["address"], return_inverse=True)
+        inverse = inverse.ravel()
+
+        stats = numpy.zeros(len(unique), stats_dtype)
+        if self.key == "beacon":
+            for name in BEACON_DTYPE.names:
+                stats[name] = unique[name]
+        else:
+            stats["address"] = unique
+        rssi = reports["rssi"].astype(numpy.float64)
+        count = numpy.bincount(inverse, minlength=len(unique))
+        mean = numpy.bincount(inverse, rssi, len(unique)) / numpy.maximum(count, 1)
+        square = numpy.bincount(inverse, rssi * rssi, len(unique)) / numpy.maximum(count, 1)
+        stats["count"] = count
+        stats["rssi_mean"] = mean
+        stats["rssi_std"] = numpy.sqrt(numpy.maximum(square - mean * mean, 0))
+        stats["rssi_min"] = 127
+        stats["rssi_max"] = -128
+        numpy.minimum.at(stats["rssi_min"], inverse, reports["rssi"])
+        numpy.maximum.at(stats["rssi_max"], inverse, reports["rssi"])
+        numpy.maximum.at(stats["last_seen"], inverse, reports["time"])
+        return stats
+
+
+class BleScanner(BleDongleRole):
+    """Observe the advertisements around a dongle.
+
+    ``start()`` sets the scan parameters and starts a gap_discover
+    procedure, sending only what differs from the known dongle state, as
+    the advertiser does. ``poll()`` then reads whatever the dongle sent in
+    one read() and parses the reports in bulk with parse_scan_reports(),
+    feeding ``rssi``, a BleRssiWindow. Scan interval and window are in ms.
+    """
+    def __init__(self, connection, params, metrics=None, interval=75, window=50, active=False,
+                 mode=GAP_DISCOVER_OBSERVATION, stats_window=10.0, key="beacon"):
+        if numpy is None:
+            raise ImportError("BleScanner needs numpy: pip install numpy")
+        super().__init__(connection, params, metrics)
+        self.scan_parameters = (int(interval / 0.625), int(window / 0.625), 1 if active else 0)
+        self.mode = mode
+        self.rssi = BleRssiWindow(stats_window, key)
+        self.reports = 0
+        self._buffer = bytearray()
+
+    def attach(self, connection):
+        super().attach(connection)
+        del self._buffer[:]
+
+    def _queue_start(self, batch, target):
+        if target.scanning is True and target.scan_parameters == self.scan_parameters:
+            return
+
+        """ Scan parameters are only accepted while nothing else goes on"""
+        self._queue_stop(batch, target)
+
+        if target.scan_parameters != self.scan_parameters:
+            BleStack.ble_cmd_gap_set_scan_parameters(batch, *self.scan_parameters)
+            target.scan_parameters = self.scan_parameters
+
+        """ Discover only once the scan parameters have been accepted"""
+        batch.barrier()
+        BleStack.ble_cmd_gap_discover(batch, self.mode)
+        target.scanning = True
+
+    def _execute(self, batch, target):
+        if not len(batch):
+            return
+        del self._buffer[:]
+        super()._execute(batch, target)
+
+        """ Keep the reports received while waiting for the responses"""
+        for packet in self.reader.events:
+            self._buffer += packet.view[:HEADER_SIZE + packet.length]
+        self.reader.events.clear()
+
+    def poll(self, timeout=0.0):
+        """Read and parse the reports received so far, waiting up to timeout
+        for the first ones. Returns them as a REPORT_DTYPE array."""
+        if timeout is None or timeout > 0:
+            select.select([self.serial], [], [], timeout)
+        waiting = self.serial.in_waiting
+        if waiting:
+            data = self.serial.read(waiting)
+            if self.metrics is not None:
+                self.metrics.read(len(data))
+            self._buffer += data
+        reports, consumed = parse_scan_reports(self._buffer, time.monotonic())
+        del self._buffer[:consumed]
+        if len(reports):
+            self.reports += len(reports)
+            if self.metrics is not None:
+                self.metrics.event(len(reports))
+            self.rssi.add(reports)
+        return reports
@@ -0,0 +1,144 @@
+import collections, select, struct, time
+
+from ble.reader import MESSAGE_EVENT
+
+# gap_scan_response event: rssi, packet_type, sender, address_type, ...
+_SCAN_RESPONSE_EVENT = struct.Struct('<bB6sB')
+PACKET_TYPE_SCAN_REQUEST = 3
+
+
+def _scan_request(packet):
+    """Return (address, address_type, rssi) if packet is a scan request event."""
+    if packet.msg_type == MESSAGE_EVENT and packet.cls == 6 and packet.cmd == 0 and packet.length >= _SCAN_RESPONSE_EVENT.size:
+        rssi, packet_type, address, address_type = _SCAN_RESPONSE_EVENT.unpack_from(packet.payload)
+        if packet_type == PACKET_TYPE_SCAN_REQUEST:
+            return address, address_type, rssi
+    return None
+
+
+def scan_requests(reader, duration):
+    """Yield the scan requests received by an advertising dongle.
+
+    Under enhanced broadcasting (mode 0x84) the dongle reports every scan
+    request as a gap_scan_response event. The generator reads them off the
+    link as they come, including those queued by the reader while it waited
+    for a response, for duration seconds. Items are (address, address_type,
+    rssi) with the address in the little-endian BGAPI byte order.
+    """
+    end = time.monotonic() + duration
+    events = reader.events
+    while True:
+        while events:
+            request = _scan_request(events.popleft())
+            if request is not None:
+                yield request
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return
+        if not select.select([reader.serial], [], [], remaining)[0]:
+            continue
+        request = read_scan_request(reader)
+        if request is not None:
+            yield request
+
+
+def read_scan_request(reader):
+    """Read one packet off the link, returns it as a scan request or None."""
+    packet = reader.read_packet()
+    if packet is None:
+        return None
+    if reader.metrics is not None and packet.msg_type == MESSAGE_EVENT:
+        reader.metrics.event()
+    return _scan_request(packet)
+
+
+def format_address(address):
+    """Format a BGAPI (little-endian) address as AA:BB:CC:DD:EE:FF."""
+    return ":".join("%02X" % b for b in reversed(address))
+
+
+class BleScanRequestTracker(object):
+    """Deduplicate scan requesters and keep rolling per-device aggregates.
+
+    A requester is reported to ``callback`` when it has not been reported in
+    the last ``window`` seconds; repeated requests inside the window are only
+    counted. Per device it keeps the total and in-window counts and the RSSI
+    minimum, maximum and exponential moving average, for at most
+    ``max_devices`` devices: the least recently seen one is forgotten first,
+    so memory and per-event cost stay constant however busy the site is.
+    """
+    # Per-device fields, kept in a list to avoid one object per device
+    LAST_REPORT, LAST_SEEN, COUNT, WINDOW_COUNT, RSSI_AVG, RSSI_MIN, RSSI_MAX = range(7)
+
+    def __init__(self, window=10.0, max_devices=1024, callback=None, smoothing=0.2):
+        self.window = window
+        self.max_devices = max_devices
+        self.callback = callback
+        self.smoothing = smoothing
+        self.requests = 0
+        self.evicted = 0
+        self._devices = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def add(self, address, address_type, rssi, now=None):
+        """Account for one scan request, returns True if it was reported."""
+        if now is None:
+            now = time.monotonic()
+        self.requests += 1
+        devices = self._devices
+        device = devices.get(address)
+        if device is None:
+            device = [None, now, 0, 0, float(rssi), rssi, rssi]
+            devices[address] = device
+            if len(devices) > self.max_devices:
+                devices.popitem(last=False)
+                self.evicted += 1
+        else:
+            devices.move_to_end(address)
+            device[self.RSSI_AVG] += self.smoothing * (rssi - device[self.RSSI_AVG])
+            if rssi < device[self.RSSI_MIN]:
+                device[self.RSSI_MIN] = rssi
+            if rssi > device[self.RSSI_MAX]:
+                device[self.RSSI_MAX] = rssi
+        device[self.LAST_SEEN] = now
+        device[self.COUNT] += 1
+
+        last_report = device[self.LAST_REPORT]
+        if last_report is not None and now - last_report < self.window:
+            device[self.WINDOW_COUNT] += 1
+            return False
+        device[self.LAST_REPORT] = now
+        device[self.WINDOW_COUNT] = 1
+        if self.callback is not None:
+            self.callback(address, address_type, rssi, device)
+        return True
+
+    def consume(self, requests):
+        """Feed every (address, address_type, rssi) of an iterable."""
+        add = self.add
+        for address, address_type, rssi in requests:
+            add(address, address_type, rssi)
+
+    def devices(self):
+        """Yield (address, count, rssi_avg, rssi_min, rssi_max), most recent last."""
+        for address, device in self._devices.items():
+            yield address, device[self.COUNT], device[self.RSSI_AVG], device[self.RSSI_MIN], device[self.RSSI_MAX]
+
+
+class BleScanRequestLog(object):
+    """Compact append-only log of reported scan requests.
+
+    One "epoch,address,rssi,count,rssi_avg" line per report, written through
+    the file object's own buffer. Usable as a BleScanRequestTracker callback.
+    """
+    def __init__(self, filepath):
+        self._file = open(filepath, 'a', buffering=65536)
+
+    def __call__(self, address, address_type, rssi, device):
+        self._file.write("%.3f,%s,%d,%d,%.1f\n" % (time.time(), format_address(address), rssi,
+            device[BleScanRequestTracker.COUNT], device[BleScanRequestTracker.RSSI_AVG]))
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,123 @@
+import heapq, itertools, time
+
+
+class BleSchedule(object):
+    """One periodic schedule of a BleScheduler.
+
+    ``on_start`` runs every ``period`` seconds, or only once if period is
+    None, and, if a ``duration`` is given, ``on_stop`` runs ``duration``
+    seconds after each start. Edges are
+    computed from the previous scheduled edge, not from when the callback
+    actually ran, so callback time and wakeup latency never accumulate.
+    """
+    def __init__(self, scheduler, period, on_start, duration=None, on_stop=None):
+        if period is not None and period <= 0:
+            raise ValueError("Schedule period must be positive")
+        if duration is not None and period is not None and not 0 <= duration < period:
+            raise ValueError("Schedule duration must be shorter than its period")
+        self.scheduler = scheduler
+        self.period = period
+        self.duration = duration
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.scheduled = None
+        self.active = False
+        self.cycles = 0
+        self.missed = 0
+        self.cancelled = False
+
+    def cancel(self):
+        """Drop the schedule and its pending edges."""
+        self.cancelled = True
+
+
+class BleScheduler(object):
+    """Deadline scheduler for many independent duty cycles.
+
+    Edges of every schedule are kept in one heap ordered by their
+    time.monotonic() deadline; the scheduler sleeps exactly until the
+    earliest one, so it never wakes up for nothing and supports sub-second
+    periods. ``idle(timeout)`` is called to wait, time.sleep by default; a
+    caller can pass a function that does useful work until the timeout, such
+    as reading events off the link.
+    """
+    START, STOP = 0, 1
+
+    def __init__(self, idle=None):
+        self.idle = idle or time.sleep
+        self._heap = []
+        self._sequence = itertools.count()
+        self._running = False
+
+    def every(self, period, on_start, duration=None, on_stop=None, start_at=None):
+        """Add a schedule whose first start is at start_at (default now)."""
+        schedule = BleSchedule(self, period, on_start, duration, on_stop)
+        self._push(time.monotonic() if start_at is None else start_at, schedule, self.START)
+        return schedule
+
+    def at(self, deadline, callback):
+        """Run callback once at the time.monotonic() deadline."""
+        schedule = BleSchedule(self, None, callback)
+        self._push(deadline, schedule, self.START)
+        return schedule
+
+    def _push(self, deadline, schedule, edge):
+        heapq.heappush(self._heap, (deadline, next(self._sequence), schedule, edge))
+
+    def stop(self):
+        """Make run() return after the current edge."""
+        self._running = False
+
+    def run_pending(self):
+        """Run every edge whose deadline has passed, returns the next deadline."""
+        heap = self._heap
+        while heap:
+            deadline, sequence, schedule, edge = heap[0]
+            now = time.monotonic()
+            if deadline > now:
+                return deadline
+            heapq.heappop(heap)
+            if schedule.cancelled:
+                continue
+            if edge == self.START:
+                # Next start from this scheduled start, skipping the cycles
+                # an overrunning callback made us miss
+                if schedule.period is not None:
+                    next_start = deadline + schedule.period
+                    if next_start <= now:
+                        missed = int((now - next_start) // schedule.period) + 1
+                        schedule.missed += missed
+                        next_start += missed * schedule.period
+                    self._push(next_start, schedule, self.START)
+                if schedule.duration is not None:
+                    self._push(deadline + schedule.duration, schedule, self.STOP)
+                schedule.scheduled = deadline
+                schedule.active = True
+                schedule.cycles += 1
+                schedule.on_start()
+            else:
+                schedule.scheduled = deadline
+                schedule.active = False
+                if schedule.on_stop is not None:
+                    schedule.on_stop()
+        return None
+
+    def run(self, forever=False):
+        """Run the schedules until stop() is called or none is left.
+
+        With forever set, run() calls idle(None) when no schedule is left
+        instead of returning, for callers that can add schedules from idle().
+        """
+        self._running = True
+        while self._running:
+            deadline = self.run_pending()
+            if not self._running:
+                return
+            if deadline is None:
+                if not forever:
+                    return
+                self.idle(None)
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout > 0:
+                self.idle(timeout)
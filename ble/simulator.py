@@ -0,0 +1,258 @@
+import collections, heapq, select, socket, struct, threading, time
+
+from ble.stack import COMMAND_NAMES
+
+# BGAPI result codes returned by the simulated dongle
+RESULT_OK = 0x0000
+RESULT_INVALID_PARAMETER = 0x0180
+RESULT_WRONG_STATE = 0x0181
+RESULT_NOT_CONNECTED = 0x0186
+
+# Fault meaning "never answer this command"
+DROP = "drop"
+
+_COMMAND_IDS = dict((name, key) for key, name in COMMAND_NAMES.items())
+
+_BOOT_EVENT = struct.Struct('<HHHHHBB')
+_SCAN_RESPONSE_EVENT = struct.Struct('<bB6sBBB')
+
+
+class SimulatedBled112(object):
+    """In-process stand-in for a BLED112 dongle on a serial port.
+
+    It implements the part of the pyserial API used by the roles, parses
+    the BGAPI commands of BleStack, keeps a model of the dongle state and
+    answers with correct response frames, so the advertiser can be run and
+    benchmarked without hardware. Responses are delivered through a socket
+    pair, which makes ``fileno()`` usable by the asyncio transport.
+
+    ``latency`` (seconds, or a dict of command name to seconds) delays every
+    response as if the dongle took that long to process the command; commands
+    are processed one after the other. ``inject()`` makes the next commands
+    of a kind fail with a result code or go unanswered, and ``unplug()``
+    makes every further I/O raise like a removed USB device.
+    """
+    def __init__(self, latency=0.0, timeout=1):
+        self.timeout = timeout
+        self.latency = latency
+        self.mode = (0, 0)
+        self.adv_parameters = None
+        self.adv_data = b""
+        self.scan_response = b""
+        self.connected = False
+        self.scanning = False
+        self.scan_parameters = None
+        self.commands = collections.Counter()
+        self.bytes_in = 0
+        self.unplugged = False
+        self._faults = collections.defaultdict(collections.deque)
+        self._device, self._host = socket.socketpair()
+        self._host.setblocking(False)
+        self._rx = bytearray()
+        self._busy_until = 0.0
+        self._queue = []
+        self._sequence = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # pyserial API
+    def fileno(self):
+        return self._host.fileno()
+
+    @property
+    def in_waiting(self):
+        self._check()
+        try:
+            return len(self._host.recv(65536, socket.MSG_PEEK))
+        except BlockingIOError:
+            return 0
+
+    def write(self, data):
+        self._check()
+        self._rx += data
+        self.bytes_in += len(data)
+        while len(self._rx) >= 4:
+            size = 4 + (((self._rx[0] & 0x07) << 8) | self._rx[1])
+            if len(self._rx) < size:
+                break
+            frame = bytes(self._rx[:size])
+            del self._rx[:size]
+            self._execute(frame)
+        return len(data)
+
+    def read(self, size=1):
+        self._check()
+        data = bytearray()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while len(data) < size:
+            try:
+                chunk = self._host.recv(size - len(data))
+            except BlockingIOError:
+                chunk = None
+            if chunk:
+                data += chunk
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            select.select([self._host], [], [], remaining)
+        return bytes(data)
+
+    def reset_input_buffer(self):
+        self._check()
+        while True:
+            try:
+                if not self._host.recv(65536):
+                    return
+            except BlockingIOError:
+                return
+
+    def reset_output_buffer(self):
+        self._check()
+
+    flushInput = reset_input_buffer
+    flushOutput = reset_output_buffer
+
+    def close(self):
+        with self._cond:
+            self._queue = None
+            self._cond.notify()
+        self._device.close()
+        self._host.close()
+
+    # simulation controls
+    def inject(self, command, result=DROP, count=1):
+        """Fail the next count commands named command with result, or drop them."""
+        for _ in range(count):
+            self._faults[_COMMAND_IDS[command]].append(result)
+
+    def unplug(self):
+        self.unplugged = True
+
+    def emit_event(self, cls, cmd, payload=b""):
+        self._deliver(struct.pack('4B', 0x80 | (len(payload) >> 8), len(payload) & 0xFF, cls, cmd) + payload, 0.0)
+
+    def emit_scan_request(self, address, rssi, address_type=0):
+        """Emit the gap_scan_response event of a scan request (packet type 3)."""
+        self.emit_event(6, 0, _SCAN_RESPONSE_EVENT.pack(rssi, 3, bytes(address), address_type, 0xFF, 0))
+
+    def emit_scan_response(self, address, rssi, data, packet_type=0, address_type=0):
+        """Emit the gap_scan_response event of an advertisement report."""
+        self.emit_event(6, 0, _SCAN_RESPONSE_EVENT.pack(rssi, packet_type, bytes(address), address_type, 0xFF, len(data)) + bytes(data))
+
+    def _check(self):
+        if self.unplugged:
+            raise OSError("device reports readiness to read but returned no data (device disconnected?)")
+
+    def _execute(self, frame):
+        cls, cmd = frame[2], frame[3]
+        self.commands[COMMAND_NAMES.get((cls, cmd), "%d_%d" % (cls, cmd))] += 1
+        faults = self._faults.get((cls, cmd))
+        if faults:
+            result = faults.popleft()
+            if result == DROP:
+                return
+            self._respond(cls, cmd, result)
+            return
+
+        payload = frame[4:]
+        if (cls, cmd) == (0, 0):
+            self._reset()
+            self._deliver(struct.pack('4B', 0x80, _BOOT_EVENT.size, 0, 0) + _BOOT_EVENT.pack(1, 3, 2, 122, 3, 1, 1), self._latency(cls, cmd))
+        elif (cls, cmd) == (3, 0):
+            if self.connected:
+                self.connected = False
+                self._respond(cls, cmd, RESULT_OK)
+                self.emit_event(3, 4, struct.pack('<BH', 0, 0x0216))
+            else:
+                self._respond(cls, cmd, RESULT_NOT_CONNECTED)
+        elif (cls, cmd) == (6, 1):
+            self.mode = (payload[0], payload[1])
+            self._respond(cls, cmd, RESULT_OK)
+        elif (cls, cmd) == (6, 2):
+            if self.scanning or self.mode != (0, 0):
+                self._respond(cls, cmd, RESULT_WRONG_STATE)
+            else:
+                self.scanning = True
+                self._respond(cls, cmd, RESULT_OK)
+        elif (cls, cmd) == (6, 7):
+            interval, window, active = struct.unpack('<HHB', payload)
+            if not 0x4 <= window <= interval <= 0x4000:
+                self._respond(cls, cmd, RESULT_INVALID_PARAMETER)
+            else:
+                self.scan_parameters = (interval, window, active)
+                self._respond(cls, cmd, RESULT_OK)
+        elif (cls, cmd) == (6, 4):
+            result = RESULT_OK if self.scanning else RESULT_WRONG_STATE
+            self.scanning = False
+            self._respond(cls, cmd, result)
+        elif (cls, cmd) == (6, 8):
+            interval_min, interval_max, channels = struct.unpack('<HHB', payload)
+            if interval_min < 0x20 or interval_max > 0x4000 or interval_min > interval_max or not channels:
+                self._respond(cls, cmd, RESULT_INVALID_PARAMETER)
+            else:
+                self.adv_parameters = (interval_min, interval_max, channels)
+                self._respond(cls, cmd, RESULT_OK)
+        elif (cls, cmd) == (6, 9):
+            data = payload[2:2 + payload[1]]
+            if len(data) > 31 or payload[0] > 1:
+                self._respond(cls, cmd, RESULT_INVALID_PARAMETER)
+            else:
+                if payload[0]:
+                    self.scan_response = data
+                else:
+                    self.adv_data = data
+                self._respond(cls, cmd, RESULT_OK)
+        else:
+            self._respond(cls, cmd, RESULT_INVALID_PARAMETER)
+
+    def _reset(self):
+        self.mode = (0, 0)
+        self.scan_parameters = None
+        self.adv_parameters = None
+        self.adv_data = b""
+        self.scan_response = b""
+        self.connected = False
+        self.scanning = False
+
+    def _respond(self, cls, cmd, result):
+        if (cls, cmd) == (3, 0):
+            payload = struct.pack('<BH', 0, result)
+        else:
+            payload = struct.pack('<H', result)
+        self._deliver(struct.pack('4B', 0, len(payload), cls, cmd) + payload, self._latency(cls, cmd))
+
+    def _latency(self, cls, cmd):
+        if isinstance(self.latency, dict):
+            return self.latency.get(COMMAND_NAMES.get((cls, cmd)), 0.0)
+        return self.latency
+
+    def _deliver(self, packet, latency):
+        """Send packet to the host once the dongle is done with it."""
+        with self._cond:
+            now = time.monotonic()
+            if not latency and not self._queue and self._busy_until <= now:
+                self._device.sendall(packet)
+                return
+            self._busy_until = max(self._busy_until, now) + latency
+            self._sequence += 1
+            heapq.heappush(self._queue, (self._busy_until, self._sequence, packet))
+            self._cond.notify()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="SimulatedBled112", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._queue is not None and not self._queue:
+                    self._cond.wait()
+                if self._queue is None:
+                    return
+                due, sequence, packet = self._queue[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._queue)
+                self._device.sendall(packet)
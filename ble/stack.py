@@ -1,28 +1,122 @@
-import serial, time, datetime, struct
+import struct
+
+# BGAPI command codecs, compiled once instead of on every command
+_CMD_BYTE = struct.Struct('5B')
+_CMD_GAP_SET_MODE = struct.Struct('6B')
+_CMD_GAP_SET_ADV_PARAMETERS = struct.Struct('<4BHHB')
+_CMD_GAP_SET_ADV_DATA_HEADER = struct.Struct('<4BBB')
+_CMD_GAP_SET_SCAN_PARAMETERS = struct.Struct('<4BHHB')
+
+# Largest AD payload accepted by ble_cmd_gap_set_adv_data (BLE 4.x limit)
+ADV_DATA_MAX_LENGTH = 31
+# Size of a frame buffer that holds any gap_set_adv_data command
+ADV_DATA_FRAME_SIZE = _CMD_GAP_SET_ADV_DATA_HEADER.size + ADV_DATA_MAX_LENGTH
+
+# gap_set_mode (discover, connect) that stops advertising
+MODE_OFF = (0, 0)
+
+# Constant frames for argument-free or fixed-argument commands
+FRAME_GAP_END_PROCEDURE = bytes((0, 0, 6, 4))
+FRAME_GAP_SET_MODE_OFF = _CMD_GAP_SET_MODE.pack(0, 2, 6, 1, 0, 0)
+FRAME_GAP_SET_MODE_BROADCAST = _CMD_GAP_SET_MODE.pack(0, 2, 6, 1, 0x84, 0x03)
+FRAME_CONNECTION_DISCONNECT = _CMD_BYTE.pack(0, 1, 3, 0, 0)
+
+# (class, id) of every command above, as used in logs and metrics
+COMMAND_NAMES = {
+    (0, 0): "system_reset",
+    (3, 0): "connection_disconnect",
+    (6, 1): "gap_set_mode",
+    (6, 2): "gap_discover",
+    (6, 4): "gap_end_procedure",
+    (6, 7): "gap_set_scan_parameters",
+    (6, 8): "gap_set_adv_parameters",
+    (6, 9): "gap_set_adv_data",
+}
+
+_GAP_SET_MODE_FRAMES = {
+    MODE_OFF: FRAME_GAP_SET_MODE_OFF,
+    (0x84, 0x03): FRAME_GAP_SET_MODE_BROADCAST,
+}
 
 # define API commands we might use for this script
 class BleStack(object):
     @staticmethod
     def ble_cmd_system_reset(p, boot_in_dfu):
-        p.write(struct.pack('5B', 0, 1, 0, 0, boot_in_dfu))
+        p.write(_CMD_BYTE.pack(0, 1, 0, 0, boot_in_dfu))
 
     @staticmethod
     def ble_cmd_connection_disconnect(p, connection):
-        p.write(struct.pack('5B', 0, 1, 3, 0, connection))
-        
+        if connection == 0:
+            p.write(FRAME_CONNECTION_DISCONNECT)
+        else:
+            p.write(_CMD_BYTE.pack(0, 1, 3, 0, connection))
+
     @staticmethod
     def ble_cmd_gap_set_mode(p, discover, connect):
-        p.write(struct.pack('6B', 0, 2, 6, 1, discover, connect))
-        
+        frame = _GAP_SET_MODE_FRAMES.get((discover, connect))
+        if frame is None:
+            frame = _CMD_GAP_SET_MODE.pack(0, 2, 6, 1, discover, connect)
+        p.write(frame)
+
     @staticmethod
     def ble_cmd_gap_end_procedure(p):
-        p.write(struct.pack('4B', 0, 0, 6, 4))
-        
+        p.write(FRAME_GAP_END_PROCEDURE)
+
+    @staticmethod
+    def ble_cmd_gap_discover(p, mode):
+        p.write(_CMD_BYTE.pack(0, 1, 6, 2, mode))
+
+    @staticmethod
+    def ble_cmd_gap_set_scan_parameters(p, scan_interval, scan_window, active):
+        p.write(_CMD_GAP_SET_SCAN_PARAMETERS.pack(0, 5, 6, 7, scan_interval, scan_window, active))
+
     @staticmethod
     def ble_cmd_gap_set_adv_parameters(p, adv_interval_min, adv_interval_max, adv_channels):
-        p.write(struct.pack('<4BHHB', 0, 5, 6, 8, adv_interval_min, adv_interval_max, adv_channels))
-        
+        p.write(_CMD_GAP_SET_ADV_PARAMETERS.pack(0, 5, 6, 8, adv_interval_min, adv_interval_max, adv_channels))
+
+    @staticmethod
+    def ble_cmd_gap_set_adv_data(p, set_scanrsp, adv_data, frame=None):
+        """Send gap_set_adv_data, encoded into frame if given.
+
+        frame is a buffer of ADV_DATA_FRAME_SIZE bytes owned by the caller,
+        e.g. one per role, reused from one call to the next: a memoryview of
+        it is written without a copy. Without one, every call builds a new
+        frame, since the port may keep it after write() returns.
+        """
+        if frame is not None:
+            p.write(frame[:BleStack.pack_gap_set_adv_data_into(frame, 0, set_scanrsp, adv_data)])
+            return
+        length = len(adv_data)
+        if length > ADV_DATA_MAX_LENGTH:
+            raise ValueError("Advertisement data is %d bytes, max %d" % (length, ADV_DATA_MAX_LENGTH))
+        p.write(_CMD_GAP_SET_ADV_DATA_HEADER.pack(0, 2 + length, 6, 9, set_scanrsp, length) + bytes(adv_data))
+
     @staticmethod
-    def ble_cmd_gap_set_adv_data(p, set_scanrsp, adv_data):
-        mystr = '<4BBB' + str(len(adv_data)) + 's'
-        p.write(struct.pack(mystr.encode('utf8'), 0, 2 + len(adv_data), 6, 9, set_scanrsp, len(adv_data), bytes(adv_data)))
\ No newline at end of file
+    def pack_gap_set_adv_data_into(buffer, offset, set_scanrsp, adv_data):
+        """Encode a gap_set_adv_data frame into buffer, returns its size."""
+        length = len(adv_data)
+        if length > ADV_DATA_MAX_LENGTH:
+            raise ValueError("Advertisement data is %d bytes, max %d" % (length, ADV_DATA_MAX_LENGTH))
+        header_size = _CMD_GAP_SET_ADV_DATA_HEADER.size
+        _CMD_GAP_SET_ADV_DATA_HEADER.pack_into(buffer, offset, 0, 2 + length, 6, 9, set_scanrsp, length)
+        buffer[offset + header_size:offset + header_size + length] = adv_data
+        return header_size + length
+
+
+def _async_command(command):
+    def send(transport, *args):
+        command(transport, *args)
+        return transport.last_response
+    send.__name__ = command.__name__
+    send.__doc__ = "Send %s, returns a future resolved with the response result code." % command.__name__
+    return staticmethod(send)
+
+# coroutine-friendly API commands for a BleAsyncTransport
+class AsyncBleStack(object):
+    ble_cmd_connection_disconnect = _async_command(BleStack.ble_cmd_connection_disconnect)
+    ble_cmd_gap_set_mode = _async_command(BleStack.ble_cmd_gap_set_mode)
+    ble_cmd_gap_end_procedure = _async_command(BleStack.ble_cmd_gap_end_procedure)
+    ble_cmd_gap_discover = _async_command(BleStack.ble_cmd_gap_discover)
+    ble_cmd_gap_set_scan_parameters = _async_command(BleStack.ble_cmd_gap_set_scan_parameters)
+    ble_cmd_gap_set_adv_parameters = _async_command(BleStack.ble_cmd_gap_set_adv_parameters)
+    ble_cmd_gap_set_adv_data = _async_command(BleStack.ble_cmd_gap_set_adv_data)
@@ -0,0 +1,28 @@
+class BleDongleState(object):
+    """What we know of the dongle's configuration.
+
+    None means unknown, e.g. right after the port was opened or after a
+    command failed: the next reconfiguration then sends every command.
+    """
+    FIELDS = ("mode", "adv_parameters", "adv_data", "scan_response", "connected", "scanning", "scan_parameters")
+
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget everything, forcing a full resync."""
+        self.mode = None
+        self.adv_parameters = None
+        self.adv_data = None
+        self.scan_response = None
+        self.connected = None
+        self.scanning = None
+        self.scan_parameters = None
+
+    def copy(self):
+        state = BleDongleState()
+        state.__dict__.update(self.__dict__)
+        return state
+
+    def __repr__(self):
+        return "BleDongleState(%s)" % ", ".join("%s=%r" % (field, getattr(self, field)) for field in self.FIELDS)
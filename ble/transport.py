@@ -0,0 +1,179 @@
+import asyncio, collections
+
+from ble.reader import BgapiPacket, HEADER_SIZE, PAYLOAD_MAX_LENGTH, MESSAGE_EVENT, payload_length, is_header, result_code
+from ble.batch import BleBatch, BleBatchError
+
+
+class BleAsyncTransport(object):
+    """asyncio transport for a BGAPI dongle.
+
+    The serial port is switched to non-blocking reads and watched by the
+    event loop, so no thread ever blocks on it. Each command frame written
+    through the transport gets a future, resolved with the result code of
+    the matching response; responses arrive in command order, and one that
+    matches no outstanding command is dropped and counted. Events are
+    handed to ``on_event`` as BgapiPacket objects that stay valid until the
+    callback returns.
+    """
+    def __init__(self, connection, loop=None, on_event=None, timeout=1.0, metrics=None):
+        self.serial = connection
+        self.loop = loop or asyncio.get_running_loop()
+        self.on_event = on_event
+        self.metrics = metrics
+        self.timeout = timeout
+        self.last_response = None
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._packet = BgapiPacket(HEADER_SIZE + PAYLOAD_MAX_LENGTH)
+        self.serial.timeout = 0
+        self._fd = self.serial.fileno()
+        self.loop.add_reader(self._fd, self._on_readable)
+
+    def close(self):
+        """Stop watching the port, fail every outstanding command and close the port."""
+        self.loop.remove_reader(self._fd)
+        self._fail()
+        try:
+            self.serial.close()
+        except OSError:
+            pass
+
+    def _fail(self, error=None):
+        """Fail every outstanding command with error, BleBatchError by default."""
+        for cls, cmd, future in self._pending:
+            if not future.done():
+                future.set_exception(error or BleBatchError(cls, cmd, None))
+        self._pending.clear()
+
+    def write(self, frame):
+        """Write one command frame; its response future is ``last_response``."""
+        self.last_response = self.send(frame, ((frame[2], frame[3]),))[0]
+        return len(frame)
+
+    def send(self, frames, commands, checks=None):
+        """Write several command frames at once.
+
+        ``commands`` lists the (class, id) of every frame, in order, and
+        ``checks`` whether each result is checked, for the metrics. Returns
+        one response future per command.
+        """
+        futures = []
+        for cls, cmd in commands:
+            future = self.loop.create_future()
+            self._pending.append((cls, cmd, future))
+            futures.append(future)
+        self.serial.write(frames)
+        if self.metrics is not None:
+            self.metrics.sent(frames, checks)
+        return futures
+
+    def flush(self):
+        """Drop buffered input and fail every outstanding command."""
+        self.serial.reset_input_buffer()
+        self._buffer.clear()
+        if self.metrics is not None:
+            self.metrics.flushed()
+        self._fail()
+
+    def _on_readable(self):
+        try:
+            data = self.serial.read(self.serial.in_waiting or 1)
+        except OSError as e:
+            # serial.SerialException is an OSError: the dongle is gone, stop
+            # watching it and fail the outstanding commands now rather than
+            # on their timeout
+            self.loop.remove_reader(self._fd)
+            self._fail(e)
+            return
+        if not data:
+            return
+        if self.metrics is not None:
+            self.metrics.read(len(data))
+        buffer = self._buffer
+        buffer += data
+        while buffer:
+            # Resynchronise on a byte that is not a Bluetooth BGAPI header
+            if not is_header(buffer[0]):
+                del buffer[0]
+                continue
+            if len(buffer) < HEADER_SIZE:
+                break
+            size = HEADER_SIZE + payload_length(buffer)
+            if len(buffer) < size:
+                break
+            packet = self._packet
+            packet.view[:size] = buffer[:size]
+            del buffer[:size]
+            packet.decode()
+            if packet.msg_type == MESSAGE_EVENT:
+                if self.metrics is not None:
+                    self.metrics.event()
+                if self.on_event is not None:
+                    self.on_event(packet)
+            else:
+                self._on_response(packet.cls, packet.cmd, result_code(packet.cls, packet.cmd, packet.payload))
+
+    def _on_response(self, cls, cmd, result):
+        pending = self._pending
+        for index, (pending_cls, pending_cmd, future) in enumerate(pending):
+            if pending_cls == cls and pending_cmd == cmd:
+                break
+        else:
+            # A late answer to a command already failed or flushed: drop it
+            if self.metrics is not None:
+                self.metrics.unmatched(cls, cmd)
+            return
+        if self.metrics is not None:
+            self.metrics.received(cls, cmd, result)
+        for _ in range(index):
+            pending_cls, pending_cmd, future = pending.popleft()
+            # Responses come in command order: this one was never answered
+            if not future.done():
+                future.set_exception(BleBatchError(pending_cls, pending_cmd, None))
+        future = pending.popleft()[2]
+        if not future.done():
+            future.set_result(result)
+
+    def batch(self):
+        """Return an empty pipelined command batch on this transport."""
+        return AsyncBleBatch(self)
+
+
+def _discard(futures):
+    """Cancel, or retrieve the exception of, the futures nobody will await,
+    so that none of them logs "Future exception was never retrieved"."""
+    for future in futures:
+        if not future.done():
+            future.cancel()
+        elif not future.cancelled():
+            future.exception()
+
+
+class AsyncBleBatch(BleBatch):
+    """BleBatch whose execute() is a coroutine running on a BleAsyncTransport."""
+    def __init__(self, transport):
+        super().__init__(transport.serial, None)
+        self.transport = transport
+
+    async def execute(self):
+        """Send the batch, raises BleBatchError on the first failed command."""
+        for frames, commands in self._segments:
+            if not commands:
+                continue
+            futures = self.transport.send(frames, [(cls, cmd) for cls, cmd, check in commands], [check for cls, cmd, check in commands])
+            failure = None
+            try:
+                for (cls, cmd, check), future in zip(commands, futures):
+                    try:
+                        result = await asyncio.wait_for(future, self.transport.timeout)
+                    except asyncio.TimeoutError:
+                        if self.transport.metrics is not None:
+                            self.transport.metrics.timed_out(cls, cmd)
+                        raise BleBatchError(cls, cmd, None)
+                    if failure is None and check and result != 0:
+                        failure = BleBatchError(cls, cmd, result)
+            except BaseException:
+                _discard(futures)
+                raise
+            if failure is not None:
+                raise failure
@@ -1,9 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*
 
-import serial, signal, schedule, sys
-import time, datetime
-import csv
+import serial, signal, sys
+import time, datetime, asyncio, atexit
 from pathlib import Path
 
 """
@@ -19,6 +18,20 @@ RESOURCE_DIR="resources"
 
 from ble.optionparser import BleOptionParser
 from ble.advertiser import BleAdvertiser
+from ble.fleet import BleFleet
+from ble.rotation import BleIdentityTable, BleRotator
+from ble.eventlog import BleEventLog
+from ble.metrics import BleMetrics, BleMetricsExporter
+from ble.scanreq import scan_requests, read_scan_request, format_address, BleScanRequestTracker, BleScanRequestLog
+from ble.scheduler import BleScheduler
+from ble.dutycycle import BleDutyCycle
+from ble.daemon import BleControlServer
+from ble.campaign import BleCampaign, BleCampaignRunner
+from ble.payload import BlePayloadCompiler
+from ble.feed import BleTelemetryFeed
+from ble.link import BleLinkSupervisor, BleLinkFatalError
+from ble.capture import BleCapture, BleCaptureTap
+from ble.scanner import BleScanner
 
 
 """
@@ -33,39 +46,80 @@ def ctrl_c_handler(signal, frame):
     print ('Goodbye, cruel world!')
     exit(0)
 
-def append_list_as_row(file_name, list_of_elem):
-    # Open file in append mode
-    with open(file_name, 'a+', newline='') as write_obj:
-        # Create a writer object from csv module
-        csv_writer = csv.writer(write_obj)
-        # Add contents of list as last row in the csv file
-        csv_writer.writerow(list_of_elem)
-
-def writeCSV(status="Start", filepath="resources/wakeup.csv"):
-    row_contents = [datetime.datetime.now(), status]
-    # Append a list as new line to an old csv file
-    append_list_as_row(filepath, row_contents)
-
-
-def writeCSVHeader(filepath="resources/wakeup.csv"):
-    with open(filepath, 'w', newline='') as outcsv:
-        writer = csv.DictWriter(outcsv, fieldnames = ["Date", "Status"])
-        writer.writeheader()
-
-def doTask(bletask):
-    bletask.start()
-    if not bletask.params.quiet:
-        writeCSV("Start")
-        print(f"-> [{datetime.datetime.now()}] iBeacon advertisements started")
-        time.sleep(bletask.params.duration)
-    bletask.stop()
-    writeCSV("Stop")
-    print(f"<- [{datetime.datetime.now()}] iBeacon advertisements stopped")
+def printScanRequest(address, address_type, rssi, device):
+    print(f"   [{datetime.datetime.now()}] Scan request from {format_address(address)} ({rssi} dBm, {device[BleScanRequestTracker.COUNT]} requests, avg {device[BleScanRequestTracker.RSSI_AVG]:.1f} dBm)")
+
+
+def readScanRequests(reader, tracker):
+    tracker.consume(scan_requests(reader, 0))
+    request = read_scan_request(reader)
+    if request is not None:
+        tracker.add(*request)
+
+def printBeaconStats(stats):
+    print(f"   [{datetime.datetime.now()}] {len(stats)} beacons")
+    for beacon in stats:
+        print("   %s %04X/%04X\t%d reports, avg %.1f dBm (sd %.1f, %d to %d dBm)" % (''.join(['%02X' % b for b in beacon['uuid']]),
+            beacon['major'], beacon['minor'], beacon['count'], beacon['rssi_mean'], beacon['rssi_std'], beacon['rssi_min'], beacon['rssi_max']))
+
+def observeBeacons(scanner, window):
+    scanner.start()
+    deadline = time.monotonic() + window
+    while True:
+        scanner.poll(max(deadline - time.monotonic(), 0))
+        if time.monotonic() >= deadline:
+            printBeaconStats(scanner.rssi.stats())
+            deadline += window
+
+def startMetricsExporter(params, metrics_list):
+    if not params.metrics and not params.metrics_port:
+        return
+    try:
+        exporter = BleMetricsExporter(metrics_list, filepath=params.metrics, port=params.metrics_port)
+    except OSError as e:
+        print("\n================================================================")
+        print("Metrics export error (port='%s'): %s" % (params.metrics_port, e))
+        print("================================================================")
+        exit(2)
+    atexit.register(exporter.close)
+
+def runFleet(params):
+    try:
+        members = BleFleet.load(params.fleet, params)
+    except (OSError, ValueError, KeyError) as e:
+        print("\n================================================================")
+        print("Fleet file error (name='%s'): %s" % (params.fleet, e))
+        print("================================================================")
+        exit(2)
+    if not(params.quiet):
+        print("================================================================")
+        print("BLED112 iBeacon fleet for Python v%s" % __version__)
+        print("================================================================")
+        for member in members:
+            print("%s\t%s %04X/%04X, %d ms, %g s every %g s" % (member.port, ''.join(['%02X' % b for b in member.params.uuid]),
+                member.params.major, member.params.minor, member.params.interval, member.params.duration, member.params.period))
+        print("----------------------------------------------------------------")
+    # Log every dongle's duty cycle events to its own file
+    for member in members:
+        try:
+            member.eventlog = BleEventLog(member.params.log, fmt=params.log_format, rotate=params.log_rotate)
+        except (OSError, ValueError) as e:
+            print("\n================================================================")
+            print("Event log error (name='%s'): %s" % (member.params.log, e))
+            print("================================================================")
+            exit(2)
+        atexit.register(member.eventlog.close)
+    fleet = BleFleet(members, stagger=params.stagger, quiet=params.quiet)
+    startMetricsExporter(params, [member.metrics for member in members])
+    asyncio.run(fleet.run())
 
 def main():
     mkdir(RESOURCE_DIR)
     options = BleOptionParser()
     params = options.parse()
+    if params.fleet:
+        runFleet(params)
+        return
     # display  parameter summary, if not in quiet mode
     if not(params.quiet):
         print("================================================================")
@@ -77,8 +131,8 @@ def main():
         print("Beacon Major:\t%04X" % params.major)
         print("Beacon Minor:\t%04X" % params.minor)
         print("Adv. interval:\t%d ms" % params.interval)
-        print("Adv. duty cycle duration:\t%d s" % params.duration)
-        print("Adv. duty cycle period :\t%d s" % params.period)
+        print("Adv. duty cycle duration:\t%g s" % params.duration)
+        print("Adv. duty cycle period :\t%g s" % params.period)
         print("Scan requests:\t%s" % ['Disabled', 'Enabled'][params.scanreq])
         print("----------------------------------------------------------------")
 
@@ -86,7 +140,6 @@ def main():
         Open the serial port on which the dongle is connected
     """
     try:
-        writeCSVHeader()
         ser = serial.Serial(port=params.port, baudrate=params.baudrate, timeout=1)
     except serial.SerialException as e:
         print("\n================================================================")
@@ -94,14 +147,135 @@ def main():
         print("================================================================")
         exit(2)
 
+    # Record the serial traffic, if asked to
+    capture = None
+    if params.capture:
+        try:
+            capture = BleCapture(params.capture)
+        except OSError as e:
+            print("\n================================================================")
+            print("Capture file error (name='%s'): %s" % (params.capture, e))
+            print("================================================================")
+            exit(2)
+        atexit.register(capture.close)
+        ser = BleCaptureTap(ser, capture)
+
+    def openPort():
+        connection = serial.Serial(port=params.port, baudrate=params.baudrate, timeout=1)
+        return connection if capture is None else BleCaptureTap(connection, capture)
+
+    # Log the duty cycle events in the background, appending to any previous log
+    try:
+        event_log = BleEventLog(params.log, fmt=params.log_format, rotate=params.log_rotate)
+    except (OSError, ValueError) as e:
+        print("\n================================================================")
+        print("Event log error (name='%s'): %s" % (params.log, e))
+        print("================================================================")
+        exit(2)
+    atexit.register(event_log.close)
+
     # Create the ble advertiser task
-    advertiser_task = BleAdvertiser(ser, params)
+    metrics = BleMetrics(port=params.port)
+    startMetricsExporter(params, [metrics])
 
-    schedule.every(params.period).seconds.do(doTask, bletask=advertiser_task)
-    doTask(advertiser_task) # Run now
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    # Observe the beacons around instead, if asked to
+    if params.observe:
+        try:
+            scanner = BleScanner(ser, params, metrics, params.scan_interval, params.scan_window, params.active_scan, stats_window=params.observe_window)
+        except ImportError as e:
+            print("\n================================================================")
+            print("Scanner error: %s" % e)
+            print("================================================================")
+            exit(2)
+        BleLinkSupervisor(scanner, openPort, quiet=params.quiet).run(observeBeacons, scanner, params.observe_window)
+        return
+
+    advertiser_task = BleAdvertiser(ser, params, metrics=metrics)
+
+    # Reopen the port and restore advertising if the dongle resets or is replugged
+    supervisor = BleLinkSupervisor(advertiser_task, openPort, quiet=params.quiet)
+
+    # Load the identities to rotate through, if any
+    rotator = None
+    if params.identities:
+        try:
+            rotator = BleRotator(advertiser_task, BleIdentityTable.load(params.identities), params.dwell)
+        except (OSError, ValueError) as e:
+            print("\n================================================================")
+            print("Identity file error (name='%s'): %s" % (params.identities, e))
+            print("================================================================")
+            exit(2)
+        if not(params.quiet):
+            print("Rotating through %d identities, %.3f s each" % (len(rotator.table), params.dwell))
+
+    # Advertise the values of a telemetry feed, if any
+    feed = None
+    if params.feed:
+        if params.feed_payload == "tlm":
+            payload = BlePayloadCompiler().flags().eddystone_tlm().compile()
+        else:
+            payload = BlePayloadCompiler().flags().ibeacon(params.uuid, params.major, params.minor, params.power).compile()
+        feed = BleTelemetryFeed(advertiser_task, payload, params.feed_rate)
+        feed.read(params.feed)
+        atexit.register(feed.close)
+
+    # Follow the scan requests received while advertising, if enabled,
+    # reading them off the link while waiting for the next duty cycle edge
+    idle = None
+    if params.scanreq:
+        if params.scanreq_log:
+            scan_log = BleScanRequestLog(params.scanreq_log)
+            atexit.register(scan_log.close)
+            scan_tracker = BleScanRequestTracker(window=params.scanreq_window, callback=scan_log)
+        else:
+            scan_tracker = BleScanRequestTracker(window=params.scanreq_window, callback=printScanRequest)
+        idle = lambda timeout: scan_tracker.consume(scan_requests(advertiser_task.reader, timeout))
+
+    scheduler = BleScheduler(idle)
+    if feed is not None:
+        feed.begin(scheduler)
+
+    # Advertise a campaign's entries as they come, if given
+    if params.campaign:
+        try:
+            campaign = BleCampaign.load(params.campaign, params)
+        except (OSError, ValueError) as e:
+            print("\n================================================================")
+            print("Campaign file error (name='%s'): %s" % (params.campaign, e))
+            print("================================================================")
+            exit(2)
+        if not(params.quiet):
+            print("Campaign of %d entries" % len(campaign))
+        supervisor.owner = BleCampaignRunner(advertiser_task, campaign, scheduler, event_log, params.quiet)
+        supervisor.run(supervisor.owner.begin)
+        supervisor.run(scheduler.run)
+        return
+
+    # Run the duty cycle now, then every period
+    duty_cycle = BleDutyCycle(advertiser_task, scheduler, event_log, rotator, params.quiet)
+    supervisor.owner = duty_cycle
+    supervisor.run(duty_cycle.begin)
+    if not params.daemon:
+        supervisor.run(scheduler.run)
+        return
+
+    # Daemon mode: wait for the next edge on the control socket instead,
+    # and keep running while paused
+    try:
+        server = BleControlServer(params.daemon, duty_cycle)
+    except OSError as e:
+        print("\n================================================================")
+        print("Control socket error (name='%s'): %s" % (params.daemon, e))
+        print("================================================================")
+        exit(2)
+    atexit.register(server.close)
+    if params.scanreq:
+        scheduler.idle = lambda timeout: server.poll(timeout, advertiser_task.serial, lambda: readScanRequests(advertiser_task.reader, scan_tracker))
+    else:
+        scheduler.idle = server.poll
+    if not(params.quiet):
+        print("Listening for commands on %s" % params.daemon)
+    supervisor.run(scheduler.run, True)
 
 
 signal.signal(signal.SIGINT, ctrl_c_handler)
@@ -109,5 +283,10 @@ signal.signal(signal.SIGINT, ctrl_c_handler)
 if __name__ == '__main__':
     try:
         main()
+    except BleLinkFatalError as e:
+        print("\n================================================================")
+        print("Dongle error: %s" % e)
+        print("================================================================")
+        exit(2)
     except Exception as e:
         print(f"{e.args}\nPlease, run \"./main.py -h\" for more options!")
\ No newline at end of file
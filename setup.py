@@ -13,5 +13,8 @@ setup(
 		'Pillow==8.3.1',
 		'pyserial==3.5',
 		'serial==0.0.97'
-    ]
+    ],
+    extras_require={
+		'scanner': ['numpy']
+    }
 )
@@ -0,0 +1,55 @@
+import os, sys, types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+from ble.optionparser import BleParsedArgs
+from ble.simulator import SimulatedBled112
+from ble.metrics import BleMetrics
+from ble.advertiser import BleAdvertiser
+
+
+class FakeClock(object):
+    """time.monotonic() stand-in, advanced by the scheduler's idle() only."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, timeout):
+        self.now += timeout
+
+
+@pytest.fixture
+def params():
+    return BleParsedArgs(uuid=list(range(16)), major=1, minor=1, interval=100, adv_min=90, adv_max=110,
+                         power=-59, duration=3, period=10)
+
+
+@pytest.fixture
+def dongles():
+    """Open simulated dongles, closed at the end of the test."""
+    opened = []
+
+    def open_dongle():
+        dongle = SimulatedBled112(timeout=0.2)
+        opened.append(dongle)
+        return dongle
+    yield open_dongle
+    for dongle in opened:
+        dongle.close()
+
+
+@pytest.fixture
+def advertiser(params, dongles):
+    return BleAdvertiser(dongles(), params, metrics=BleMetrics(port="simulated"))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Run the BleScheduler on a FakeClock, the rest keeps the real time."""
+    clock = FakeClock()
+    monkeypatch.setattr("ble.scheduler.time", types.SimpleNamespace(monotonic=clock, sleep=clock.sleep))
+    return clock
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from ble.simulator import RESULT_WRONG_STATE, DROP
+from ble.batch import BleBatchError
+from ble.stack import BleStack, MODE_OFF
+from ble.transport import BleAsyncTransport
+from ble.advertiser import AsyncBleAdvertiser, MODE_BROADCAST
+
+
+def count_writes(monkeypatch, dongle):
+    writes = []
+    write = dongle.write
+
+    def counted(data):
+        writes.append(bytes(data))
+        return write(data)
+    monkeypatch.setattr(dongle, "write", counted)
+    return writes
+
+
+def test_start_is_two_writes(advertiser, monkeypatch, capsys):
+    dongle = advertiser.serial
+    writes = count_writes(monkeypatch, dongle)
+    advertiser.start()
+
+    # The configuration, then set_mode once it has been accepted
+    assert len(writes) == 2
+    assert writes[1] == bytes([0, 2, 6, 1, 0x84, 0x03])
+    assert dongle.mode == MODE_BROADCAST
+    assert dongle.adv_data == bytes(advertiser._ibeacon.data)
+    assert capsys.readouterr().out == "Entering advertisement mode...\n"
+
+
+def test_unchanged_start_sends_nothing(advertiser, monkeypatch, capsys):
+    advertiser.start()
+    capsys.readouterr()
+    writes = count_writes(monkeypatch, advertiser.serial)
+    advertiser.start()
+    assert writes == []
+    assert capsys.readouterr().out == ""
+
+
+def test_identity_change_only_sends_adv_data(advertiser, params, capsys):
+    advertiser.start()
+    capsys.readouterr()
+    dongle = advertiser.serial
+    dongle.commands.clear()
+    params.minor = 7
+    advertiser.start()
+    assert dict(dongle.commands) == {"gap_set_adv_data": 1}
+    assert dongle.adv_data[27:29] == b"\x00\x07"
+    assert capsys.readouterr().out == ""
+
+
+def test_interval_change_restarts_advertising(advertiser, params, capsys):
+    advertiser.start()
+    capsys.readouterr()
+    dongle = advertiser.serial
+    dongle.commands.clear()
+    params.adv_min, params.adv_max = 190, 210
+    advertiser.start()
+    assert dongle.commands["gap_set_adv_parameters"] == 1
+    assert dongle.commands["gap_set_mode"] == 2
+    assert dongle.mode == MODE_BROADCAST
+    assert capsys.readouterr().out == "Entering advertisement mode...\n"
+
+
+def test_failed_configuration_does_not_advertise(advertiser, capsys):
+    dongle = advertiser.serial
+    dongle.inject("gap_set_adv_data", RESULT_WRONG_STATE)
+    with pytest.raises(BleBatchError) as error:
+        advertiser.start()
+    assert (error.value.cls, error.value.cmd, error.value.result) == (6, 9, RESULT_WRONG_STATE)
+    # The commands behind the barrier were never written
+    assert dongle.commands["gap_set_mode"] == 1
+    assert dongle.mode == MODE_OFF
+    assert capsys.readouterr().out == ""
+
+    # The state is unknown now: the next start sends everything again
+    advertiser.start()
+    assert dongle.commands["gap_set_adv_parameters"] == 2
+    assert dongle.mode == MODE_BROADCAST
+
+
+def test_missing_response_raises(advertiser):
+    advertiser.serial.inject("gap_set_adv_parameters", DROP)
+    with pytest.raises(BleBatchError) as error:
+        advertiser.start()
+    assert error.value.result is None
+
+
+def test_system_reset_cannot_be_batched(advertiser):
+    with pytest.raises(ValueError):
+        BleStack.ble_cmd_system_reset(advertiser.batch(), 0)
+
+
+def test_async_start_prints_after_success(dongles, params, capsys):
+    dongle = dongles()
+    dongle.inject("gap_set_mode", RESULT_WRONG_STATE, 2)
+
+    async def run():
+        transport = BleAsyncTransport(dongle, timeout=0.5)
+        advertiser = AsyncBleAdvertiser(transport, params)
+        # set_mode off may fail, set_mode broadcast may not
+        with pytest.raises(BleBatchError):
+            await advertiser.start()
+        assert capsys.readouterr().out == ""
+        await advertiser.start()
+        transport.close()
+    asyncio.run(run())
+
+    assert dongle.mode == MODE_BROADCAST
+    assert capsys.readouterr().out == "Entering advertisement mode...\n"
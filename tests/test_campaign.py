@@ -0,0 +1,120 @@
+import math, random, time
+
+import pytest
+
+from ble.advertiser import MODE_BROADCAST
+from ble.campaign import BleCampaign, BleCampaignRunner, BleIntervalIndex
+from ble.scheduler import BleScheduler
+from ble.stack import MODE_OFF
+
+
+def random_campaign(seed, count=500):
+    """Return a campaign and its entries as (start, end, period, duration)."""
+    rng = random.Random(seed)
+    campaign = BleCampaign()
+    entries = []
+    for index in range(count):
+        start = rng.uniform(0, 10000)
+        if rng.random() < 0.5:
+            period = rng.choice([100.0, 250.0, 3600.0])
+            duration = rng.uniform(1, period - 1)
+            end = start + rng.uniform(100, 8000) if rng.random() < 0.5 else math.inf
+        else:
+            period = duration = None
+            end = start + rng.uniform(0.1, 500)
+        campaign.add([index & 0xFF] * 16, 1, index, 100, start, end, period, duration)
+        entries.append((start, end, period, duration))
+    campaign.build()
+    return campaign, entries
+
+
+def brute_force_active(entries, t):
+    return [index for index, (start, end, period, duration) in enumerate(entries)
+            if start <= t < end and (period is None or (t - start) % period < duration)]
+
+
+def test_interval_index_stab():
+    index = BleIntervalIndex()
+    for id, (start, end) in enumerate([(0, 10), (5, 6), (8, 20), (30, 40)]):
+        index.add(start, end, id)
+    assert sorted(id for id, end in index.stab(5.5)) == [0, 1]
+    assert sorted(id for id, end in index.stab(10)) == [2]
+    assert list(index.stab(25)) == []
+    assert index.next_start(10) == 30
+
+
+def test_active_matches_brute_force():
+    campaign, entries = random_campaign(1)
+    rng = random.Random(2)
+    for _ in range(1000):
+        t = rng.uniform(-10, 20000)
+        assert campaign.active(t) == brute_force_active(entries, t)
+
+
+def test_nothing_changes_before_next_change():
+    campaign, entries = random_campaign(3)
+    rng = random.Random(4)
+    for _ in range(200):
+        t = rng.uniform(0, 20000)
+        change = campaign.next_change(t)
+        active = brute_force_active(entries, t)
+        for step in range(1, 6):
+            assert brute_force_active(entries, t + (change - t) * step / 6.01) == active
+
+
+def test_recurring_entry_is_indexed_once():
+    campaign = BleCampaign()
+    campaign.add([0] * 16, 1, 1, 100, 0.0, 350.0, 100.0, 10.0)
+    campaign.add([0] * 16, 1, 2, 100, 0.0, 1e9, 100.0, 10.0)
+    campaign.build()
+    assert len(campaign._once) == 0
+    assert sum(len(recurring) for recurring in campaign._recurring.values()) == 2
+    assert campaign.active(5) == [0, 1]
+    assert campaign.active(305) == [0, 1]
+    assert campaign.active(405) == [1]
+    assert campaign.active(315) == []
+    assert campaign.next_change(315) == 350.0
+
+
+def test_load_reports_invalid_lines(tmp_path, params):
+    path = tmp_path / "campaign.csv"
+    path.write_text("uuid,major,minor,interval,start,end,period,duration\n"
+                    "# comment\n"
+                    "504f4c45-5354-4152-4d4f-422d31343433,0001,0001,100,0,,10,5\n"
+                    "504f4c45-5354-4152-4d4f-422d31343433,zz,0001,100,0,,,\n"
+                    "504f4c45-5354-4152-4d4f-422d31343433,0001,0001,20,0,,,\n")
+    with pytest.raises(ValueError) as error:
+        BleCampaign.load(path, params)
+    assert "2 invalid campaign entries" in str(error.value)
+    assert "campaign.csv:4:" in str(error.value)
+
+
+def test_runner_follows_the_campaign(advertiser):
+    now = time.time()
+    campaign = BleCampaign()
+    campaign.add(list(range(16)), 7, 9, 200, now - 10, now + 3600)
+    campaign.build()
+    runner = BleCampaignRunner(advertiser, campaign, BleScheduler(), quiet=True)
+    runner.begin()
+    dongle = advertiser.serial
+    assert runner.index == 0
+    assert dongle.mode == MODE_BROADCAST
+    assert dongle.adv_data[25:29] == b"\x00\x07\x00\x09"
+    assert runner._next is not None
+
+    # After a link failure the entry is applied again, in full
+    commands = sum(dongle.commands.values())
+    runner.restore()
+    assert sum(dongle.commands.values()) > commands
+    assert dongle.mode == MODE_BROADCAST
+
+
+def test_runner_stops_without_entry(advertiser):
+    campaign = BleCampaign()
+    campaign.add(list(range(16)), 1, 1, 100, time.time() + 3600, time.time() + 7200)
+    campaign.build()
+    advertiser.start()
+    runner = BleCampaignRunner(advertiser, campaign, BleScheduler(), quiet=True)
+    runner.begin()
+    assert runner.index is None
+    assert advertiser.serial.mode == MODE_OFF
@@ -0,0 +1,77 @@
+import io, os
+
+import pytest
+
+from ble.simulator import RESULT_INVALID_PARAMETER
+from ble.advertiser import BleAdvertiser
+from ble.capture import BleCapture, BleCaptureTap, read_capture, capture_commands, dump, replay, TX, RX
+
+
+@pytest.fixture
+def trace(tmp_path, params, dongles):
+    """Capture an advertiser starting, switching minor and stopping."""
+    path = str(tmp_path / "trace.bin")
+    capture = BleCapture(path)
+    advertiser = BleAdvertiser(BleCaptureTap(dongles(), capture), params)
+    advertiser.start()
+    params.minor = 2
+    advertiser.start()
+    advertiser.stop()
+    capture.close()
+    return path
+
+
+def test_records_round_trip(tmp_path):
+    path = str(tmp_path / "trace.bin")
+    capture = BleCapture(path)
+    capture.record(TX, b"\x00\x00\x06\x04")
+    capture.record(RX, b"\x00\x02\x06\x04\x00")
+    capture.close()
+    started, records = read_capture(path)
+    assert [(direction, bytes(data)) for seconds, direction, data in records] == [(TX, b"\x00\x00\x06\x04"), (RX, b"\x00\x02\x06\x04\x00")]
+
+
+def test_records_are_buffered_until_flushed(tmp_path):
+    path = str(tmp_path / "trace.bin")
+    capture = BleCapture(path, flush_interval=3600)
+    capture.record(TX, b"\x00\x00\x06\x04")
+    assert os.path.getsize(path) == 0
+    capture.flush()
+    assert os.path.getsize(path) > 0
+    capture.close()
+
+
+def test_existing_capture_is_not_overwritten(trace):
+    size = os.path.getsize(trace)
+    with pytest.raises(FileExistsError):
+        BleCapture(trace)
+    assert os.path.getsize(trace) == size
+
+
+def test_commands_are_paired_with_their_responses(trace):
+    started, records = read_capture(trace)
+    pairs = list(capture_commands(records))
+    assert pairs
+    for seconds, command, response in pairs:
+        assert response is not None
+        assert response[2:4] == command[2:4]
+    out = io.StringIO()
+    dump(trace, out)
+    assert "cmd gap_set_adv_data" in out.getvalue()
+    assert "rsp gap_set_adv_data" in out.getvalue()
+
+
+def test_replay_matches_the_capture(trace, dongles):
+    commands, mismatches, seconds, divergence = replay(trace, dongles(), speed=0)
+    assert commands > 0
+    assert mismatches == 0
+    assert divergence is None
+
+
+def test_replay_reports_the_first_difference(trace, dongles):
+    dongle = dongles()
+    dongle.inject("gap_set_adv_parameters", RESULT_INVALID_PARAMETER)
+    commands, mismatches, seconds, divergence = replay(trace, dongle, speed=0)
+    assert mismatches >= 1
+    number, at, name, captured, result = divergence
+    assert (name, captured, result) == ("gap_set_adv_parameters", 0, RESULT_INVALID_PARAMETER)
@@ -0,0 +1,111 @@
+import json, os, socket, stat
+
+import pytest
+
+from ble.simulator import RESULT_WRONG_STATE
+from ble.batch import BleBatchError
+from ble.advertiser import MODE_BROADCAST
+from ble.scheduler import BleScheduler
+from ble.dutycycle import BleDutyCycle
+from ble.link import BleLinkSupervisor
+from ble.daemon import BleControlServer
+from ble.optionparser import BleParsedArgs
+
+
+@pytest.fixture
+def duty_cycle(advertiser):
+    return BleDutyCycle(advertiser, BleScheduler(), quiet=True)
+
+
+@pytest.fixture
+def server(tmp_path, duty_cycle):
+    server = BleControlServer(str(tmp_path / "control.sock"), duty_cycle)
+    yield server
+    server.close()
+
+
+class Client(object):
+    """Control socket client driving the server's poll() itself."""
+    def __init__(self, server):
+        self.server = server
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(server.path)
+        server.poll(0.1)
+
+    def send(self, command, **arguments):
+        self.socket.sendall(json.dumps(dict(arguments, cmd=command)).encode("utf-8") + b"\n")
+
+    def receive(self):
+        response = bytearray()
+        while not response.endswith(b"\n"):
+            response += self.socket.recv(4096)
+        return json.loads(response)
+
+    def command(self, command, **arguments):
+        self.send(command, **arguments)
+        self.server.poll(0.1)
+        return self.receive()
+
+
+def test_socket_is_owner_only(server):
+    assert stat.S_IMODE(os.stat(server.path).st_mode) == 0o600
+
+
+def test_stale_socket_is_replaced(tmp_path, duty_cycle):
+    path = str(tmp_path / "control.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    BleControlServer(path, duty_cycle).close()
+
+
+def test_live_daemon_socket_is_kept(server, duty_cycle):
+    with pytest.raises(OSError):
+        BleControlServer(server.path, duty_cycle)
+    assert os.path.exists(server.path)
+
+
+def test_commands_change_the_params_in_place(server, duty_cycle):
+    client = Client(server)
+    duty_cycle.start()
+    response = client.command("set_identity", minor="0005")
+    assert response["ok"]
+    assert response["minor"] == "0005"
+    assert duty_cycle.advertiser.serial.adv_data[27:29] == b"\x00\x05"
+
+    response = client.command("set_interval", interval=200)
+    assert response["interval"] == 200
+    adv_min, adv_max = BleParsedArgs.parseInterval(200)
+    assert duty_cycle.advertiser.serial.adv_parameters == (int(adv_min * 0.625), int(adv_max * 0.625), 7)
+
+    assert client.command("pause")["paused"]
+    assert duty_cycle.advertiser.serial.mode != MODE_BROADCAST
+    assert not client.command("resume")["paused"]
+
+
+def test_invalid_commands_are_answered(server):
+    client = Client(server)
+    assert client.command("reboot") == {"ok": False, "error": "Unknown command 'reboot'"}
+    assert not client.command("set_interval", interval=5)["ok"]
+    assert not client.command("set_duty_cycle", duration=10, period=5)["ok"]
+
+
+def test_link_error_is_answered_then_raised(server, duty_cycle, dongles):
+    client = Client(server)
+    duty_cycle.start()
+    dongle = duty_cycle.advertiser.serial
+    dongle.inject("gap_set_adv_data", RESULT_WRONG_STATE)
+    client.send("set_identity", minor="0007")
+    with pytest.raises(BleBatchError):
+        server.poll(0.1)
+    assert not client.receive()["ok"]
+
+    # The supervisor resyncs the dongle with the new identity
+    supervisor = BleLinkSupervisor(duty_cycle.advertiser, dongles, quiet=True, owner=duty_cycle)
+    dongle.inject("gap_set_adv_data", RESULT_WRONG_STATE)
+    client.send("set_identity", minor="0008")
+    supervisor.run(server.poll, 0.1)
+    assert client.receive()["ok"] is False
+    assert supervisor.failures == 1
+    assert dongle.adv_data[27:29] == b"\x00\x08"
+    assert dongle.mode == MODE_BROADCAST
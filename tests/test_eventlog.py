@@ -0,0 +1,93 @@
+import csv, datetime, os, time
+
+import pytest
+
+from ble.eventlog import BleEventLog, BINARY_MAGIC, read_binary_log
+
+
+def log_events(path, statuses, **options):
+    options.setdefault("fsync", False)
+    log = BleEventLog(path, **options)
+    for status in statuses:
+        log.write(status)
+    log.close()
+
+
+def read_csv(path):
+    with open(path, newline='') as logfile:
+        return list(csv.reader(logfile))
+
+
+def test_csv_appends_under_one_header(tmp_path):
+    path = tmp_path / "wakeup.csv"
+    log_events(path, ["Start", "Stop"])
+    log_events(path, ["Start"])
+    rows = read_csv(path)
+    assert rows[0] == ["Date", "Status"]
+    assert [row[1] for row in rows[1:]] == ["Start", "Stop", "Start"]
+    datetime.datetime.fromisoformat(rows[1][0])
+
+
+def test_binary_round_trip(tmp_path):
+    path = tmp_path / "wakeup.bin"
+    before = datetime.datetime.now()
+    log_events(path, ["Start", "Stop"], fmt="binary")
+    log_events(path, ["Start"], fmt="binary")
+    assert path.read_bytes().startswith(BINARY_MAGIC)
+    assert path.read_bytes().count(BINARY_MAGIC) == 1
+    records = list(read_binary_log(path))
+    assert [status for date, status in records] == ["Start", "Stop", "Start"]
+    assert all(before - datetime.timedelta(seconds=1) <= date <= datetime.datetime.now() for date, status in records)
+
+
+def test_refuses_the_other_format(tmp_path):
+    csv_path, binary_path = tmp_path / "wakeup.csv", tmp_path / "wakeup.bin"
+    log_events(csv_path, ["Start"])
+    log_events(binary_path, ["Start"], fmt="binary")
+    with pytest.raises(ValueError):
+        BleEventLog(csv_path, fmt="binary")
+    with pytest.raises(ValueError):
+        BleEventLog(binary_path, fmt="csv")
+    with pytest.raises(ValueError):
+        BleEventLog(tmp_path / "wakeup.log", fmt="json")
+    with pytest.raises(ValueError):
+        list(read_binary_log(csv_path))
+
+
+def test_flush_size_writes_before_close(tmp_path):
+    path = tmp_path / "wakeup.csv"
+    log = BleEventLog(path, flush_size=2, flush_interval=60, fsync=False)
+    log.write("Start")
+    log.write("Stop")
+    deadline = time.monotonic() + 2
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    try:
+        assert len(read_csv(path)) == 3
+    finally:
+        log.close()
+
+
+def test_size_rotation(tmp_path):
+    path = tmp_path / "wakeup.csv"
+    log_events(path, ["Start"], rotate=1)
+    log_events(path, ["Stop"], rotate=1)
+    log_events(path, ["Start"], rotate=1)
+    rotated = sorted(p.name for p in tmp_path.iterdir() if p != path)
+    assert len(rotated) == 2
+    assert all(name.startswith("wakeup-") and name.endswith(".csv") for name in rotated)
+    assert [row[1] for row in read_csv(path)[1:]] == ["Start"]
+
+
+def test_daily_rotation(tmp_path):
+    path = tmp_path / "wakeup.csv"
+    log_events(path, ["Start"], rotate="daily")
+    log_events(path, ["Stop"], rotate="daily")
+    assert [row[1] for row in read_csv(path)[1:]] == ["Start", "Stop"]
+
+    yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+    os.utime(path, (yesterday.timestamp(), yesterday.timestamp()))
+    log_events(path, ["Start"], rotate="daily")
+    rotated = tmp_path / ("wakeup-%s.csv" % yesterday.strftime("%Y%m%d"))
+    assert [row[1] for row in read_csv(rotated)[1:]] == ["Start", "Stop"]
+    assert [row[1] for row in read_csv(path)[1:]] == ["Start"]
@@ -0,0 +1,156 @@
+import time
+
+import pytest
+
+from ble.simulator import RESULT_WRONG_STATE, DROP
+from ble.batch import BleBatchError
+from ble.payload import BlePayloadCompiler
+from ble.scheduler import BleScheduler
+from ble.feed import BleTelemetryFeed, parse_feed_line
+
+
+@pytest.fixture
+def feed(advertiser):
+    feed = BleTelemetryFeed(advertiser, BlePayloadCompiler().flags().eddystone_tlm().compile(), rate=10)
+    yield feed
+    feed.close()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+@pytest.mark.parametrize("line, values", [
+    ("battery=2950 temperature=21.5", {"battery": 2950, "temperature": 21.5}),
+    ('{"adv_count": 1200, "uptime": 3600.0}', {"adv_count": 1200, "uptime": 3600}),
+    ("uptime=12.0", {"uptime": 12}),
+    ("  # comment", {}),
+    ("", {}),
+])
+def test_parse_feed_line(line, values):
+    parsed = parse_feed_line(line)
+    assert parsed == values
+    assert [type(value) for value in parsed.values()] == [type(value) for value in values.values()]
+
+
+def test_parse_feed_line_rejects():
+    with pytest.raises(ValueError):
+        parse_feed_line("battery")
+    with pytest.raises(ValueError):
+        parse_feed_line("battery=full")
+
+
+def test_burst_is_coalesced_into_one_update(advertiser, feed):
+    advertiser.start()
+    dongle = advertiser.serial
+    dongle.commands.clear()
+    for battery in range(2900, 3000, 10):
+        feed.offer({"battery": battery})
+    feed.offer({"temperature": 21.5})
+    feed.tick()
+
+    assert dict(dongle.commands) == {"gap_set_adv_data": 1}
+    assert (feed.offered, feed.coalesced, feed.updates) == (11, 9, 1)
+    assert feed.payload.get("battery") == 2990
+    assert feed.payload.get("temperature") == 21.5
+    assert dongle.adv_data == bytes(feed.payload.data)
+
+    # Nothing new, or no change: nothing is sent
+    feed.tick()
+    feed.offer({"battery": 2990})
+    feed.tick()
+    assert dict(dongle.commands) == {"gap_set_adv_data": 1}
+
+
+def test_unknown_field_is_refused(feed):
+    with pytest.raises(KeyError):
+        feed.offer({"humidity": 40})
+    assert feed.offered == 0
+
+
+def test_out_of_range_value_is_rejected(advertiser, feed):
+    advertiser.start()
+    feed.offer({"battery": 70000, "adv_count": 5})
+    feed.tick()
+    assert feed.rejected == 1
+    assert feed.payload.get("adv_count") == 5
+    assert advertiser.serial.adv_data == bytes(feed.payload.data)
+
+
+def test_values_wait_for_the_next_start(advertiser, feed):
+    feed.offer({"battery": 3000})
+    feed.tick()
+    assert advertiser.serial.commands["gap_set_adv_data"] == 0
+    advertiser.start()
+    assert advertiser.serial.adv_data == bytes(feed.payload.data)
+    assert feed.payload.get("battery") == 3000
+
+
+def test_failed_update_is_counted(advertiser, feed):
+    advertiser.start()
+    advertiser.serial.inject("gap_set_adv_data", RESULT_WRONG_STATE)
+    feed.offer({"battery": 3000})
+    feed.tick()
+    assert feed.failures == 1
+    assert "0x0181" in feed.last_error
+    assert advertiser.state.adv_data is None
+
+    # The next start restores the payload
+    advertiser.start()
+    assert advertiser.serial.adv_data == bytes(feed.payload.data)
+
+
+def test_missing_response_is_a_link_error(advertiser, feed):
+    advertiser.start()
+    advertiser.serial.inject("gap_set_adv_data", DROP)
+    feed.offer({"battery": 3000})
+    with pytest.raises(BleBatchError):
+        feed.tick()
+    assert advertiser.state.adv_data is None
+
+
+def test_read_lines(advertiser, feed, capsys):
+    advertiser.start()
+    feed.read(["battery=2900\n", "humidity=40\n", "battery=3100 uptime=60\n"])
+    wait_for(lambda: feed.offered + feed.rejected == 3)
+    feed.tick()
+    assert feed.rejected == 1
+    assert "humidity" in capsys.readouterr().err
+    assert (feed.payload.get("battery"), feed.payload.get("uptime")) == (3100, 60)
+
+
+def test_consume_is_paced_by_the_feed(advertiser, feed):
+    advertiser.start()
+    feed.consume(iter([{"adv_count": count} for count in range(1, 6)]))
+    wait_for(lambda: feed.offered == 1)
+    time.sleep(0.05)
+    # The producer waits for the first values to be sent
+    assert feed.offered == 1
+    for count in range(5):
+        wait_for(lambda: feed.offered == count + 1)
+        feed.tick()
+        assert feed.payload.get("adv_count") == count + 1
+    assert (feed.updates, feed.coalesced) == (5, 0)
+
+
+def test_begin_ticks_at_the_feed_rate(advertiser, feed, clock):
+    advertiser.start()
+    scheduler = BleScheduler()
+    feed.begin(scheduler)
+    feed.offer({"battery": 2900})
+    scheduler.run_pending()
+    feed.offer({"battery": 3000})
+    clock.now += 0.05
+    scheduler.run_pending()
+    assert feed.updates == 1
+    clock.now += 0.05
+    scheduler.run_pending()
+    assert feed.updates == 2
+    feed.cancel()
+    feed.offer({"battery": 3100})
+    clock.now += 0.1
+    scheduler.run_pending()
+    assert feed.updates == 2
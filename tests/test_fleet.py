@@ -0,0 +1,78 @@
+import asyncio, sys
+
+import pytest
+
+pytest.importorskip("serial")
+
+from ble import fleet as fleet_module
+from ble.advertiser import MODE_BROADCAST
+from ble.fleet import BleFleet, BleFleetMember
+from ble.optionparser import BleOptionParser, BleParsedArgs
+
+
+@pytest.fixture
+def defaults(params):
+    return BleParsedArgs(**dict(params.__dict__, port="/dev/ttyACM0", baudrate=115200, log="resources/wakeup.csv"))
+
+
+class EventLog(object):
+    def __init__(self):
+        self.events = []
+
+    def write(self, status):
+        self.events.append(status)
+
+
+def test_entries_override_the_defaults(defaults):
+    params = BleFleet.params({"port": "/dev/ttyACM1", "minor": 2, "interval": 200, "duration": 1, "period": 2}, defaults)
+    assert (params.port, params.major, params.minor, params.interval) == ("/dev/ttyACM1", 1, 2, 200)
+    assert (params.duration, params.period) == (1, 2)
+    assert params.log == "resources/wakeup-ttyACM1.csv"
+    assert BleFleet.params({"port": "COM3", "log": "com3.csv"}, defaults).log == "com3.csv"
+
+
+def test_invalid_entry_names_the_dongle(defaults):
+    with pytest.raises(ValueError) as error:
+        BleFleet.params({"port": "/dev/ttyACM1", "minor": "zz"}, defaults)
+    assert "/dev/ttyACM1" in str(error.value)
+
+
+def test_fleet_runs_and_logs_every_dongle(defaults, dongles, monkeypatch, capsys):
+    opened = {}
+
+    def open_port(port, baudrate, timeout):
+        opened[port] = dongles()
+        return opened[port]
+    monkeypatch.setattr(fleet_module.serial, "Serial", open_port)
+    members = []
+    for port in ("/dev/ttyACM0", "/dev/ttyACM1"):
+        member = BleFleetMember(BleFleet.params({"port": port, "duration": 0.1, "period": 0.2}, defaults))
+        member.eventlog = EventLog()
+        members.append(member)
+    fleet = BleFleet(members, stagger=0.05, quiet=True, report_interval=0.1)
+
+    async def run():
+        try:
+            await asyncio.wait_for(fleet.run(), 0.35)
+        except asyncio.TimeoutError:
+            pass
+    asyncio.run(run())
+
+    assert sorted(opened) == ["/dev/ttyACM0", "/dev/ttyACM1"]
+    for member in members:
+        assert member.cycles >= 1
+        assert member.failures == 0
+        assert member.eventlog.events[:2] == ["Start", "Stop"]
+    # Quiet: no edges and no health report
+    out = capsys.readouterr().out
+    assert "cycles=" not in out
+    assert "ttyACM" not in out
+
+
+@pytest.mark.parametrize("option", [["--capture", "trace.bin"], ["--identities", "ids.csv"], ["--campaign", "campaign.csv"],
+                                    ["--daemon", "control.sock"], ["--feed", "-"], ["--scanreq"], ["--observe"]])
+def test_fleet_rejects_single_dongle_options(option, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["main.py", "-u", "504f4c45-5354-4152-4d4f-422d31343433", "--fleet", "fleet.json"] + option)
+    with pytest.raises(SystemExit):
+        BleOptionParser().parse()
+    assert "--fleet cannot be used with %s" % option[0] in capsys.readouterr().out
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+from ble.simulator import RESULT_WRONG_STATE, RESULT_INVALID_PARAMETER, DROP
+from ble.batch import BleBatchError
+from ble.stack import BleStack, MODE_OFF
+from ble.transport import BleAsyncTransport
+from ble.advertiser import MODE_BROADCAST
+from ble.link import BleLinkSupervisor, BleLinkFatalError, backoff_delays
+from ble.scheduler import BleScheduler
+from ble.dutycycle import BleDutyCycle
+
+
+def test_backoff_delays_double_up_to_maximum():
+    delays = backoff_delays(0.1, 0.5)
+    assert [next(delays) for _ in range(5)] == [0.1, 0.2, 0.4, 0.5, 0.5]
+
+
+def test_unplug_reopens_with_backoff_and_restores(advertiser, dongles, params):
+    advertiser.start()
+    attempts = []
+
+    def opener():
+        attempts.append(None)
+        if len(attempts) < 3:
+            raise OSError("No such device")
+        return dongles()
+    supervisor = BleLinkSupervisor(advertiser, opener, initial_delay=0.01, quiet=True)
+
+    advertiser.serial.unplug()
+    params.minor = 2
+    supervisor.run(advertiser.start)
+
+    dongle = advertiser.serial
+    assert len(attempts) == 3
+    assert dongle.mode == MODE_BROADCAST
+    assert dongle.adv_data == bytes(advertiser._ibeacon.data)
+    assert dongle.adv_data[27:29] == b"\x00\x02"
+    assert supervisor.failures == 1
+    assert advertiser.metrics.link_failures == 1
+    assert advertiser.metrics.recovery.count == 1
+
+
+def test_bad_result_resyncs_in_place(advertiser, params):
+    advertiser.start()
+    dongle = advertiser.serial
+
+    def opener():
+        pytest.fail("a live link must not be reopened")
+    supervisor = BleLinkSupervisor(advertiser, opener, quiet=True)
+
+    dongle.inject("gap_set_adv_data", RESULT_WRONG_STATE)
+    params.minor = 3
+    supervisor.run(advertiser.start)
+
+    assert advertiser.serial is dongle
+    assert dongle.adv_data[27:29] == b"\x00\x03"
+    assert supervisor.failures == 1
+
+
+def test_rejected_command_is_fatal(advertiser, params):
+    def opener():
+        pytest.fail("a live link must not be reopened")
+    supervisor = BleLinkSupervisor(advertiser, opener, quiet=True)
+
+    # An interval below the dongle's range is rejected on every resync
+    params.adv_min = params.adv_max = 20
+    with pytest.raises(BleLinkFatalError) as error:
+        supervisor.run(advertiser.start)
+    assert error.value.error.result == RESULT_INVALID_PARAMETER
+    assert "gap_set_adv_parameters" in str(error.value)
+    assert "0x0180" in str(error.value)
+    assert supervisor.failures == 1
+
+
+def test_rejection_after_reopen_is_fatal(advertiser, dongles):
+    opened = []
+
+    def opener():
+        opened.append(dongles())
+        opened[-1].inject("gap_set_adv_data", RESULT_INVALID_PARAMETER, 10)
+        return opened[-1]
+    supervisor = BleLinkSupervisor(advertiser, opener, initial_delay=0.01, quiet=True)
+
+    advertiser.serial.unplug()
+    with pytest.raises(BleLinkFatalError):
+        supervisor.run(advertiser.start)
+    assert len(opened) == 1
+
+
+def test_dropped_response_restores_the_duty_cycle(advertiser, dongles, clock):
+    scheduler = BleScheduler()
+    duty_cycle = BleDutyCycle(advertiser, scheduler, quiet=True)
+    supervisor = BleLinkSupervisor(advertiser, dongles, initial_delay=0.01, quiet=True, owner=duty_cycle)
+
+    # The start edge goes unanswered: the duty cycle must still end up advertising
+    advertiser.serial.inject("gap_set_mode", DROP)
+    duty_cycle.begin()
+    supervisor.run(scheduler.run_pending)
+
+    assert duty_cycle.advertising
+    assert advertiser.serial.mode == MODE_BROADCAST
+    assert supervisor.failures == 1
+
+    # The next stop edge reaches the reopened dongle
+    clock.now += advertiser.params.duration
+    supervisor.run(scheduler.run_pending)
+    assert not duty_cycle.advertising
+    assert advertiser.serial.mode == MODE_OFF
+
+
+def test_async_unplug_fails_pending_commands_at_once(dongles):
+    dongle = dongles()
+    dongle.latency = 0.05
+
+    async def run():
+        transport = BleAsyncTransport(dongle, timeout=2)
+        batch = transport.batch()
+        BleStack.ble_cmd_gap_set_mode(batch, 0, 0)
+        BleStack.ble_cmd_gap_set_mode(batch, 0, 0)
+        task = asyncio.ensure_future(batch.execute())
+        await asyncio.sleep(0.01)
+        dongle.unplug()
+        # Make the port readable, as the kernel does on a USB removal
+        dongle.emit_event(0, 0)
+        loop = asyncio.get_running_loop()
+        began = loop.time()
+        with pytest.raises(OSError):
+            await task
+        assert loop.time() - began < 1
+        transport.close()
+    asyncio.run(run())
+
+
+def test_async_dropped_response_times_out(dongles):
+    dongle = dongles()
+    dongle.inject("gap_set_mode", DROP)
+
+    async def run():
+        transport = BleAsyncTransport(dongle, timeout=0.2)
+        batch = transport.batch()
+        BleStack.ble_cmd_gap_set_mode(batch, 0, 0)
+        BleStack.ble_cmd_gap_end_procedure(batch)
+        with pytest.raises(BleBatchError) as error:
+            await batch.execute()
+        assert error.value.result is None
+        transport.close()
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from ble.simulator import RESULT_WRONG_STATE
+from ble.batch import BleBatchError
+from ble.metrics import BleMetrics, render_metrics
+from ble.transport import BleAsyncTransport
+from ble.advertiser import AsyncBleAdvertiser
+
+
+def test_unchecked_stop_commands_are_not_errors(advertiser):
+    # The first start and every stop send disconnect and end_procedure,
+    # which an idle dongle rejects
+    advertiser.start()
+    advertiser.stop(force=True)
+
+    metrics = advertiser.metrics
+    assert advertiser.serial.commands["connection_disconnect"] == 2
+    assert advertiser.serial.commands["gap_end_procedure"] == 2
+    assert not metrics.errors
+    assert not metrics.timeouts
+    assert (3, 0) in metrics.latency and (6, 4) in metrics.latency
+
+
+def test_checked_failure_is_an_error(advertiser):
+    advertiser.serial.inject("gap_set_adv_data", RESULT_WRONG_STATE)
+    with pytest.raises(BleBatchError):
+        advertiser.start()
+    assert advertiser.metrics.errors == {(6, 9): 1}
+
+
+def test_async_unchecked_stop_commands_are_not_errors(dongles, params):
+    dongle = dongles()
+    dongle.inject("gap_set_adv_data", RESULT_WRONG_STATE)
+
+    async def run():
+        transport = BleAsyncTransport(dongle, timeout=0.5, metrics=BleMetrics(port="simulated"))
+        advertiser = AsyncBleAdvertiser(transport, params)
+        with pytest.raises(BleBatchError):
+            await advertiser.start()
+        await advertiser.stop(force=True)
+        transport.close()
+        return advertiser.metrics
+    metrics = asyncio.run(run())
+    assert metrics.errors == {(6, 9): 1}
+
+
+def test_render_metrics(advertiser):
+    advertiser.start()
+    metrics = advertiser.metrics
+    metrics.errors[(6, 9)] += 1
+    metrics.link_failed()
+    metrics.link_recovered(0.3)
+    other = BleMetrics(port="other")
+
+    text = render_metrics([metrics, other])
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    assert "# TYPE ble_command_latency_seconds histogram" in lines
+    assert 'ble_bytes_out_total{port="simulated"} %d' % metrics.bytes_out in lines
+    assert 'ble_bytes_out_total{port="other"} 0' in lines
+    assert 'ble_link_failures_total{port="simulated"} 1' in lines
+    assert 'ble_link_recovery_seconds_bucket{port="simulated",le="0.5"} 1' in lines
+    assert 'ble_command_errors_total{port="simulated",command="gap_set_adv_data"} 1' in lines
+    assert 'ble_command_latency_seconds_count{port="simulated",command="gap_set_adv_parameters"} 1' in lines
+    # Every sample follows the HELP and TYPE lines of its metric
+    kinds = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+    samples = [line.split("{", 1)[0] for line in lines if not line.startswith("#")]
+    assert kinds.index("ble_command_errors_total") > kinds.index("ble_bytes_out_total")
+    assert samples.index("ble_command_errors_total") > samples.index("ble_bytes_out_total")
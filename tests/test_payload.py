@@ -0,0 +1,62 @@
+import pytest
+
+from ble.advertiser import ibeacon_adv_data, MEASURED_POWER
+from ble.payload import BlePayloadCompiler
+from ble.stack import BleStack
+
+UUID = bytes(range(16))
+
+
+class Port(object):
+    def __init__(self):
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(bytes(data))
+
+
+@pytest.mark.parametrize("major, minor", [(1, 1), (0x1234, 0xABCD), (0, 0xFFFF)])
+def test_ibeacon_matches_ibeacon_adv_data(major, minor):
+    payload = BlePayloadCompiler().flags().ibeacon(UUID, major, minor, MEASURED_POWER - 256).compile()
+    assert bytes(payload.data) == bytes(ibeacon_adv_data(list(UUID), major, minor))
+
+    port = Port()
+    BleStack.ble_cmd_gap_set_adv_data(port, 0, ibeacon_adv_data(list(UUID), major, minor))
+    assert bytes(payload.frame) == port.frames[0]
+
+
+def test_ibeacon_field_offsets():
+    payload = BlePayloadCompiler().flags().ibeacon(UUID).compile()
+    payload.update(major=0x0102, minor=0x0304, measured_power=-59)
+    # flags (3 bytes), manufacturer data header (4), iBeacon type and length (2)
+    assert bytes(payload.data[9:25]) == UUID
+    assert bytes(payload.data[25:30]) == b"\x01\x02\x03\x04\xc5"
+    assert payload.get("minor") == 0x0304
+    assert payload.get("measured_power") == -59
+
+
+def test_eddystone_tlm_fields():
+    payload = BlePayloadCompiler().flags().eddystone_tlm().compile()
+    payload.set("battery", 2950)
+    assert payload.get("battery") == 2950
+    with pytest.raises(KeyError):
+        payload.set("minor", 1)
+
+
+def test_scan_response_frame():
+    payload = BlePayloadCompiler().local_name("MOB-1443").compile(scan_response=True)
+    assert bytes(payload.frame[:6]) == bytes((0, 12, 6, 9, 1, 10))
+    assert bytes(payload.data) == b"\x09\x09MOB-1443"
+
+
+def test_compiled_payloads_do_not_share_data():
+    first = BlePayloadCompiler().flags().ibeacon(UUID, 1, 1).compile()
+    second = BlePayloadCompiler().flags().ibeacon(UUID, 1, 2).compile()
+    first.set("minor", 5)
+    assert second.get("minor") == 2
+    assert BlePayloadCompiler().flags().ibeacon(UUID, 1, 1).compile().get("minor") == 1
+
+
+def test_payload_too_long():
+    with pytest.raises(ValueError):
+        BlePayloadCompiler().flags().ibeacon(UUID).local_name("MOB-1443").compile()
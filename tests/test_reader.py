@@ -0,0 +1,83 @@
+import struct
+
+from ble.reader import BgapiReader, MESSAGE_EVENT
+from ble.metrics import BleMetrics
+from ble.stack import BleStack
+
+
+class BytePort(object):
+    """Serial port replaying fixed input, reads time out once it is drained."""
+    def __init__(self, data):
+        self.data = bytearray(data)
+
+    def read(self, size=1):
+        data = bytes(self.data[:size])
+        del self.data[:size]
+        return data
+
+
+def response(cls, cmd, result):
+    return struct.pack('<4BH', 0, 2, cls, cmd, result)
+
+
+def event(cls, cmd, payload):
+    return struct.pack('4B', 0x80, len(payload), cls, cmd) + payload
+
+
+def test_resynchronises_on_garbage():
+    # 0x7F and 0x08 have technology bits set: no BGAPI header starts with them
+    port = BytePort(b"\x7f\x08\x7f" + response(6, 1, 0) + b"\xff" + response(6, 9, 0x0181))
+    reader = BgapiReader(port)
+    assert reader.read_response(6, 1) == 0
+    assert reader.read_response(6, 9) == 0x0181
+    assert reader.read_packet() is None
+
+
+def test_truncated_packet_times_out():
+    metrics = BleMetrics()
+    metrics.sent(bytes([0, 2, 6, 1, 0, 0]))
+    reader = BgapiReader(BytePort(response(6, 1, 0)[:5]), metrics=metrics)
+    assert reader.read_response(6, 1) is None
+    assert metrics.timeouts == {(6, 1): 1}
+
+
+def test_events_are_queued_while_waiting(dongles):
+    dongle = dongles()
+    reader = BgapiReader(dongle)
+    dongle.emit_scan_request(b"\x01\x02\x03\x04\x05\x06", -40)
+    dongle.emit_event(3, 4, struct.pack('<BH', 0, 0x0216))
+    BleStack.ble_cmd_gap_set_mode(dongle, 0, 0)
+
+    assert reader.read_response(6, 1) == 0
+    assert [(packet.msg_type, packet.cls, packet.cmd) for packet in reader.events] == [
+        (MESSAGE_EVENT, 6, 0), (MESSAGE_EVENT, 3, 4)]
+    assert bytes(reader.events[0].payload[2:8]) == b"\x01\x02\x03\x04\x05\x06"
+    assert bytes(reader.events[1].payload) == b"\x00\x16\x02"
+
+
+def test_reused_slot_drops_oldest_event(dongles):
+    dongle = dongles()
+    reader = BgapiReader(dongle, slots=4)
+    for index in range(5):
+        dongle.emit_event(6, 0, bytes([index]) * 11)
+    BleStack.ble_cmd_gap_end_procedure(dongle)
+
+    assert reader.read_response(6, 4) == 0x0181
+    # 4 slots: the fifth event and the response reused the slots of the
+    # two oldest events
+    assert reader.dropped_events == 2
+    assert [packet.payload[0] for packet in reader.events] == [2, 3, 4]
+
+
+def test_on_event_receives_every_event(dongles):
+    dongle = dongles()
+    received = []
+    reader = BgapiReader(dongle, slots=2, on_event=lambda packet: received.append(bytes(packet.payload)))
+    for index in range(4):
+        dongle.emit_event(6, 0, bytes([index]) * 11)
+    BleStack.ble_cmd_gap_set_mode(dongle, 0, 0)
+
+    assert reader.read_response(6, 1) == 0
+    assert received == [bytes([index]) * 11 for index in range(4)]
+    assert reader.dropped_events == 0
+    assert not reader.events
@@ -0,0 +1,96 @@
+import pytest
+
+from ble.simulator import RESULT_WRONG_STATE
+from ble.batch import BleBatchError
+from ble.stack import BleStack
+from ble.advertiser import ibeacon_adv_data
+from ble.rotation import BleIdentityTable, BleRotator, DEFAULT_TX_POWER
+
+UUID = "504f4c45-5354-4152-4d4f-422d31343433"
+
+
+class Port(object):
+    def __init__(self):
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(bytes(data))
+
+
+@pytest.fixture
+def table():
+    table = BleIdentityTable()
+    for minor in range(3):
+        table.add(list(range(16)), 0x0102, minor, -60 + minor)
+    return table
+
+
+def test_frames_match_the_stack_encoding(table):
+    assert len(table) == 3
+    for index in range(3):
+        port = Port()
+        BleStack.ble_cmd_gap_set_adv_data(port, 0, ibeacon_adv_data(list(range(16)), 0x0102, index, -60 + index))
+        assert bytes(table.frame(index)) == port.frames[0]
+        assert table.identity(index) == (list(range(16)), 0x0102, index, -60 + index)
+
+
+def test_add_after_frame(table):
+    assert table.identity(0)[2] == 0
+    table.add(list(range(16)), 1, 2)
+    assert len(table) == 4
+    assert table.identity(3) == (list(range(16)), 1, 2, DEFAULT_TX_POWER)
+
+
+def test_load(tmp_path):
+    path = tmp_path / "identities.csv"
+    path.write_text("uuid,major,minor,tx_power\n# comment\n%s,0001,00FF,-59\n\n%s,ABCD,0002\n" % (UUID, UUID))
+    table = BleIdentityTable.load(str(path))
+    assert len(table) == 2
+    assert table.identity(0)[1:] == (0x0001, 0x00FF, -59)
+    assert table.identity(1)[1:] == (0xABCD, 0x0002, DEFAULT_TX_POWER)
+    assert bytes(table.identity(0)[0]).hex() == UUID.replace("-", "")
+
+
+@pytest.mark.parametrize("content, message", [
+    ("", "no identity"),
+    ("uuid,major,minor\n", "no identity"),
+    ("%s,0001\n" % UUID, ":1:"),
+    ("%s,0001,0002,200\n" % UUID, "tx power"),
+    ("nope,0001,0002\n", ":1:"),
+])
+def test_load_rejects(tmp_path, content, message):
+    path = tmp_path / "identities.csv"
+    path.write_text(content)
+    with pytest.raises(ValueError) as error:
+        BleIdentityTable.load(str(path))
+    assert message in str(error.value)
+
+
+def test_rotator_switches_adv_data_only(advertiser, table):
+    advertiser.start()
+    dongle = advertiser.serial
+    dongle.commands.clear()
+    rotator = BleRotator(advertiser, table, dwell=1.0)
+
+    for expected in (0, 1, 2, 0):
+        rotator.switch()
+        assert rotator.index == expected
+        assert dongle.adv_data == bytes(table.frame(expected)[6:])
+        assert advertiser.state.adv_data == dongle.adv_data
+    rotator.switch(2)
+    assert rotator.index == 2
+    assert dict(dongle.commands) == {"gap_set_adv_data": 5}
+
+
+def test_rotator_failure_invalidates_adv_data(advertiser, table):
+    advertiser.start()
+    rotator = BleRotator(advertiser, table, dwell=1.0)
+    advertiser.serial.inject("gap_set_adv_data", RESULT_WRONG_STATE)
+    with pytest.raises(BleBatchError):
+        rotator.switch()
+    assert rotator.index == -1
+    assert advertiser.state.adv_data is None
+
+    # The next start sends the params' iBeacon again
+    advertiser.start()
+    assert advertiser.serial.adv_data == bytes(advertiser._ibeacon.data)
@@ -0,0 +1,75 @@
+import struct
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from ble import scanner as scanner_module
+from ble.advertiser import ibeacon_adv_data
+from ble.payload import BlePayloadCompiler
+from ble.scanner import BleScanner, parse_scan_reports
+
+UUID = bytes(range(16))
+
+
+def report(data, address=bytes((1, 2, 3, 4, 5, 6)), rssi=-40):
+    payload = struct.pack('<bB6sBBB', rssi, 0, address, 0, 0xFF, len(data)) + bytes(data)
+    return bytes((0x80, len(payload), 6, 0)) + payload
+
+
+@pytest.fixture(params=[0, 1 << 20], ids=["bulk", "struct"])
+def parse_path(request, monkeypatch):
+    monkeypatch.setattr(scanner_module, "BULK_MIN_SIZE", request.param)
+
+
+def test_reads_back_the_advertised_beacon(parse_path):
+    reports, consumed = parse_scan_reports(report(ibeacon_adv_data(list(UUID), 0x1234, 0xABCD)), 1.5)
+    assert consumed == 45
+    assert reports["ibeacon"].tolist() == [True]
+    assert bytes(reports["uuid"][0]) == UUID
+    assert (int(reports["major"][0]), int(reports["minor"][0]), int(reports["tx_power"][0])) == (0x1234, 0xABCD, -58)
+    assert int(reports["address"][0]) == 0x060504030201
+    assert reports["time"][0] == 1.5
+
+
+def test_finds_beacons_anywhere_in_the_advertising_data(parse_path):
+    beacon = bytes(BlePayloadCompiler().ibeacon(UUID, 7, 9).compile().data)
+    name = bytes(BlePayloadCompiler().local_name("ab").compile().data)
+    other = bytes(BlePayloadCompiler().flags().local_name("MOB-1443").compile().data)
+    reports, consumed = parse_scan_reports(report(beacon) + report(name + beacon) + report(other) + report(b"\x00" + beacon[:-1]), 0.0)
+    assert reports["ibeacon"].tolist() == [True, True, False, False]
+    assert reports["minor"].tolist() == [9, 9, 0, 0]
+
+
+def test_keeps_an_incomplete_report(parse_path):
+    data = report(ibeacon_adv_data(list(UUID), 1, 2)) * 2
+    reports, consumed = parse_scan_reports(data[:-3], 0.0)
+    assert len(reports) == 1
+    assert consumed == len(data) // 2
+
+
+def test_start_and_stop_scanning(params, dongles):
+    dongle = dongles()
+    scanner = BleScanner(dongle, params, interval=100, window=50)
+    scanner.start()
+    assert dongle.scanning
+    assert dongle.scan_parameters == (160, 80, 0)
+    scanner.stop()
+    assert not dongle.scanning
+
+
+def test_poll_feeds_the_rssi_window(params, dongles):
+    dongle = dongles()
+    scanner = BleScanner(dongle, params)
+    scanner.start()
+    data = ibeacon_adv_data(list(UUID), 1, 2)
+    for rssi in (-40, -50, -60):
+        dongle.emit_scan_response(bytes(6), rssi, data)
+    reports = 0
+    for _ in range(10):
+        reports += len(scanner.poll(0.1))
+        if reports == 3:
+            break
+    stats = scanner.rssi.stats()
+    assert stats["count"].tolist() == [3]
+    assert stats["rssi_mean"].tolist() == [-50.0]
@@ -0,0 +1,91 @@
+import pytest
+
+from ble.stack import BleStack
+from ble.advertiser import MODE_BROADCAST
+from ble.scanreq import scan_requests, read_scan_request, format_address, BleScanRequestTracker, BleScanRequestLog
+
+PHONE = bytes([0x66, 0x55, 0x44, 0x33, 0x22, 0x11])
+WATCH = bytes([0x01, 0x02, 0x03, 0x04, 0x05, 0x06])
+
+
+def test_format_address():
+    assert format_address(PHONE) == "11:22:33:44:55:66"
+
+
+def test_scan_requests_skip_other_events(advertiser):
+    advertiser.start()
+    dongle = advertiser.serial
+    dongle.emit_scan_request(PHONE, -40, address_type=1)
+    dongle.emit_scan_response(WATCH, -70, b"\x02\x01\x06")
+    dongle.emit_event(3, 4, b"\x00\x16\x02")
+    dongle.emit_scan_request(WATCH, -65)
+
+    assert list(scan_requests(advertiser.reader, 0.1)) == [(PHONE, 1, -40), (WATCH, 0, -65)]
+
+
+def test_scan_requests_include_queued_events(advertiser):
+    advertiser.start()
+    dongle = advertiser.serial
+    # Received while the reader waits for a response
+    dongle.emit_scan_request(PHONE, -41)
+    BleStack.ble_cmd_gap_set_mode(dongle, *MODE_BROADCAST)
+    assert advertiser.reader.read_response(6, 1) == 0
+    assert len(advertiser.reader.events) == 1
+
+    dongle.emit_scan_request(WATCH, -60)
+    assert list(scan_requests(advertiser.reader, 0.1)) == [(PHONE, 0, -41), (WATCH, 0, -60)]
+    assert not advertiser.reader.events
+
+
+def test_read_scan_request_counts_events(advertiser):
+    dongle = advertiser.serial
+    dongle.emit_scan_response(WATCH, -70, b"")
+    dongle.emit_scan_request(PHONE, -40)
+    assert read_scan_request(advertiser.reader) is None
+    assert read_scan_request(advertiser.reader) == (PHONE, 0, -40)
+    assert advertiser.metrics.events == 2
+
+
+def test_tracker_reports_once_per_window():
+    reports = []
+    tracker = BleScanRequestTracker(window=10, callback=lambda address, address_type, rssi, device: reports.append((address, rssi)))
+    assert tracker.add(PHONE, 0, -40, now=0)
+    assert not tracker.add(PHONE, 0, -50, now=5)
+    assert tracker.add(WATCH, 0, -70, now=6)
+    assert not tracker.add(PHONE, 0, -30, now=9.9)
+    assert tracker.add(PHONE, 0, -40, now=10)
+
+    assert reports == [(PHONE, -40), (WATCH, -70), (PHONE, -40)]
+    assert tracker.requests == 5
+    devices = dict((address, rest) for address, *rest in tracker.devices())
+    count, average, minimum, maximum = devices[PHONE]
+    assert (count, minimum, maximum) == (4, -50, -30)
+    assert average == pytest.approx(-39.68)
+
+
+def test_tracker_rssi_average():
+    tracker = BleScanRequestTracker(smoothing=0.5)
+    tracker.consume([(PHONE, 0, -40), (PHONE, 0, -60), (PHONE, 0, -60)])
+    (address, count, average, minimum, maximum), = tracker.devices()
+    assert (count, average, minimum, maximum) == (3, -55.0, -60, -40)
+
+
+def test_tracker_forgets_least_recently_seen():
+    tracker = BleScanRequestTracker(max_devices=2)
+    for index, address in enumerate((PHONE, WATCH, PHONE, bytes(6))):
+        tracker.add(address, 0, -50, now=index)
+    assert len(tracker) == 2
+    assert tracker.evicted == 1
+    assert [address for address, *rest in tracker.devices()] == [PHONE, bytes(6)]
+
+
+def test_scan_request_log(tmp_path):
+    path = tmp_path / "scanreq.csv"
+    log = BleScanRequestLog(path)
+    tracker = BleScanRequestTracker(window=10, callback=log)
+    tracker.consume([(PHONE, 0, -40), (PHONE, 0, -42), (WATCH, 0, -70)])
+    log.close()
+    lines = [line.split(",") for line in path.read_text().splitlines()]
+    assert [line[1:] for line in lines] == [["11:22:33:44:55:66", "-40", "1", "-40.0"],
+                                            ["06:05:04:03:02:01", "-70", "1", "-70.0"]]
+    float(lines[0][0])
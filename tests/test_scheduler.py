@@ -0,0 +1,76 @@
+import pytest
+
+from ble.advertiser import MODE_BROADCAST
+from ble.scheduler import BleScheduler
+from ble.dutycycle import BleDutyCycle
+from ble.optionparser import BleParsedArgs
+
+
+def run_until(scheduler, clock, deadline):
+    """Run the edges due up to deadline, then stop the clock there."""
+    scheduler.at(deadline, scheduler.stop)
+    scheduler.run()
+    clock.now = deadline
+
+
+def test_edges_follow_the_schedule(clock):
+    scheduler = BleScheduler()
+    edges = []
+    scheduler.every(10, lambda: edges.append(("start", clock())), 3, lambda: edges.append(("stop", clock())))
+    run_until(scheduler, clock, 25)
+    assert edges == [("start", 0), ("stop", 3), ("start", 10), ("stop", 13), ("start", 20), ("stop", 23)]
+
+
+def test_overrunning_callback_skips_missed_cycles(clock):
+    scheduler = BleScheduler()
+    starts = []
+
+    def start():
+        starts.append(clock())
+        if len(starts) == 1:
+            clock.now += 25
+    schedule = scheduler.every(10, start)
+    run_until(scheduler, clock, 45)
+    # The start due at 10 runs late, the one at 20 is skipped and the next
+    # ones stay on the grid
+    assert starts == [0, 25, 30, 40]
+    assert schedule.missed == 1
+
+
+def test_cancel_drops_pending_edges(clock):
+    scheduler = BleScheduler()
+    edges = []
+    schedule = scheduler.every(10, lambda: edges.append("start"), 3, lambda: edges.append("stop"))
+    scheduler.at(1, schedule.cancel)
+    run_until(scheduler, clock, 30)
+    assert edges == ["start"]
+
+
+def test_duration_must_be_shorter_than_the_period(clock):
+    with pytest.raises(ValueError):
+        BleScheduler().every(10, lambda: None, 10, lambda: None)
+
+
+def test_whole_period_duty_cycle_never_stops(advertiser, clock):
+    advertiser.params.duration = advertiser.params.period = 10
+    duty_cycle = BleDutyCycle(advertiser, BleScheduler(), quiet=True)
+    duty_cycle.begin()
+    run_until(duty_cycle.scheduler, clock, 5)
+    commands = sum(advertiser.serial.commands.values())
+    run_until(duty_cycle.scheduler, clock, 35)
+    assert duty_cycle.advertising
+    assert duty_cycle.schedule.cycles == 4
+    assert advertiser.serial.mode == MODE_BROADCAST
+    # Later starts find the dongle advertising already, nothing is sent
+    assert sum(advertiser.serial.commands.values()) == commands
+
+
+@pytest.mark.parametrize("duration, period", [(300, 300), (0, 300), (45, 360)])
+def test_parse_duty_cycle_accepts(duration, period):
+    assert BleParsedArgs.parseDutyCycle(duration, period) == (duration, period)
+
+
+@pytest.mark.parametrize("duration, period", [(301, 300), (-1, 300), (0, 0)])
+def test_parse_duty_cycle_rejects(duration, period):
+    with pytest.raises(ValueError):
+        BleParsedArgs.parseDutyCycle(duration, period)
@@ -0,0 +1,42 @@
+import struct
+
+import pytest
+
+from ble.stack import BleStack, ADV_DATA_FRAME_SIZE
+
+ADV_DATA = [0x02, 0x01, 0x06, 0x1a, 0xff, 0x4c, 0x00, 0x02, 0x15] + list(range(16)) + [0x00, 0x01, 0x00, 0x01, 0xC6]
+
+
+class Port(object):
+    def __init__(self):
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(data)
+
+
+def legacy_frame(set_scanrsp, adv_data):
+    return struct.pack('<4BBB%ds' % len(adv_data), 0, 2 + len(adv_data), 6, 9, set_scanrsp, len(adv_data), bytes(adv_data))
+
+
+@pytest.mark.parametrize("adv_data", [ADV_DATA, bytes(ADV_DATA), b"", bytes(31)])
+def test_gap_set_adv_data_matches_the_legacy_encoding(adv_data):
+    port = Port()
+    BleStack.ble_cmd_gap_set_adv_data(port, 1, adv_data)
+    BleStack.ble_cmd_gap_set_adv_data(port, 1, adv_data, bytearray(ADV_DATA_FRAME_SIZE))
+    assert [bytes(frame) for frame in port.frames] == [legacy_frame(1, adv_data)] * 2
+
+
+def test_frames_written_are_not_shared():
+    port = Port()
+    frame = bytearray(ADV_DATA_FRAME_SIZE)
+    for minor in (1, 2):
+        BleStack.ble_cmd_gap_set_adv_data(port, 0, ADV_DATA[:-2] + [minor, 0xC6])
+        BleStack.ble_cmd_gap_set_adv_data(port, 0, ADV_DATA[:-2] + [minor, 0xC6], frame)
+    assert [frame[-2] for frame in port.frames] == [1, 1, 2, 2]
+
+
+def test_gap_set_adv_data_too_long():
+    for frame in (None, bytearray(ADV_DATA_FRAME_SIZE)):
+        with pytest.raises(ValueError):
+            BleStack.ble_cmd_gap_set_adv_data(Port(), 0, bytes(32), frame)
@@ -0,0 +1,54 @@
+import asyncio
+
+from ble.batch import BleBatchError
+from ble.stack import BleStack
+from ble.metrics import BleMetrics
+from ble.transport import BleAsyncTransport
+
+
+def test_late_response_does_not_fail_pending_commands(dongles):
+    dongle = dongles()
+    dongle.latency = {"gap_set_adv_parameters": 0.1}
+
+    async def run():
+        transport = BleAsyncTransport(dongle, timeout=1, metrics=BleMetrics(port="simulated"))
+        batch = transport.batch()
+        BleStack.ble_cmd_gap_set_adv_parameters(batch, 0x20, 0x40, 7)
+        task = asyncio.ensure_future(batch.execute())
+        await asyncio.sleep(0)
+        # Flushed before its answer: the set_adv_parameters response comes late
+        transport.flush()
+        task.cancel()
+
+        BleStack.ble_cmd_gap_set_mode(transport, 0, 0)
+        set_mode = transport.last_response
+        BleStack.ble_cmd_gap_end_procedure(transport)
+        results = await asyncio.gather(set_mode, transport.last_response)
+        transport.close()
+        return results, transport.metrics
+    results, metrics = asyncio.run(run())
+
+    assert results == [0, 0x0181]
+    assert metrics.unmatched_responses == {(6, 8): 1}
+    assert not metrics.timeouts
+
+
+def test_skipped_response_fails_only_earlier_commands(dongles):
+    dongle = dongles()
+    dongle.inject("gap_set_mode")
+
+    async def run():
+        transport = BleAsyncTransport(dongle, timeout=1, metrics=BleMetrics(port="simulated"))
+        BleStack.ble_cmd_gap_set_mode(transport, 0, 0)
+        set_mode = transport.last_response
+        BleStack.ble_cmd_gap_end_procedure(transport)
+        results = await asyncio.gather(set_mode, transport.last_response, return_exceptions=True)
+        transport.close()
+        return results, transport.metrics
+    (set_mode, end_procedure), metrics = asyncio.run(run())
+
+    # Responses come in command order: the unanswered set_mode fails at once
+    assert isinstance(set_mode, BleBatchError) and set_mode.result is None
+    assert end_procedure == 0x0181
+    assert metrics.timeouts == {(6, 1): 1}
+    assert not metrics.unmatched_responses